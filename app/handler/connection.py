@@ -0,0 +1,277 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, List, Optional, Tuple, cast
+
+from app.processor.resp_coder import RespParser, RespProtocolError
+
+# bytes buffered ahead of a pulling reader or a suspended dispatcher before
+# the socket stops being read
+READ_BUFFER_LIMIT: int = 256 * 1024
+
+Dispatcher = Callable[["Connection"], Coroutine[Any, Any, None]]
+
+EAGER_TASKS: bool = hasattr(asyncio, "eager_task_factory")
+
+
+def start_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """## Run `coro` as a task, started right away where the loop supports it
+
+    From 3.12 an eager task runs up to its first suspension before this
+    returns, so a burst of commands that never wait is answered from the
+    protocol callback itself, with no trip through the event loop. Older
+    versions schedule the task as usual.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    if EAGER_TASKS:
+        return asyncio.eager_task_factory(loop, coro)  # type: ignore[attr-defined]
+    return loop.create_task(coro)
+
+
+class Connection(asyncio.Protocol):
+    """A connection driven by protocol callbacks instead of streams.
+
+    Once a dispatcher is set, every chunk received goes straight into the
+    RESP parser and the decoded requests are queued for the dispatcher,
+    which takes them with `next_request`. It runs as a task, started
+    eagerly where the loop allows, so a burst of commands that never
+    suspend is answered inside `data_received` itself, replies going to the
+    transport without awaiting. While a dispatcher is suspended, requests
+    arriving meanwhile queue up behind it, and past `READ_BUFFER_LIMIT` of
+    them the socket stops being read. Whatever is still queued when it
+    returns gets a new dispatcher.
+
+    Before that, `readline`, `readuntil`, `read` and `readexactly` pull
+    from a buffer, which is what the replica's handshake needs. `write`,
+    `drain`, `transport`, `get_extra_info`, `close` and `wait_closed`
+    behave as on a `StreamWriter`, so a connection can be handed to code
+    written against one, like a replica link.
+    """
+
+    def __init__(
+        self,
+        dispatch: Optional[Dispatcher] = None,
+        write_high_water: Optional[int] = None,
+    ) -> None:
+        self.transport: Optional[asyncio.Transport] = None
+        self.parser = RespParser()
+        # requests decoded but not executed yet, in arrival order
+        self.pending: Deque[Tuple[List[bytes], int]] = deque()
+        # wire size of everything on `pending`
+        self._pending_bytes: int = 0
+        # resolved once the connection is gone
+        self.closed: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._dispatch: Optional[Dispatcher] = dispatch
+        self._dispatching: bool = False
+        # the running dispatcher; the loop only keeps weak references to tasks
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self._write_high_water: Optional[int] = write_high_water
+        self._write_paused: bool = False
+        self._drain_waiters: Deque[asyncio.Future] = deque()
+        self._buffer = bytearray()
+        self._eof: bool = False
+        self._read_paused: bool = False
+        self._read_waiter: Optional[asyncio.Future] = None
+        # error reply owed for malformed input, sent once `pending` is served
+        self._protocol_error: Optional[bytes] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        # uvloop's transports don't subclass asyncio's
+        self.transport = cast(asyncio.Transport, transport)
+        if self._write_high_water is not None:
+            # drain() only suspends once the transport buffers more than this
+            self.transport.set_write_buffer_limits(high=self._write_high_water)
+
+    def data_received(self, data: bytes) -> None:
+        if self._dispatch is None:
+            self._buffer += data
+            if len(self._buffer) > READ_BUFFER_LIMIT and self._read_waiter is None:
+                self._pause_reading()
+            self._wake_reader()
+            return
+        self._feed(data)
+        self._run_dispatch()
+        if self._dispatching and self._pending_bytes > READ_BUFFER_LIMIT:
+            self._pause_reading()
+
+    def eof_received(self) -> Optional[bool]:
+        self._eof = True
+        self._wake_reader()
+        # let the transport close itself
+        return None
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._eof = True
+        self._wake_reader()
+        if not self.closed.done():
+            self.closed.set_result(None)
+        while self._drain_waiters:
+            waiter: asyncio.Future = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("Connection lost"))
+
+    def start_dispatch(self, dispatch: Dispatcher, head: bytes = b"") -> None:
+        """## Stop pulling reads and push everything from now on to `dispatch`
+
+        ### Args:
+            - `dispatch (Dispatcher)`: runs the queued requests, taken with `next_request`
+            - `head (bytes)`: data the caller pulled past, it is dispatched first
+        """
+        self._dispatch = dispatch
+        if head or self._buffer:
+            self._feed(head + bytes(self._buffer))
+            self._buffer.clear()
+        if self._read_paused and self.transport is not None:
+            self._read_paused = False
+            self.transport.resume_reading()
+        self._run_dispatch()
+
+    def next_request(self) -> Tuple[List[bytes], int]:
+        """## Take the oldest queued request, with its size on the wire"""
+        request, size = self.pending.popleft()
+        self._pending_bytes -= size
+        return request, size
+
+    def _queue(self, requests: List[Tuple[List[bytes], int]]) -> None:
+        self.pending.extend(requests)
+        self._pending_bytes += sum(size for _, size in requests)
+
+    def _feed(self, data: bytes) -> None:
+        if self._protocol_error is not None:
+            return
+        try:
+            self._queue(self.parser.feed(data))
+        except RespProtocolError as e:
+            # serve what came before, then reply with the error and hang up
+            self._queue(e.commands)
+            self._protocol_error = b"-ERR %s\r\n" % str(e).encode()
+            self._pause_reading()
+
+    def _run_dispatch(self) -> None:
+        if self._dispatching:
+            return
+        if not self.pending:
+            if self._protocol_error is not None and not self.is_closing():
+                self.write(self._protocol_error)
+                self.close()
+            return
+        self._dispatching = True
+        self._dispatch_task = start_task(self._dispatch_pending())
+
+    async def _dispatch_pending(self) -> None:
+        assert self._dispatch
+        try:
+            await self._dispatch(self)
+        finally:
+            self._dispatching = False
+            self._dispatch_task = None
+        if self.pending or self._protocol_error is not None:
+            # requests that arrived while the dispatcher was suspended past
+            # its last look at `pending`, or the error reply, are still owed
+            if not self.is_closing():
+                self._run_dispatch()
+        if (
+            self._read_paused
+            and self.transport is not None
+            and self._protocol_error is None
+            and not (self._dispatching and self._pending_bytes > READ_BUFFER_LIMIT)
+        ):
+            self._read_paused = False
+            self.transport.resume_reading()
+
+    # -- pulling reads, before a dispatcher is set --
+
+    def _pause_reading(self) -> None:
+        if not self._read_paused and self.transport is not None:
+            self._read_paused = True
+            self.transport.pause_reading()
+
+    def _wake_reader(self) -> None:
+        if self._read_waiter is not None and not self._read_waiter.done():
+            self._read_waiter.set_result(None)
+
+    async def _wait_for_data(self) -> None:
+        if self._read_paused and self.transport is not None:
+            self._read_paused = False
+            self.transport.resume_reading()
+        self._read_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._read_waiter
+        finally:
+            self._read_waiter = None
+
+    def _consume(self, size: int) -> bytes:
+        data: bytes = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def readuntil(self, separator: bytes = b"\n") -> bytes:
+        search_from: int = 0
+        while (end := self._buffer.find(separator, search_from)) == -1:
+            if self._eof:
+                raise asyncio.IncompleteReadError(
+                    self._consume(len(self._buffer)), None
+                )
+            # the separator may straddle two reads
+            search_from = max(0, len(self._buffer) - len(separator) + 1)
+            await self._wait_for_data()
+        return self._consume(end + len(separator))
+
+    async def readline(self) -> bytes:
+        try:
+            return await self.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    async def read(self, size: int) -> bytes:
+        while not self._buffer and not self._eof:
+            await self._wait_for_data()
+        return self._consume(size)
+
+    async def readexactly(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            if self._eof:
+                raise asyncio.IncompleteReadError(
+                    self._consume(len(self._buffer)), size
+                )
+            await self._wait_for_data()
+        return self._consume(size)
+
+    # -- the StreamWriter side --
+
+    def pause_writing(self) -> None:
+        self._write_paused = True
+
+    def resume_writing(self) -> None:
+        self._write_paused = False
+        while self._drain_waiters:
+            waiter: asyncio.Future = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def write(self, data: bytes) -> None:
+        assert self.transport
+        self.transport.write(data)
+
+    async def drain(self) -> None:
+        """## Wait until the transport is back under its high water mark"""
+        if self.closed.done():
+            raise ConnectionResetError("Connection lost")
+        if not self._write_paused:
+            return
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        assert self.transport
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self.transport is None or self.transport.is_closing()
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self) -> None:
+        await asyncio.shield(self.closed)
@@ -1,5 +1,7 @@
 import asyncio
+import logging
 from dataclasses import dataclass
+from logging.handlers import QueueListener
 import socket
 from typing import Any, List, Optional
 
@@ -11,6 +13,8 @@ from app.handler.master_sync_handelr import (
 )
 from app.handler.redis_handler import RedisServer
 from app.handler.server_conf import ServerInfo
+from app.handler.server_log import setup_logging
+from app.handler.workers import Workers
 from app.processor.command import Command, CommandProcessor
 
 REPLICAS: List = []
@@ -75,10 +79,16 @@ async def init_as_slave_with_handshake(server_args: ServerInfo) -> None:
         await psync_master(reader, writer)
 
 
-async def start_redis_server(config: ServerInfo) -> None:
-    server = RedisServer(config)
-    print(f"Server is starting on :{config.port}")
-    await server.start()
+async def start_redis_server(
+    config: ServerInfo, workers: Optional[Workers] = None
+) -> None:
+    listener: QueueListener = setup_logging(config.loglevel, config.logfile)
+    server = RedisServer(config, workers)
+    logging.info("Server is starting on :%d", config.port)
+    try:
+        await server.start()
+    finally:
+        listener.stop()
 
 
 async def main_with_event_loop(server_args: ServerInfo) -> None:
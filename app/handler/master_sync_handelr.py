@@ -1,7 +1,8 @@
 import asyncio
-from typing import Optional
+import logging
+from typing import List, Optional
 
-from app.processor.resp_coder import PING_REQUEST_BYTES
+from app.processor.resp_coder import PING_REQUEST_BYTES, RespCoder
 
 
 async def get_master_connection(
@@ -11,16 +12,28 @@ async def get_master_connection(
         reader, writer = await asyncio.open_connection(master_address, master_port)
         return reader, writer
     except ConnectionError as e:
-        print(f"Error connecting to master server: {e}")
+        logging.error("Error connecting to master server: %s", e)
         return None
 
 
-async def psync_master(reader, writer):
-    psync = b"*3\r\n$5\r\nPSYNC\r\n$1\r\n?\r\n$2\r\n-1\r\n"
+async def psync_master(
+    reader, writer, replid: Optional[str] = None, offset: int = 0
+) -> List[str]:
+    """## Ask to resume right after `offset`, or for a full sync without `replid`
+
+    ### Returns:
+        - `List[str]`: words of the reply, `FULLRESYNC <replid> <offset>` or `CONTINUE [<replid>]`
+    """
+    psync: bytes = (
+        RespCoder.encode(["PSYNC", replid, str(offset + 1)])
+        if replid
+        else b"*3\r\n$5\r\nPSYNC\r\n$1\r\n?\r\n$2\r\n-1\r\n"
+    )
     writer.write(psync)
     await writer.drain()
     master_response: bytes = await reader.readline()
-    print(f"Received response: {master_response.decode()}")
+    logging.info("Master replied: %r", master_response)
+    return master_response.decode().strip().lstrip("+").split()
 
 
 async def replconf_master(reader, writer, count, port: int):
@@ -32,7 +45,7 @@ async def replconf_master(reader, writer, count, port: int):
     writer.write(replconf)
     await writer.drain()
     master_response: bytes = await reader.readline()
-    print(f"Received response: {master_response.decode()}")
+    logging.info("Master replied: %r", master_response)
 
 
 async def ping_master(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
@@ -40,4 +53,4 @@ async def ping_master(reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     writer.write(ping)
     await writer.drain()
     master_response: bytes = await reader.readline()
-    print(f"Received response: {master_response.decode()}")
+    logging.info("Master replied: %r", master_response)
@@ -1,170 +1,577 @@
 import asyncio
 import logging
-from typing import Optional
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, List, Optional, Tuple, TypeVar
 
+from app.handler.connection import Connection
 from app.handler.master_sync_handelr import ping_master, psync_master, replconf_master
 from app.handler.server_conf import ServerInfo, ServerRole
-from app.processor.command import Command, CommandProcessor
-from app.processor.resp_coder import RespCoder, parse_input_array_bytes
+from app.handler.server_log import VERBOSE, request_log
+from app.handler.workers import (
+    CROSS_WORKER_ERROR,
+    CrossWorkerError,
+    Workers,
+    keyspace_worker_error,
+)
+from app.processor.command import (
+    Asking,
+    Command,
+    CommandFlag,
+    CommandProcessor,
+    Psync,
+    Replconf,
+    Wait,
+    command_flags,
+    command_keys,
+    fold_command_stats,
+)
+from app.processor.append_only_file import aof
+from app.processor.cluster import cluster
+from app.processor.rdb_file_processor import RDBError, RDBFileProcessor, load_rdb
+from app.processor.rdb_saver import rdb_saver
+from app.processor.replication import MasterLinkState, replication
+from app.processor.replication_backlog import repl_backlog
+from app.processor.resp_coder import EMPTY_BYTE, RespCoder
+from app.storage.storage import kvPair
 
-logging.basicConfig(level=logging.INFO)
+CHUNK_SIZE: int = 64 * 1024
+# forwards a pipeline may have in flight before their replies are collected
+FORWARD_BATCH_SIZE: int = 1024
+SERVER_CRON_HZ: int = 10
 
-CHUNK_SIZE: int = 1024
+T = TypeVar("T")
+
+
+@dataclass
+class ClientState:
+    """Bookkeeping that outlives a single request on a connection."""
+
+    # replication offset right after the client's last write, what WAIT waits for
+    last_write_offset: int = 0
+    # AOF offset right after the client's last write, what its replies wait for
+    aof_offset: int = 0
+    # set when the connection is a replica announcing its port
+    listening_port: Optional[int] = None
+    # ASKING was sent, the next command may run in an importing slot
+    asking: bool = False
+
+
+class ClientConnection(Connection):
+    """A client of this server; its requests are served by `RedisServer.serve_pending`."""
+
+    def __init__(self, server: "RedisServer") -> None:
+        super().__init__(server.serve_pending, server.config.output_buffer_high_water)
+        self.role = server.role
+        self.client = ClientState()
+        # replies not handed to the transport yet
+        self.output_buffer = bytearray()
+        # requests sent to other workers, with where their reply goes in
+        # `output_buffer`
+        self.forwarded: List[Tuple[int, asyncio.Future]] = []
+        self.addr = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        super().connection_made(transport)
+        self.addr = self.get_extra_info("peername")
+        logging.log(VERBOSE, "%s:Accepted %s", self.role, self.addr)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        super().connection_lost(exc)
+        if replication.detach(self):
+            logging.info("%s:Replica %s lost", self.role, self.addr)
+        logging.log(VERBOSE, "%s:Client %s closed", self.role, self.addr)
 
 
 class RedisServer:
-    def __init__(self, config: ServerInfo):
+    READONLY_ERROR: bytes = (
+        b"-READONLY You can't write against a read only replica.\r\n"
+    )
+
+    def __init__(self, config: ServerInfo, workers: Optional[Workers] = None):
         self.config: ServerInfo = config
+        # set when running as one of several `--workers` processes
+        self.workers: Optional[Workers] = workers
         self.master_link = None
         self.role = config.role
         if config.role == ServerRole.SLAVE:
             self.master_link = RedisReplica(config)
 
+    def load_rdb_file(self) -> None:
+        rdb_file: str = os.path.join(self.config.dir, self.config.dbfilename)
+        kvPair.rdb_file = rdb_file
+        if not os.path.exists(rdb_file):
+            return
+        stats = RDBFileProcessor(rdb_file, self.config.rdbchecksum).load(kvPair)
+        logging.info(
+            "%s:DB loaded from disk: %d keys, %d bytes in %.3f ms",
+            self.role,
+            stats.rdb_last_load_keys_loaded,
+            stats.rdb_last_load_bytes_read,
+            stats.rdb_last_load_time_ms,
+        )
+
+    async def load_append_only_file(self) -> None:
+        started: float = time.perf_counter()
+        offset: int = aof.load_preamble()
+        replayed: int = 0
+        aof.loading = True
+        try:
+            for request in aof.iter_commands(offset):
+                req_command: Optional[CommandProcessor] = CommandProcessor.get_command(
+                    request, self.config
+                )
+                if req_command:
+                    await req_command.call()
+                    replayed += 1
+        finally:
+            aof.loading = False
+        # replayed writes are already on disk, they mustn't trigger a save
+        kvPair.dirty = 0
+        logging.info(
+            "%s:DB loaded from append only file: %d commands in %.3f ms",
+            self.role,
+            replayed,
+            (time.perf_counter() - started) * 1000,
+        )
+
+    async def load_data(self) -> None:
+        rdb_file: str = os.path.join(self.config.dir, self.config.dbfilename)
+        aof_file: str = os.path.join(self.config.dir, self.config.appendfilename)
+        rdb_saver.configure(rdb_file, self.config.save_params, self.config.rdbchecksum)
+        repl_backlog.configure(self.config.repl_backlog_size)
+        replication.configure(self.config)
+        cluster.configure(self.config)
+        aof.configure(
+            self.config.appendonly,
+            aof_file,
+            self.config.appendfsync,
+            self.config.rdbchecksum,
+        )
+        if not self.config.appendonly:
+            self.load_rdb_file()
+            return
+        # with AOF on, the log is the authoritative copy of the dataset
+        if os.path.exists(aof_file):
+            await self.load_append_only_file()
+            aof.open()
+        else:
+            self.load_rdb_file()
+            aof.open()
+            aof.bgrewrite()
+
+    async def server_cron(self) -> None:
+        while True:
+            await asyncio.sleep(1 / SERVER_CRON_HZ)
+            kvPair.active_expire_cycle(self.config.active_expire_cycle_ms)
+            rdb_saver.cron()
+            aof.cron()
+            replication.cron()
+            cluster.cron()
+            fold_command_stats()
+
     async def start(self):
+        await self.load_data()
+        asyncio.create_task(self.server_cron())
         if self.config.role == ServerRole.SLAVE:
             # await self.master_link.handshake()  # type: ignore
             # Now move to a separate task instead of sequential events
             asyncio.create_task(self.master_link.handshake())  # type: ignore
 
-        server: asyncio.Server = await asyncio.start_server(
-            self.handle_client, "localhost", self.config.port
+        if self.workers is not None:
+            await self.workers.start(self.execute_forwarded)
+        server: asyncio.Server = await asyncio.get_running_loop().create_server(
+            lambda: ClientConnection(self),
+            "localhost",
+            self.config.port,
+            # every worker binds the port, the kernel spreads connections
+            reuse_port=self.workers is not None,
         )
         async with server:
             await server.serve_forever()
 
-    async def handle_client(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
-    ) -> None:
-        addr = writer.get_extra_info("peername")
-        logging.info(f"{self.role}:Request send to {addr}")
+    async def serve_pending(self, conn: ClientConnection) -> None:
+        """## Run what the client sent, then answer it all in one write
 
+        Called as soon as a read decodes into requests; until it returns,
+        further reads only queue up on `conn.pending`.
+        """
         try:
-            while requestobj := await reader.read(CHUNK_SIZE):
-                # async for request in self.readlines(reader):
-                if not requestobj:
-                    break
-                for request_str, offset in parse_input_array_bytes(requestobj):
-                    await self.process_request(reader, writer, request_str)
+            while conn.pending and not conn.is_closing():
+                request_str, _ = conn.next_request()
+                await self.process_request(conn, request_str)
+                if (
+                    len(conn.output_buffer) >= self.config.output_buffer_high_water
+                    or len(conn.forwarded) >= FORWARD_BATCH_SIZE
+                ):
+                    await self.flush(conn)
+            # one write for every reply decoded from this read
+            await self.flush(conn)
         except ConnectionResetError:
-            logging.error(f"{self.role}:Connection reset by peer: {addr}")
+            logging.log(
+                VERBOSE, "%s:Connection reset by peer: %s", self.role, conn.addr
+            )
+            conn.close()
         except Exception as e:
-            logging.error(f"{self.role}:Error handling client {addr}: {e}")
+            logging.error("%s:Error handling client %s: %s", self.role, conn.addr, e)
+            conn.close()
+
+    async def flush(self, conn: ClientConnection) -> None:
+        if conn.forwarded:
+            await self.collect_forwarded(conn)
+        if conn.output_buffer and not conn.is_closing():
+            # replies to writes only leave once the AOF policy is satisfied
+            await aof.commit(conn.client.aof_offset)
+            conn.write(bytes(conn.output_buffer))
+            conn.output_buffer.clear()
+            await conn.drain()
+
+    async def collect_forwarded(self, conn: ClientConnection) -> None:
+        """## Wait for every forwarded reply and splice each in where it belongs
+
+        The forwards of a pipeline all left before this, so the batch costs
+        one round trip to the other workers rather than one per request.
+        """
+        forwarded: List[Tuple[int, asyncio.Future]] = conn.forwarded
+        conn.forwarded = []
+        try:
+            replies: List[bytes] = await asyncio.gather(
+                *(future for _, future in forwarded)
+            )
+        except BaseException:
+            for _, future in forwarded:
+                future.cancel()
+            raise
+        output_buffer: bytearray = conn.output_buffer
+        merged = bytearray()
+        start: int = 0
+        for (position, _), reply in zip(forwarded, replies):
+            merged += output_buffer[start:position]
+            merged += reply
+            start = position
+        merged += output_buffer[start:]
+        # process_request holds on to the buffer, so refill it in place
+        output_buffer[:] = merged
+
+    async def call_blocking(self, command: Awaitable[T], conn: ClientConnection) -> T:
+        """## Run a blocking command while still watching the connection
+
+        Requests arriving meanwhile are queued behind it, and if the client
+        goes away the command is cancelled so it releases what it waits on.
+
+        ### Args:
+            - `command (Awaitable)`: the command's call, or its forward to another worker
+        """
+        call: asyncio.Future = asyncio.ensure_future(command)
+        try:
+            await asyncio.wait({call, conn.closed}, return_when=asyncio.FIRST_COMPLETED)
+            if not call.done():
+                raise ConnectionResetError("client disconnected while blocked")
+            return call.result()
         finally:
-            writer.close()
-            await writer.wait_closed()
-            logging.info("{self.role}:Connection closed")
+            call.cancel()
 
-    async def process_request(self, reader, writer, request_str):
-        request = RespCoder.encode(request_str).encode()
-        print(f"Request is {request}")
+    async def process_request(
+        self, conn: ClientConnection, request_str: List[bytes]
+    ) -> None:
+        output_buffer: bytearray = conn.output_buffer
+        client: ClientState = conn.client
+        if request_log.enabled:
+            request_log.record(f"{self.role}:Request", request_str)
+        if self.workers is not None:
+            try:
+                owner: Optional[int] = self.workers.owner_of(request_str)
+            except CrossWorkerError:
+                output_buffer += CROSS_WORKER_ERROR
+                return
+            if owner is not None:
+                forward: asyncio.Future = self.workers.forward(owner, request_str)
+                if CommandFlag.BLOCKING in command_flags(request_str):
+                    await self.flush(conn)
+                    output_buffer += await self.call_blocking(forward, conn)
+                else:
+                    # the rest of the pipeline goes on, the reply is collected
+                    # when the output is flushed
+                    conn.forwarded.append((len(output_buffer), forward))
+                return
         req_command: Optional[CommandProcessor] = CommandProcessor.get_command(
-            request, self.config
+            request_str, self.config
         )
         if req_command:
-            response, followup = await req_command.response()
-            logging.info(f"{self.role}:Sending response: {response}")
-            writer.write(response)
-            await writer.drain()
+            if cluster.enabled:
+                asking: bool = client.asking or CommandFlag.ASKING in req_command.flags
+                client.asking = isinstance(req_command, Asking)
+                redirect: Optional[bytes] = cluster.route(
+                    command_keys(request_str), asking
+                )
+                if redirect is not None:
+                    req_command.reject()
+                    output_buffer += redirect
+                    return
+            if self.workers is not None and CommandFlag.KEYSPACE in req_command.flags:
+                req_command.reject()
+                output_buffer += keyspace_worker_error(request_str[0])
+                return
+            if (
+                self.config.role == ServerRole.SLAVE
+                and CommandFlag.WRITE in req_command.flags
+            ):
+                # the dataset only changes through the master's stream
+                req_command.reject()
+                output_buffer += self.READONLY_ERROR
+                return
+            if isinstance(req_command, Wait):
+                req_command.target_offset = client.last_write_offset
+            if CommandFlag.BLOCKING in req_command.flags:
+                # don't hold earlier replies back while this one waits
+                await self.flush(conn)
+                response, followup = await self.call_blocking(req_command.call(), conn)
+            else:
+                response, followup = await req_command.call()
+            if CommandFlag.WRITE in req_command.flags:
+                client.last_write_offset = self.config.master_repl_offset
+                client.aof_offset = aof.fed_offset
+            output_buffer += response
+            diskless_sync = (
+                req_command.diskless_sync if isinstance(req_command, Psync) else None
+            )
             if followup:
-                writer.write(followup)
+                output_buffer += followup
+                # the connection may be registered as a replica right after
+                # this, so the snapshot must hit the socket before propagation
+                if diskless_sync is None:
+                    await self.flush(conn)
 
             if self.config.role == ServerRole.MASTER:
                 if (
-                    req_command.command == Command.REPLCONF
-                    and "listening-port" in req_command.message
+                    isinstance(req_command, Psync)
+                    and req_command.sync_offset is not None
                 ):
-                    self.config.replicas.append((reader, writer))
-                if req_command.command == Command.SET:
-                    print("sending replica request...")
-                    await self.propagate_to_replicas(request)
-
-    async def propagate_to_replicas(self, request):
-        print(f"Replicas are: {len(self.config.replicas)} ")
-        for _, replica_writer in self.config.replicas:
-            try:
-                print("{self.role}:writing to replica...")
-                replica_writer.write(request)
-                await replica_writer.drain()
-                print("{self.role}:sent to replica...")
-            except Exception as e:
-                logging.error(f"{self.role}:Failed to connect to replica, error: {e}")
+                    # the reply (and snapshot) must precede the stream
+                    if diskless_sync is None:
+                        await self.flush(conn)
+                    else:
+                        # the shared sync waits for every replica it was
+                        # promised, so attach without yielding first
+                        conn.write(bytes(output_buffer))
+                        output_buffer.clear()
+                    replication.attach(
+                        conn,
+                        req_command.sync_offset,
+                        client.listening_port,
+                        diskless_sync,
+                    )
+                if isinstance(req_command, Replconf):
+                    if req_command.ack_offset is not None:
+                        replication.ack(conn, req_command.ack_offset)
+                    if req_command.listening_port is not None:
+                        client.listening_port = req_command.listening_port
+
+    async def execute_forwarded(self, request: List[bytes]) -> bytes:
+        """## Run a request another worker forwarded here, its keys are ours"""
+        req_command: Optional[CommandProcessor] = CommandProcessor.get_command(
+            request, self.config
+        )
+        assert req_command, "forwarded requests are never empty"
+        response, _ = await req_command.call()
+        if CommandFlag.WRITE in req_command.flags:
+            # the reply goes back only once the AOF policy is satisfied
+            await aof.commit(aof.fed_offset)
+        return response
 
 
 class RedisReplica:
+    RECONNECT_DELAY_S: float = 1.0
+    # how often the replica reports its offset without being asked
+    ACK_PERIOD_S: float = 1.0
+    EOF_MARK_SIZE: int = 40
+
     def __init__(self, config: ServerInfo):
         self.config: ServerInfo = config
-        self.reader: Optional[asyncio.StreamReader] = None
-        self.writer: Optional[asyncio.StreamWriter] = None
+        self.conn: Optional[Connection] = None
         self.role = self.config.role.value
-        self.offset = 0
+        # replid of the master's history, None until the first full sync
+        self.master_replid: Optional[str] = None
+        self.link = MasterLinkState(
+            self.config.master_address or "", self.config.master_port or 0
+        )
+        replication.master_link = self.link
+        self._ack_task: Optional[asyncio.Task] = None
+        # stream bytes read along with the end of an EOF-marked snapshot
+        self._stream_head: bytes = EMPTY_BYTE
+
+    @property
+    def offset(self) -> int:
+        """## Replication offset applied so far, which INFO reports as master_repl_offset"""
+        return self.config.master_repl_offset
+
+    @offset.setter
+    def offset(self, value: int) -> None:
+        self.config.master_repl_offset = value
 
     async def connect(self):
-        self.reader, self.writer = await asyncio.open_connection(
-            self.config.master_address, self.config.master_port
+        _, self.conn = await asyncio.get_running_loop().create_connection(
+            Connection, self.config.master_address, self.config.master_port
         )
 
-    async def receive_commands(self) -> None:
-        print("In receiving commands....")
-        assert self.reader and self.writer, "assert reader write failed..."
-        addr = self.writer.get_extra_info("peername")
+    async def apply_commands(self, conn: Connection) -> None:
+        """## Apply what the master streamed, as soon as it is read"""
+        self.link.last_io = time.time()
         try:
-            while requestobj := await self.reader.read(CHUNK_SIZE):
-                for request_str, offset in parse_input_array_bytes(requestobj):
-
-                    request = RespCoder.encode(request_str).encode()
-                    print(f"Request is {request}")
-                    if not request:
-                        print("{self.role}:no requests found....")
-                        break
-                    logging.info(
-                        f"{self.role}:Received master request\r\n>> {request}\r\n"
-                    )
-                    req_command: Optional[CommandProcessor] = (
-                        CommandProcessor.get_command(request, self.config)
-                    )
-                    print(f"parsed command {req_command}")
-                    if req_command:
-                        if (
-                            req_command.command == Command.REPLCONF
-                            and "GETACK" in req_command.message
-                        ):
-                            req_command.message = [str(self.offset)] + [
-                                *req_command.message
-                            ]
-                            response, followup = await req_command.response()
-                            logging.info(f"{self.role}:Sending response: {response}")
-                            ## respond to master only for ACKs
-                            self.writer.write(response)
-                            await self.writer.drain()
-                        else:
-                            response, followup = await req_command.response()
-                        self.offset += offset
-
+            while conn.pending:
+                request_str, offset = conn.next_request()
+                if request_log.enabled:
+                    request_log.record(f"{self.role}:Master request", request_str)
+                req_command: Optional[CommandProcessor] = CommandProcessor.get_command(
+                    request_str, self.config
+                )
+                if req_command:
+                    if (
+                        req_command.command == Command.REPLCONF
+                        and b"GETACK" in req_command.message
+                    ):
+                        req_command.message = [str(self.offset)] + [
+                            *req_command.message
+                        ]
+                        response, followup = await req_command.call()
+                        ## respond to master only for ACKs
+                        conn.write(response)
+                        await conn.drain()
+                    else:
+                        response, followup = await req_command.call()
+                    self.offset += offset
         except ConnectionResetError:
-            logging.error(f"{ self.role}:Connection reset by peer: {addr}")
+            logging.error("%s:Connection reset by master", self.role)
+            conn.close()
         except Exception as e:
-            logging.error(f"{ self.role}:Error handling client {addr}: {e}")
+            logging.error("%s:Error applying master stream: %s", self.role, e)
+            conn.close()
+
+    async def load_snapshot(self) -> None:
+        """## Receive the snapshot and load it in place of the dataset
+
+        The payload is either `$<length>` framed or, from a diskless sync,
+        `$EOF:<mark>` framed and ended by the same mark. It is read in chunks
+        so the loop keeps serving clients; whatever the master streams after
+        it stays queued and is applied once the snapshot is in.
+        """
+        assert self.conn
+        header: bytes = await self.conn.readuntil(b"\r\n")
+        if header.startswith(b"$EOF:"):
+            payload: bytearray = await self.read_eof_payload(header[5:-2])
+        else:
+            payload = await self.read_sized_payload(int(header[1:-2]))
+        # replaces the dataset, which stays as it was if the snapshot is corrupt
+        stats = load_rdb(bytes(payload), kvPair, self.config.rdbchecksum)
+        logging.info(
+            "%s:MASTER <-> REPLICA sync: loaded %d keys, %d bytes in %.3f ms",
+            self.role,
+            stats.rdb_last_load_keys_loaded,
+            len(payload),
+            stats.rdb_last_load_time_ms,
+        )
+
+    async def read_sized_payload(self, length: int) -> bytearray:
+        assert self.conn
+        payload = bytearray()
+        while len(payload) < length:
+            chunk: bytes = await self.conn.read(min(CHUNK_SIZE, length - len(payload)))
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(payload), length)
+            payload += chunk
+            self.link.last_io = time.time()
+        return payload
+
+    async def read_eof_payload(self, eof_mark: bytes) -> bytearray:
+        assert self.conn
+        if len(eof_mark) != self.EOF_MARK_SIZE:
+            raise RDBError(f"invalid EOF mark {eof_mark!r}")
+        payload = bytearray()
+        while True:
+            chunk: bytes = await self.conn.read(CHUNK_SIZE)
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(payload), None)
+            # the mark may straddle two reads
+            search_from: int = max(0, len(payload) - self.EOF_MARK_SIZE + 1)
+            payload += chunk
+            self.link.last_io = time.time()
+            end: int = payload.find(eof_mark, search_from)
+            if end != -1:
+                # the live stream may already follow the mark
+                self._stream_head = bytes(payload[end + self.EOF_MARK_SIZE :])
+                del payload[end:]
+                return payload
+
+    async def send_acks(self) -> None:
+        """## Report the applied offset every second, which the master shows as lag"""
+        while self.conn is not None:
+            self.conn.write(
+                RespCoder.encode([b"REPLCONF", b"ACK", b"%d" % self.offset])
+            )
+            await asyncio.sleep(self.ACK_PERIOD_S)
 
     async def handshake(self):
-        if not self.writer or not self.reader:
-            await self.connect()
-            print("handshaking as slave...")
-            assert self.reader and self.writer
-            await ping_master(self.reader, self.writer)  # type: ignore
-            await replconf_master(self.reader, self.writer, 0, self.config.port)  # type: ignore
-            await replconf_master(self.reader, self.writer, 1, self.config.port)  # type: ignore
-            await psync_master(self.reader, self.writer)
-
-            print(" now kicking of reads...")
-            ## Read rdb file first as partial commands
-            res: bytes = await self.reader.readuntil(b"\r\n")
-            await self.reader.readexactly(int(res[1:-2]))
-            logging.info(f"{self.role}:PSYNC2")
-            logging.info(f"{self.role}:Handshake completed")
-            ## start recieving commands
-            await self.receive_commands()
+        """## Sync with the master, then keep the link up for good
+
+        The replid and offset survive a dropped link, so reconnecting asks
+        for a partial resync and only falls back to a snapshot when the
+        master can't serve it.
+        """
+        while True:
+            try:
+                await self.connect()
+                logging.info("%s:Connected to MASTER, handshaking", self.role)
+                assert self.conn
+                # the connection pulls like a stream until the sync is done
+                await ping_master(self.conn, self.conn)  # type: ignore
+                await replconf_master(self.conn, self.conn, 0, self.config.port)  # type: ignore
+                await replconf_master(self.conn, self.conn, 1, self.config.port)  # type: ignore
+                reply: List[str] = await psync_master(
+                    self.conn, self.conn, self.master_replid, self.offset
+                )
+                if reply and reply[0] == "FULLRESYNC":
+                    self.master_replid, self.offset = reply[1], int(reply[2])
+                    self.link.sync_in_progress = True
+                    try:
+                        await self.load_snapshot()
+                    finally:
+                        self.link.sync_in_progress = False
+                elif reply and reply[0] == "CONTINUE":
+                    if len(reply) > 1:
+                        self.master_replid = reply[1]
+                    logging.info(
+                        "%s:Partial resynchronization from offset %d",
+                        self.role,
+                        self.offset,
+                    )
+                else:
+                    raise ConnectionError(f"unexpected PSYNC reply {reply}")
+                self.config.master_replid = self.master_replid
+                self.link.up = True
+                self.link.last_io = time.time()
+                logging.info("%s:PSYNC2", self.role)
+                logging.info("%s:Handshake completed", self.role)
+                self._ack_task = asyncio.create_task(self.send_acks())
+                ## start recieving commands
+                self.conn.start_dispatch(self.apply_commands, self._stream_head)
+                self._stream_head = EMPTY_BYTE
+                await self.conn.wait_closed()
+                logging.error("%s:Connection with master closed", self.role)
+            except (OSError, asyncio.IncompleteReadError, RDBError) as e:
+                logging.error("%s:Link with master failed: %s", self.role, e)
+            await self.close()
+            await asyncio.sleep(self.RECONNECT_DELAY_S)
 
     async def close(self):
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
+        if self.link.up:
+            self.link.up = False
+            self.link.down_since = time.time()
+        if self._ack_task is not None:
+            self._ack_task.cancel()
+            self._ack_task = None
+        if self.conn:
+            self.conn.close()
+            await self.conn.wait_closed()
+        self.conn = None
+        self._stream_head = EMPTY_BYTE
@@ -1,4 +1,3 @@
-import asyncio
 from dataclasses import dataclass, field
 from argparse import ArgumentParser, Namespace
 from enum import Enum
@@ -7,6 +6,12 @@ import string
 from typing import Optional
 
 
+class AppendFsync(Enum):
+    ALWAYS = "always"
+    EVERYSEC = "everysec"
+    NO = "no"
+
+
 class ServerRole(Enum):
     MASTER = "master"
     SLAVE = "slave"
@@ -22,8 +27,33 @@ class ServerInfo:
     master_repl_offset: int
     dir: str
     dbfilename: str
-    replicas: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = field(
-        default_factory=list
+    output_buffer_high_water: int = 1024 * 1024
+    rdbchecksum: bool = True
+    save_params: list[tuple[int, int]] = field(default_factory=list)
+    appendonly: bool = False
+    appendfilename: str = "appendonly.aof"
+    appendfsync: AppendFsync = AppendFsync.EVERYSEC
+    active_expire_cycle_ms: float = 25.0
+    repl_backlog_size: int = 1024 * 1024
+    repl_diskless_sync: bool = False
+    # seconds a diskless sync waits for more replicas to share its snapshot
+    repl_diskless_sync_delay: int = 5
+    loglevel: str = "notice"
+    # empty logs to stderr
+    logfile: str = ""
+    # "uvloop" runs the server on uvloop when it is installed
+    event_loop: str = "asyncio"
+    # processes sharing the port, each owning a partition of the keyspace
+    workers: int = 1
+    cluster_enabled: bool = False
+    cluster_config_file: str = "nodes.conf"
+    # address other nodes and redirected clients reach this node at
+    cluster_announce_ip: str = "127.0.0.1"
+    # hard limit, soft limit and soft limit seconds of a replica's output buffer
+    replica_output_buffer_limit: tuple[int, int, int] = (
+        256 * 1024 * 1024,
+        64 * 1024 * 1024,
+        60,
     )
 
 
@@ -41,12 +71,139 @@ def get_args_parser() -> ArgumentParser:
     parser.add_argument(
         "--dbfilename", type=str, default="rdbfile", help="replica conf of master"
     )
+    parser.add_argument(
+        "--output-buffer-high-water",
+        type=int,
+        default=1024 * 1024,
+        help="bytes buffered for a client before replies wait on the socket",
+    )
+    parser.add_argument(
+        "--rdbchecksum",
+        type=str,
+        choices=["yes", "no"],
+        default="yes",
+        help="verify the CRC64 trailer when loading RDB files",
+    )
+    parser.add_argument(
+        "--save",
+        type=str,
+        default="3600 1 300 100 60 10000",
+        help='snapshot rules as "<seconds> <changes> ...", empty to disable',
+    )
+    parser.add_argument(
+        "--appendonly",
+        type=str,
+        choices=["yes", "no"],
+        default="no",
+        help="log every write to the append-only file",
+    )
+    parser.add_argument(
+        "--appendfilename",
+        type=str,
+        default="appendonly.aof",
+        help="append-only file name inside --dir",
+    )
+    parser.add_argument(
+        "--appendfsync",
+        type=str,
+        choices=[policy.value for policy in AppendFsync],
+        default=AppendFsync.EVERYSEC.value,
+        help="when the append-only file is fsynced",
+    )
+    parser.add_argument(
+        "--active-expire-cycle-ms",
+        type=float,
+        default=25.0,
+        help="longest time one background expire cycle may hold the event loop",
+    )
+    parser.add_argument(
+        "--repl-backlog-size",
+        type=int,
+        default=1024 * 1024,
+        help="bytes of replication stream kept for replicas to resume from",
+    )
+    parser.add_argument(
+        "--loglevel",
+        type=str,
+        choices=["debug", "verbose", "notice", "warning"],
+        default="notice",
+        help="debug logs requests (rate limited), verbose connections, notice lifecycle events",
+    )
+    parser.add_argument(
+        "--logfile",
+        type=str,
+        default="",
+        help="file the log is appended to, stderr when empty",
+    )
+    parser.add_argument(
+        "--event-loop",
+        type=str,
+        choices=["asyncio", "uvloop"],
+        default="asyncio",
+        help="event loop implementation, uvloop falls back to asyncio when missing",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes serving the port, each owning a hash partition of the keyspace;"
+        " KEYS, INFO, SAVE, BGSAVE, BGREWRITEAOF, LASTSAVE and MIGRATE are refused",
+    )
+    parser.add_argument(
+        "--cluster-enabled",
+        type=str,
+        choices=["yes", "no"],
+        default="no",
+        help="serve a share of the 16384 hash slots as a cluster node",
+    )
+    parser.add_argument(
+        "--cluster-config-file",
+        type=str,
+        default="nodes.conf",
+        help="file inside --dir the node persists its view of the cluster to",
+    )
+    parser.add_argument(
+        "--cluster-announce-ip",
+        type=str,
+        default="127.0.0.1",
+        help="address advertised to other nodes and in redirects",
+    )
+    parser.add_argument(
+        "--repl-diskless-sync",
+        type=str,
+        choices=["yes", "no"],
+        default="no",
+        help="stream full syncs straight to replica sockets instead of buffering them",
+    )
+    parser.add_argument(
+        "--repl-diskless-sync-delay",
+        type=int,
+        default=5,
+        help="seconds a diskless sync waits for more replicas to join it",
+    )
+    parser.add_argument(
+        "--client-output-buffer-limit-replica",
+        type=str,
+        default="256mb 64mb 60",
+        help='"<hard> <soft> <soft seconds>" before a lagging replica is dropped, 0 disables a limit',
+    )
 
     return parser
 
 
 def get_server_info() -> ServerInfo:
-    parsed_args: Namespace = get_args_parser().parse_args()
+    parser: ArgumentParser = get_args_parser()
+    parsed_args: Namespace = parser.parse_args()
+    if parsed_args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if parsed_args.workers > 1 and parsed_args.replicaof:
+        parser.error("--workers can't be combined with --replicaof")
+    if parsed_args.cluster_enabled == "yes" and (
+        parsed_args.workers > 1 or parsed_args.replicaof
+    ):
+        parser.error(
+            "--cluster-enabled can't be combined with --workers or --replicaof"
+        )
     master_address, master_port, role = None, None, ServerRole.MASTER
     master_replid, master_repl_offset = generate_random_string(40), 0
     if parsed_args.replicaof:
@@ -65,9 +222,60 @@ def get_server_info() -> ServerInfo:
         master_repl_offset=master_repl_offset,
         dir=parsed_args.dir,
         dbfilename=parsed_args.dbfilename,
+        output_buffer_high_water=parsed_args.output_buffer_high_water,
+        rdbchecksum=parsed_args.rdbchecksum == "yes",
+        save_params=parse_save_params(parsed_args.save),
+        appendonly=parsed_args.appendonly == "yes",
+        appendfilename=parsed_args.appendfilename,
+        appendfsync=AppendFsync(parsed_args.appendfsync),
+        active_expire_cycle_ms=parsed_args.active_expire_cycle_ms,
+        repl_backlog_size=parsed_args.repl_backlog_size,
+        repl_diskless_sync=parsed_args.repl_diskless_sync == "yes",
+        repl_diskless_sync_delay=parsed_args.repl_diskless_sync_delay,
+        loglevel=parsed_args.loglevel,
+        logfile=parsed_args.logfile,
+        event_loop=parsed_args.event_loop,
+        workers=parsed_args.workers,
+        cluster_enabled=parsed_args.cluster_enabled == "yes",
+        cluster_config_file=parsed_args.cluster_config_file,
+        cluster_announce_ip=parsed_args.cluster_announce_ip,
+        replica_output_buffer_limit=parse_output_buffer_limit(
+            parsed_args.client_output_buffer_limit_replica
+        ),
     )
 
 
+def parse_save_params(save: str) -> list[tuple[int, int]]:
+    values: list[int] = [int(value) for value in save.split()]
+    if len(values) % 2:
+        raise ValueError(f"Invalid save parameters: {save!r}")
+    return list(zip(values[0::2], values[1::2]))
+
+
+def parse_memory(value: str) -> int:
+    """## Parse a byte count with an optional k/kb/m/mb/g/gb unit"""
+    units: dict[str, int] = {
+        "k": 1000,
+        "kb": 1024,
+        "m": 1000**2,
+        "mb": 1024**2,
+        "g": 1000**3,
+        "gb": 1024**3,
+    }
+    number: str = value.lower().rstrip(string.ascii_lowercase)
+    unit: str = value.lower()[len(number) :]
+    if unit and unit not in units:
+        raise ValueError(f"Invalid memory unit in {value!r}")
+    return int(number) * units.get(unit, 1)
+
+
+def parse_output_buffer_limit(limit: str) -> tuple[int, int, int]:
+    values: list[str] = limit.split()
+    if len(values) != 3:
+        raise ValueError(f"Invalid client output buffer limit: {limit!r}")
+    return parse_memory(values[0]), parse_memory(values[1]), int(values[2])
+
+
 def generate_random_string(length: int = 10) -> str:
     characters = string.ascii_letters + string.digits
     random_string = "".join(random.choice(characters) for _ in range(length))
@@ -0,0 +1,148 @@
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, List, Optional
+
+# between DEBUG and INFO, like redis' verbose: per-connection events
+VERBOSE: int = 15
+logging.addLevelName(VERBOSE, "VERBOSE")
+
+# `--loglevel` names, notice being where lifecycle events are logged
+LOG_LEVELS: Dict[str, int] = {
+    "debug": logging.DEBUG,
+    "verbose": VERBOSE,
+    "notice": logging.INFO,
+    "warning": logging.WARNING,
+}
+
+LOG_FORMAT: str = "%(process)d:%(asctime)s.%(msecs)03d %(levelname)s %(message)s"
+LOG_DATE_FORMAT: str = "%d %b %Y %H:%M:%S"
+
+# requests logged per second at debug level, the rest are only counted
+REQUEST_LOG_RATE: int = 100
+# longest argument and most arguments shown for one logged request
+REQUEST_LOG_ARG_SIZE: int = 64
+REQUEST_LOG_ARGS: int = 8
+
+# log file of this process, "" for stderr, None until logging is set up
+_logfile: Optional[str] = None
+
+
+class _RequestRepr:
+    """Formats a request for the log only if a record is actually emitted."""
+
+    __slots__ = ("request",)
+
+    def __init__(self, request: List[bytes]) -> None:
+        self.request: List[bytes] = request
+
+    def __str__(self) -> str:
+        args: List[str] = [
+            repr(arg[:REQUEST_LOG_ARG_SIZE])
+            + ("..." if len(arg) > REQUEST_LOG_ARG_SIZE else "")
+            for arg in self.request[:REQUEST_LOG_ARGS]
+        ]
+        if len(self.request) > REQUEST_LOG_ARGS:
+            args.append(f"... ({len(self.request) - REQUEST_LOG_ARGS} more)")
+        return " ".join(args)
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records untouched, the listener thread does the formatting."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RequestLog:
+    """Rate-limited debug log of the requests the server handles.
+
+    Callers check `enabled` before calling `record`, so below debug level
+    the request path makes no logging call at all. Above `REQUEST_LOG_RATE`
+    requests a second the rest are counted and summed up in one line.
+    """
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self._window_start: float = 0.0
+        self._logged: int = 0
+        self._suppressed: int = 0
+
+    def configure(self, level: int) -> None:
+        self.enabled = level <= logging.DEBUG
+
+    def record(self, source: str, request: List[bytes]) -> None:
+        now: float = time.monotonic()
+        if now - self._window_start >= 1.0:
+            if self._suppressed:
+                logging.debug("%d more requests not logged", self._suppressed)
+            self._window_start, self._logged, self._suppressed = now, 0, 0
+        if self._logged >= REQUEST_LOG_RATE:
+            self._suppressed += 1
+            return
+        self._logged += 1
+        logging.debug("%s: %s", source, _RequestRepr(request))
+
+
+def _make_handler(logfile: str) -> logging.Handler:
+    handler: logging.Handler = (
+        # opened on the first record, most forked children never log
+        logging.FileHandler(logfile, delay=True)
+        if logfile
+        else logging.StreamHandler(sys.stderr)
+    )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    return handler
+
+
+def _log_directly_after_fork() -> None:
+    """## Have a forked child, such as a BGSAVE one, write its records itself
+
+    The listener thread isn't forked along, so queued records would never be
+    written, and whatever lock it held at fork time would stay held.
+    """
+    if _logfile is None:
+        return
+    root: logging.Logger = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_make_handler(_logfile))
+
+
+os.register_at_fork(after_in_child=_log_directly_after_fork)
+
+
+def setup_logging(loglevel: str, logfile: str = "") -> logging.handlers.QueueListener:
+    """## Route this process's logging through a queue to a writer thread
+
+    The event loop only enqueues records; formatting and the file or
+    stderr writes happen on the listener's thread. Forked children write
+    their own records instead.
+
+    ### Args:
+        - `loglevel (str)`: one of `LOG_LEVELS`
+        - `logfile (str)`: file to append to, stderr when empty
+
+    ### Returns:
+        - `QueueListener`: to `stop()` on shutdown, which flushes what is queued
+    """
+    global _logfile
+    level: int = LOG_LEVELS[loglevel]
+    handler: logging.Handler = _make_handler(logfile)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    root: logging.Logger = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_LocalQueueHandler(records))
+    root.setLevel(level)
+    request_log.configure(level)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    _logfile = logfile
+    return listener
+
+
+request_log = RequestLog()
@@ -0,0 +1,309 @@
+import asyncio
+import dataclasses
+import logging
+import os
+import signal
+import socket
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from app.handler.server_conf import ServerInfo
+from app.handler.server_log import setup_logging
+from app.processor.cluster import key_hash_slot
+from app.processor.command import command_keys
+from app.processor.resp_coder import RespCoder, RespParser
+
+IPC_CHUNK_SIZE: int = 64 * 1024
+
+CROSS_WORKER_ERROR: bytes = (
+    b"-CROSSSLOT Keys in request don't hash to the same worker\r\n"
+)
+
+
+def keyspace_worker_error(command: bytes) -> bytes:
+    """## The reply to a command that would only see the receiving worker's keys"""
+    return (
+        b"-ERR '%s' is not supported with --workers, "
+        b"each worker only holds a slice of the keyspace\r\n" % command.lower()
+    )
+
+
+class CrossWorkerError(Exception):
+    pass
+
+
+class PeerClient:
+    """Forwards requests to the worker owning their keys.
+
+    Requests forwarded during one loop iteration leave in a single write.
+    Each one is tagged with an id the owner echoes back, `<id> <length>`
+    then the raw reply, so a blocking command held by the owner doesn't
+    hold back the replies behind it. A frame holding only an id cancels
+    that request, which is sent when a forward is cancelled while waiting.
+    """
+
+    def __init__(
+        self, index: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.index: int = index
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self._next_id: int = 0
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._pending = bytearray()
+        self._flush_scheduled: bool = False
+        self._task: asyncio.Task = asyncio.create_task(self._read_replies())
+
+    def forward(self, request: List[bytes]) -> asyncio.Future:
+        """## Send `request` to the owner, the future resolves to its raw reply
+
+        Cancelling the future tells the owner to cancel the request, which
+        is how a blocked read is released when its client goes away.
+        """
+        request_id: int = self._next_id
+        self._next_id += 1
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        self._send([b"%d" % request_id, *request])
+        future.add_done_callback(lambda done: self._forget(request_id, done))
+        return future
+
+    def _forget(self, request_id: int, future: asyncio.Future) -> None:
+        self._waiters.pop(request_id, None)
+        if future.cancelled():
+            # the owner may still be running it, like a blocked read
+            self._send([b"%d" % request_id])
+
+    def _send(self, frame: List[bytes]) -> None:
+        self._pending += RespCoder.encode(frame)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        self.writer.write(bytes(self._pending))
+        self._pending.clear()
+
+    async def _read_replies(self) -> None:
+        try:
+            while header := await self.reader.readline():
+                request_id, length = map(int, header.split())
+                reply: bytes = await self.reader.readexactly(length)
+                future: Optional[asyncio.Future] = self._waiters.get(request_id)
+                # the client may have gone away while waiting
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.error("Link to worker %d failed: %s", self.index, e)
+        for future in self._waiters.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"worker {self.index} is gone"))
+
+
+class Workers:
+    """This process's view of a `--workers N` server.
+
+    Every worker listens on the same port with SO_REUSEPORT, so the kernel
+    spreads connections between them, and owns the keys whose hash slot
+    falls on its index. A request for another worker's keys is forwarded
+    over a Unix socketpair and its reply relayed unchanged.
+
+    Commands flagged `KEYSPACE` act on every key a server holds, like KEYS,
+    INFO's keyspace figures, SAVE or MIGRATE. A worker would only act on
+    its own partition, so they are refused in this mode rather than
+    answering for part of the dataset.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        count: int,
+        clients: Dict[int, socket.socket],
+        servers: List[socket.socket],
+        lifeline: int,
+    ) -> None:
+        self.index: int = index
+        self.count: int = count
+        self._client_sockets: Dict[int, socket.socket] = clients
+        self._server_sockets: List[socket.socket] = servers
+        # read end of a pipe the parent holds open for as long as it lives
+        self._lifeline: int = lifeline
+        self.peers: Dict[int, PeerClient] = {}
+        # the loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def worker_of(self, key: bytes) -> int:
+        return key_hash_slot(key) % self.count
+
+    def owner_of(self, request: List[bytes]) -> Optional[int]:
+        """## The worker that must run `request`, None when it runs here
+
+        ### Raises:
+            - `CrossWorkerError`: when its keys are owned by different workers
+        """
+        keys: List[bytes] = command_keys(request)
+        if not keys:
+            return None
+        owner: int = self.worker_of(keys[0])
+        if any(self.worker_of(key) != owner for key in keys[1:]):
+            raise CrossWorkerError()
+        return None if owner == self.index else owner
+
+    def forward(self, owner: int, request: List[bytes]) -> asyncio.Future:
+        """## Send `request` to worker `owner`, the future resolves to its raw reply
+
+        Nothing waits for the reply here, so a pipeline's forwards all leave
+        before the first one is answered.
+        """
+        return self.peers[owner].forward(request)
+
+    async def start(self, execute: Callable[[List[bytes]], Awaitable[bytes]]) -> None:
+        """## Connect to the other workers and serve what they forward here
+
+        ### Args:
+            - `execute (Callable)`: runs a forwarded request and returns its reply
+        """
+        for index, sock in self._client_sockets.items():
+            reader, writer = await asyncio.open_unix_connection(sock=sock)
+            self.peers[index] = PeerClient(index, reader, writer)
+        for sock in self._server_sockets:
+            reader, writer = await asyncio.open_unix_connection(sock=sock)
+            self._spawn(self._serve_peer(reader, writer, execute))
+        asyncio.get_running_loop().add_reader(self._lifeline, self._parent_exited)
+
+    async def _serve_peer(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        execute: Callable[[List[bytes]], Awaitable[bytes]],
+    ) -> None:
+        parser = RespParser()
+        replies = bytearray()
+        flush_scheduled: bool = False
+        # requests still executing, by id, so the requester can cancel them
+        running: Dict[bytes, asyncio.Task] = {}
+
+        def flush() -> None:
+            nonlocal flush_scheduled
+            flush_scheduled = False
+            writer.write(bytes(replies))
+            replies.clear()
+
+        async def run(request_id: bytes, request: List[bytes]) -> None:
+            nonlocal flush_scheduled
+            try:
+                reply: bytes = await execute(request)
+            except Exception as e:
+                logging.error("Worker %d: forwarded request failed: %s", self.index, e)
+                reply = b"-ERR %s\r\n" % str(e).encode()
+            finally:
+                running.pop(request_id, None)
+            replies.extend(b"%s %d\r\n" % (request_id, len(reply)))
+            replies.extend(reply)
+            if not flush_scheduled:
+                flush_scheduled = True
+                asyncio.get_running_loop().call_soon(flush)
+
+        while data := await reader.read(IPC_CHUNK_SIZE):
+            for request, _ in parser.feed(data):
+                if len(request) > 1:
+                    running[request[0]] = self._spawn(run(request[0], request[1:]))
+                elif (task := running.pop(request[0], None)) is not None:
+                    task.cancel()
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> asyncio.Task:
+        task: asyncio.Task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _parent_exited(self) -> None:
+        logging.warning("Worker %d: parent process exited, shutting down", self.index)
+        os._exit(0)
+
+
+def run_workers(
+    config: ServerInfo, serve: Callable[[ServerInfo, Workers], Awaitable[None]]
+) -> None:
+    """## Fork `config.workers` servers sharing the port, and wait on them
+
+    Each worker persists its own partition, to the configured file names
+    suffixed with its index. When one worker exits the others are stopped.
+    """
+    count: int = config.workers
+    channels: Dict[Tuple[int, int], Tuple[socket.socket, socket.socket]] = {
+        (client, server): socket.socketpair()
+        for client in range(count)
+        for server in range(count)
+        if client != server
+    }
+    lifeline_read, lifeline_write = os.pipe()
+    pids: List[int] = []
+    for index in range(count):
+        pid: int = os.fork()
+        if pid == 0:
+            os.close(lifeline_write)
+            for (client, server), (client_end, server_end) in channels.items():
+                if client != index:
+                    client_end.close()
+                if server != index:
+                    server_end.close()
+            workers = Workers(
+                index,
+                count,
+                {
+                    server: channels[index, server][0]
+                    for server in range(count)
+                    if server != index
+                },
+                [
+                    channels[client, index][1]
+                    for client in range(count)
+                    if client != index
+                ],
+                lifeline_read,
+            )
+            worker_config: ServerInfo = dataclasses.replace(
+                config,
+                dbfilename=f"{config.dbfilename}.{index}",
+                appendfilename=f"{config.appendfilename}.{index}",
+            )
+            try:
+                asyncio.run(serve(worker_config, workers))
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    os.close(lifeline_read)
+    for client_end, server_end in channels.values():
+        client_end.close()
+        server_end.close()
+    # only once forked, the workers set up their own logging
+    listener = setup_logging(config.loglevel, config.logfile)
+    logging.info("Started %d workers: %s", count, pids)
+    try:
+        pid, status = os.wait()
+        logging.error(
+            "Worker %d exited with %d",
+            pids.index(pid),
+            os.waitstatus_to_exitcode(status),
+        )
+    except KeyboardInterrupt:
+        pass
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    listener.stop()
@@ -2,16 +2,34 @@
 from argparse import ArgumentParser, Namespace
 import socket
 import asyncio
+import logging
 
 from app.handler.server_conf import ServerInfo, get_server_info, get_args_parser
 from app.handler.handler import main_with_event_loop, start_redis_server
+from app.handler.workers import run_workers
+
+
+def install_event_loop(event_loop: str) -> None:
+    """## Make `asyncio.run` use the requested loop, workers inherit it"""
+    if event_loop != "uvloop":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop is not installed, running on the asyncio loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 if __name__ == "__main__":
     # asyncio.run(main())
     server_args: ServerInfo = get_server_info()
+    install_event_loop(server_args.event_loop)
     try:
         # asyncio.run(main_with_event_loop(server_args))
-        asyncio.run(start_redis_server(server_args))
+        if server_args.workers > 1:
+            run_workers(server_args, start_redis_server)
+        else:
+            asyncio.run(start_redis_server(server_args))
     except KeyboardInterrupt:
         print("Keyboard Interrupt!")
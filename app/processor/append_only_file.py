@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from app.handler.server_conf import AppendFsync
+from app.processor.rdb_file_processor import (
+    RDBFileProcessor,
+    RDBFileWriter,
+    fsync_directory,
+)
+from app.processor.resp_coder import RespParser
+from app.storage.storage import Storage, kvPair
+
+
+class AppendOnlyFile:
+    """Append-only log of every write command routed through the dispatcher.
+
+    Writes are buffered as they are executed and reach the file when the
+    connection that issued them calls `commit` before sending its replies.
+    Offsets count the bytes fed so far, so a connection only waits for the
+    writes up to its own last one:
+    - `always`: all writes buffered during one loop iteration share a single
+      write + fsync done in a worker thread (group commit).
+    - `everysec`: writes go to the OS right away and `cron` fsyncs at most once
+      per second off the event loop.
+    - `no`: the OS decides when to flush.
+
+    `bgrewrite` compacts the log into an RDB preamble produced by a forked
+    child, followed by the commands received while the child was running.
+    It is refused while the AOF is off, since the file it leaves behind
+    would be replayed, stale, by a later start with appendonly on.
+    """
+
+    READ_CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, storage: Storage) -> None:
+        self.storage: Storage = storage
+        self.enabled: bool = False
+        self.filename: Optional[str] = None
+        self.fsync_policy: AppendFsync = AppendFsync.EVERYSEC
+        self.checksum: bool = True
+        self.fd: Optional[int] = None
+        # held by the fsync threads and while a rewrite swaps `fd`
+        self._fd_lock = threading.Lock()
+        self.loading: bool = False
+        self.rewrite_child_pid: Optional[int] = None
+        self.last_rewrite_status: str = "ok"
+        self._buffer = bytearray()
+        # bytes fed so far, and how many of them `commit` no longer waits on
+        self.fed_offset: int = 0
+        self._committed_offset: int = 0
+        self._rewrite_buffer: Optional[bytearray] = None
+        self._group: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._fsync_task: Optional[asyncio.Task] = None
+        self._unsynced: bool = False
+        self._last_fsync: float = time.time()
+
+    def configure(
+        self,
+        enabled: bool,
+        filename: str,
+        fsync_policy: AppendFsync,
+        checksum: bool,
+    ) -> None:
+        self.enabled = enabled
+        self.filename = filename
+        self.fsync_policy = fsync_policy
+        self.checksum = checksum
+
+    def open(self) -> None:
+        assert self.filename, "aof file name must be configured"
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def feed(self, encoded: bytes) -> None:
+        """## Buffer one RESP-encoded write request"""
+        if not self.enabled or self.loading:
+            return
+        self._buffer += encoded
+        self.fed_offset += len(encoded)
+        if self._rewrite_buffer is not None:
+            self._rewrite_buffer += encoded
+
+    async def commit(self, offset: int) -> None:
+        """## Make the writes fed up to `offset` durable according to the fsync policy
+
+        ### Args:
+            - `offset (int)`: `fed_offset` right after the caller's last write
+        """
+        if self.fd is None or offset <= self._committed_offset:
+            return
+        if self.fsync_policy != AppendFsync.ALWAYS:
+            self._write_buffer()
+            return
+        while offset > self._committed_offset:
+            if self._buffer and self._group is None:
+                self._group = asyncio.create_task(self._group_commit(self._inflight))
+            # our writes are either on their way to disk or in the next group
+            pending: Optional[asyncio.Task] = self._group or self._inflight
+            if pending is None:
+                break
+            await asyncio.shield(pending)
+
+    async def _group_commit(self, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        # commits arriving from here on form the next group
+        self._group = None
+        self._inflight = asyncio.current_task()
+        data: bytes = bytes(self._buffer)
+        end: int = self.fed_offset
+        self._buffer.clear()
+        await asyncio.to_thread(self._write_and_sync, data)
+        self._committed_offset = end
+
+    def _write_and_sync(self, data: bytes) -> None:
+        with self._fd_lock:
+            assert self.fd is not None
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self.fd, view) :]
+            os.fsync(self.fd)
+
+    def _fsync(self) -> None:
+        with self._fd_lock:
+            if self.fd is not None:
+                os.fsync(self.fd)
+
+    def _write_buffer(self) -> None:
+        if not self._buffer or self.fd is None:
+            return
+        view = memoryview(bytes(self._buffer))
+        self._buffer.clear()
+        while view:
+            view = view[os.write(self.fd, view) :]
+        self._committed_offset = self.fed_offset
+        self._unsynced = True
+
+    def cron(self) -> None:
+        if self.fd is None or self.fsync_policy == AppendFsync.ALWAYS:
+            return
+        self._write_buffer()
+        if (
+            self.fsync_policy == AppendFsync.EVERYSEC
+            and self._unsynced
+            and self._fsync_task is None
+            and time.time() - self._last_fsync >= 1
+        ):
+            self._unsynced = False
+            self._last_fsync = time.time()
+            self._fsync_task = asyncio.create_task(asyncio.to_thread(self._fsync))
+            self._fsync_task.add_done_callback(self._fsync_done)
+
+    def _fsync_done(self, task: asyncio.Task) -> None:
+        self._fsync_task = None
+        if not task.cancelled() and task.exception():
+            logging.error("AOF fsync failed: %s", task.exception())
+
+    def bgrewrite(self) -> bool:
+        """## Fork a child that compacts the log from the current keyspace
+
+        ### Returns:
+            - `bool`: False if a rewrite is already running or the AOF is off
+        """
+        assert self.filename, "aof file name must be configured"
+        if not self.enabled or self.rewrite_child_pid is not None:
+            return False
+        directory: str = os.path.dirname(self.filename) or "."
+        temp_file: str = os.path.join(
+            directory, f"temp-rewriteaof-bg-{os.getpid()}.aof"
+        )
+        self._rewrite_buffer = bytearray()
+        pid: int = os.fork()
+        if pid == 0:
+            try:
+                RDBFileWriter(self.storage, self.checksum).save(temp_file)
+                os._exit(0)
+            except BaseException as e:
+                logging.error("Writing the rewritten AOF failed: %s", e)
+                os._exit(1)
+        self.rewrite_child_pid = pid
+        logging.info("Background append only file rewriting started by pid %d", pid)
+        asyncio.create_task(self._reap_rewrite(pid, temp_file))
+        return True
+
+    async def _reap_rewrite(self, pid: int, temp_file: str) -> None:
+        _, status = await asyncio.to_thread(os.waitpid, pid, 0)
+        exit_code: int = os.waitstatus_to_exitcode(status)
+        try:
+            if exit_code != 0:
+                raise Exception(f"rewrite child exited with {exit_code}")
+            while self._inflight is not None and not self._inflight.done():
+                await asyncio.wait([self._inflight])
+            # everything up to here is either in the old file or in the
+            # rewrite buffer, so the swap below must not yield to the loop
+            self._write_buffer()
+            with open(temp_file, "ab") as f:
+                f.write(self._rewrite_buffer or b"")
+                f.flush()
+                os.fsync(f.fileno())
+            assert self.filename
+            # an fsync thread must not be left holding the closed fd
+            with self._fd_lock:
+                os.replace(temp_file, self.filename)
+                if self.fd is not None:
+                    os.close(self.fd)
+                self.open()
+            # the rename itself is only durable once the directory is synced
+            await asyncio.to_thread(fsync_directory, self.filename)
+            self.last_rewrite_status = "ok"
+            logging.info("Background AOF rewrite finished successfully")
+        except Exception as e:
+            self.last_rewrite_status = "err"
+            logging.error("Background AOF rewrite failed: %s", e)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        finally:
+            self.rewrite_child_pid = None
+            self._rewrite_buffer = None
+
+    def load_preamble(self) -> int:
+        """## Load the RDB preamble, if any, and return where the commands start"""
+        assert self.filename, "aof file name must be configured"
+        with open(self.filename, "rb") as f:
+            if f.read(5) != b"REDIS":
+                return 0
+        stats = RDBFileProcessor(self.filename, self.checksum).load(self.storage)
+        return stats.rdb_last_load_bytes_read
+
+    def iter_commands(self, offset: int = 0) -> Iterator[List[bytes]]:
+        """## Stream the logged commands through the RESP parser"""
+        assert self.filename, "aof file name must be configured"
+        parser = RespParser()
+        pending: int = 0
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            while chunk := f.read(self.READ_CHUNK_SIZE):
+                pending += len(chunk)
+                for request, size in parser.feed(chunk):
+                    pending -= size
+                    yield request
+        if pending:
+            logging.warning(
+                "AOF %s ends with a truncated command of %d bytes",
+                self.filename,
+                pending,
+            )
+
+    def info(self) -> List[Tuple[str, str]]:
+        return [
+            ("aof_enabled", str(int(self.enabled))),
+            ("aof_rewrite_in_progress", str(int(self.rewrite_child_pid is not None))),
+            ("aof_last_bgrewrite_status", self.last_rewrite_status),
+        ]
+
+
+aof: AppendOnlyFile = AppendOnlyFile(kvPair)
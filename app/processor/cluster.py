@@ -0,0 +1,492 @@
+import asyncio
+import binascii
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.handler.server_conf import ServerInfo
+from app.processor.rdb_file_processor import fsync_directory
+from app.processor.resp_coder import RespCoder
+from app.storage.storage import kvPair
+
+CLUSTER_SLOTS: int = 16384
+
+CROSSSLOT_ERROR: bytes = b"-CROSSSLOT Keys in request don't hash to the same slot\r\n"
+CLUSTERDOWN_ERROR: bytes = b"-CLUSTERDOWN Hash slot not served\r\n"
+
+
+def key_hash_slot(key: bytes) -> int:
+    """## Hash slot of `key`, computed the way Redis Cluster does
+
+    Only the part inside the first non-empty `{...}` is hashed when there
+    is one, so related keys can be kept together.
+    """
+    start: int = key.find(b"{")
+    if start != -1:
+        end: int = key.find(b"}", start + 1)
+        if end > start + 1:
+            key = key[start + 1 : end]
+    # CRC16/XMODEM, the checksum Redis Cluster uses
+    return binascii.crc_hqx(key, 0) % CLUSTER_SLOTS
+
+
+def slot_ranges(slots: List[int]) -> List[Tuple[int, int]]:
+    """## Collapse sorted slot numbers into inclusive `(first, last)` ranges"""
+    ranges: List[Tuple[int, int]] = []
+    for slot in slots:
+        if ranges and ranges[-1][1] == slot - 1:
+            ranges[-1] = (ranges[-1][0], slot)
+        else:
+            ranges.append((slot, slot))
+    return ranges
+
+
+class ClusterNode:
+    """A master of the cluster, as this node knows it."""
+
+    def __init__(self, node_id: str, host: str, port: int) -> None:
+        self.id: str = node_id
+        self.host: str = host
+        self.port: int = port
+        self.config_epoch: int = 0
+        self.link_up: bool = False
+        # unix ms of the last gossip request sent and answered
+        self.ping_sent: int = 0
+        self.pong_received: int = 0
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class ClusterLink:
+    """Outbound connection used to gossip with one node."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+
+    async def call(self, *request: bytes) -> bytes:
+        """## Send a request and return its reply, bulk strings unwrapped"""
+        self.writer.write(RespCoder.encode(list(request)))
+        await self.writer.drain()
+        header: bytes = await self.reader.readuntil(b"\r\n")
+        if header[:1] != b"$":
+            return header[:-2]
+        body: bytes = await self.reader.readexactly(int(header[1:-2]) + 2)
+        return body[:-2]
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class ClusterState:
+    """Slot ownership and node table of a `--cluster-enabled` server.
+
+    Gossip is kept minimal: once per period every known node is asked for
+    `CLUSTER NODES` over a regular client connection. A node is authoritative
+    for its own slots, and a claim only displaces the current owner when it
+    comes with a higher config epoch, which is how a slot handed over with
+    `CLUSTER SETSLOT <slot> NODE` spreads. Nodes listed by a peer are added
+    to the table, so meeting one node of a cluster is enough to join it.
+
+    The table is persisted to the `cluster-config-file` in the nodes.conf
+    layout Redis uses. Changes only mark it stale; cron rewrites it, so the
+    thousands of SETSLOT calls of a reshard cost a handful of writes.
+    """
+
+    GOSSIP_PERIOD_S: float = 1.0
+    GOSSIP_TIMEOUT_S: float = 2.0
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.myself: Optional[ClusterNode] = None
+        self.nodes: Dict[str, ClusterNode] = {}
+        # owner of every slot, None while unassigned
+        self.slots: List[Optional[ClusterNode]] = [None] * CLUSTER_SLOTS
+        self.migrating: Dict[int, ClusterNode] = {}
+        self.importing: Dict[int, ClusterNode] = {}
+        self.current_epoch: int = 0
+        self.config_file: Optional[str] = None
+        # addresses given to CLUSTER MEET whose node ID isn't known yet
+        self.handshakes: Set[Tuple[str, int]] = set()
+        self._links: Dict[Tuple[str, int], ClusterLink] = {}
+        self._gossiping: Set[Tuple[str, int]] = set()
+        self._last_gossip: float = 0.0
+        # nodes.conf lags behind the table
+        self._config_dirty: bool = False
+        # the loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def configure(self, config: ServerInfo) -> None:
+        self.enabled = config.cluster_enabled
+        if not self.enabled:
+            return
+        kvPair.index_slots(key_hash_slot)
+        self.config_file = os.path.join(config.dir, config.cluster_config_file)
+        if os.path.exists(self.config_file):
+            self.load(self.config_file)
+        if self.myself is None:
+            self.myself = ClusterNode(
+                os.urandom(20).hex(), config.cluster_announce_ip, config.port
+            )
+            self.nodes[self.myself.id] = self.myself
+        # the address may change between runs, the identity doesn't
+        self.myself.host, self.myself.port = config.cluster_announce_ip, config.port
+        self.write_config()
+
+    # slot ownership
+
+    def owned_slots(self, node: ClusterNode) -> List[int]:
+        return [slot for slot, owner in enumerate(self.slots) if owner is node]
+
+    def add_slots(self, slots: List[int]) -> Optional[str]:
+        """## Assign unassigned `slots` to this node
+
+        ### Returns:
+            - `Optional[str]`: error message, nothing is assigned when set
+        """
+        for slot in slots:
+            if self.slots[slot] is not None:
+                return f"Slot {slot} is already busy"
+        for slot in slots:
+            self.slots[slot] = self.myself
+        self.save()
+        return None
+
+    def set_slot(
+        self, slot: int, action: bytes, node_id: Optional[str]
+    ) -> Optional[str]:
+        """## `CLUSTER SETSLOT <slot> IMPORTING|MIGRATING|STABLE|NODE [node-id]`
+
+        ### Returns:
+            - `Optional[str]`: error message, the state is unchanged when set
+        """
+        node: Optional[ClusterNode] = None
+        if action != b"STABLE":
+            node = self.nodes.get(node_id or "")
+            if node is None:
+                return f"I don't know about node {node_id}"
+        if action == b"MIGRATING":
+            if self.slots[slot] is not self.myself:
+                return f"I'm not the owner of hash slot {slot}"
+            if node is self.myself:
+                return "Can't MIGRATE a slot to myself"
+            self.migrating[slot] = node  # type: ignore
+        elif action == b"IMPORTING":
+            if self.slots[slot] is self.myself:
+                return f"I'm already the owner of hash slot {slot}"
+            if node is self.myself:
+                return "Can't IMPORT a slot from myself"
+            self.importing[slot] = node  # type: ignore
+        elif action == b"STABLE":
+            self.migrating.pop(slot, None)
+            self.importing.pop(slot, None)
+        elif action == b"NODE":
+            assert node and self.myself
+            if self.slots[slot] is self.myself and node is not self.myself:
+                if kvPair.count_keys_in_slot(slot):
+                    return f"Can't assign hashslot {slot} to a different node while I still hold keys for this hash slot."
+            if node is self.myself and self.importing.pop(slot, None) is not None:
+                # the new epoch is what lets the other nodes accept the claim
+                self.current_epoch += 1
+                self.myself.config_epoch = self.current_epoch
+            self.migrating.pop(slot, None)
+            self.slots[slot] = node
+        else:
+            return "Invalid CLUSTER SETSLOT action or number of arguments. Try CLUSTER HELP"
+        self.save()
+        return None
+
+    def route(self, keys: List[bytes], asking: bool) -> Optional[bytes]:
+        """## The redirect or error for a request touching `keys`, None when it runs here"""
+        if not keys:
+            return None
+        slot: int = key_hash_slot(keys[0])
+        if any(key_hash_slot(key) != slot for key in keys[1:]):
+            return CROSSSLOT_ERROR
+        owner: Optional[ClusterNode] = self.slots[slot]
+        if owner is self.myself:
+            target: Optional[ClusterNode] = self.migrating.get(slot)
+            # keys already moved are looked up on the importing node
+            if target is not None and not all(kvPair.has(key) for key in keys):
+                return f"-ASK {slot} {target.address}{RespCoder.TERMINATOR}".encode()
+            return None
+        if asking and slot in self.importing:
+            return None
+        if owner is None:
+            return CLUSTERDOWN_ERROR
+        return f"-MOVED {slot} {owner.address}{RespCoder.TERMINATOR}".encode()
+
+    # CLUSTER subcommand replies
+
+    def describe_node(self, node: ClusterNode) -> str:
+        """## One line of CLUSTER NODES / nodes.conf"""
+        flags: str = "myself,master" if node is self.myself else "master"
+        link: str = (
+            "connected" if node is self.myself or node.link_up else "disconnected"
+        )
+        fields: List[str] = [
+            node.id,
+            f"{node.address}@{node.port + 10000}",
+            flags,
+            "-",
+            str(node.ping_sent),
+            str(node.pong_received),
+            str(node.config_epoch),
+            link,
+        ]
+        for first, last in slot_ranges(self.owned_slots(node)):
+            fields.append(str(first) if first == last else f"{first}-{last}")
+        if node is self.myself:
+            for slot, target in sorted(self.migrating.items()):
+                fields.append(f"[{slot}->-{target.id}]")
+            for slot, source in sorted(self.importing.items()):
+                fields.append(f"[{slot}-<-{source.id}]")
+        return " ".join(fields)
+
+    def nodes_description(self) -> str:
+        return "".join(self.describe_node(node) + "\n" for node in self.nodes.values())
+
+    def info(self) -> List[Tuple[str, str]]:
+        assert self.myself
+        assigned: int = sum(1 for owner in self.slots if owner is not None)
+        sizes: Set[str] = {owner.id for owner in self.slots if owner is not None}
+        return [
+            ("cluster_state", "ok" if assigned == CLUSTER_SLOTS else "fail"),
+            ("cluster_slots_assigned", str(assigned)),
+            ("cluster_slots_ok", str(assigned)),
+            ("cluster_slots_pfail", "0"),
+            ("cluster_slots_fail", "0"),
+            ("cluster_known_nodes", str(len(self.nodes))),
+            ("cluster_size", str(len(sizes))),
+            ("cluster_current_epoch", str(self.current_epoch)),
+            ("cluster_my_epoch", str(self.myself.config_epoch)),
+        ]
+
+    def slots_reply(self) -> List:
+        reply: List = []
+        for node in self.nodes.values():
+            for first, last in slot_ranges(self.owned_slots(node)):
+                reply.append([first, last, [node.host, node.port, node.id, []]])
+        reply.sort(key=lambda entry: entry[0])
+        return reply
+
+    def shards_reply(self) -> List:
+        reply: List = []
+        for node in self.nodes.values():
+            ranges: List[Tuple[int, int]] = slot_ranges(self.owned_slots(node))
+            reply.append(
+                [
+                    "slots",
+                    [bound for slot_range in ranges for bound in slot_range],
+                    "nodes",
+                    [
+                        [
+                            "id",
+                            node.id,
+                            "port",
+                            node.port,
+                            "ip",
+                            node.host,
+                            "endpoint",
+                            node.host,
+                            "role",
+                            "master",
+                            "replication-offset",
+                            0,
+                            "health",
+                            "online" if node is self.myself or node.link_up else "fail",
+                        ]
+                    ],
+                ]
+            )
+        return reply
+
+    # gossip
+
+    def meet(self, host: str, port: int) -> None:
+        if not any(
+            (node.host, node.port) == (host, port) for node in self.nodes.values()
+        ):
+            self.handshakes.add((host, port))
+
+    def cron(self) -> None:
+        if not self.enabled:
+            return
+        if self._config_dirty:
+            try:
+                self.write_config()
+            except OSError as e:
+                # left stale, the next cron tries again
+                logging.warning("Could not save the cluster config file: %s", e)
+        if time.monotonic() - self._last_gossip < self.GOSSIP_PERIOD_S:
+            return
+        self._last_gossip = time.monotonic()
+        addresses: Set[Tuple[str, int]] = set(self.handshakes)
+        addresses.update(
+            (node.host, node.port)
+            for node in self.nodes.values()
+            if node is not self.myself
+        )
+        for address in addresses - self._gossiping:
+            self._gossiping.add(address)
+            task: asyncio.Task = asyncio.create_task(self._gossip(address))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _gossip(self, address: Tuple[str, int]) -> None:
+        assert self.myself
+        node: Optional[ClusterNode] = self._node_at(address)
+        try:
+            link: Optional[ClusterLink] = self._links.get(address)
+            if link is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*address), self.GOSSIP_TIMEOUT_S
+                )
+                link = self._links[address] = ClusterLink(reader, writer)
+                # make sure the peer gossips with us as well
+                await asyncio.wait_for(
+                    link.call(
+                        b"CLUSTER",
+                        b"MEET",
+                        self.myself.host.encode(),
+                        b"%d" % self.myself.port,
+                    ),
+                    self.GOSSIP_TIMEOUT_S,
+                )
+            if node is not None:
+                node.ping_sent = int(time.time() * 1000)
+            description: bytes = await asyncio.wait_for(
+                link.call(b"CLUSTER", b"NODES"), self.GOSSIP_TIMEOUT_S
+            )
+            self.merge(address, description.decode())
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logging.debug("Cluster gossip with %s failed: %s", address, e)
+            link = self._links.pop(address, None)
+            if link is not None:
+                link.close()
+            if node is not None:
+                node.link_up = False
+        finally:
+            self._gossiping.discard(address)
+
+    def _node_at(self, address: Tuple[str, int]) -> Optional[ClusterNode]:
+        for node in self.nodes.values():
+            if (node.host, node.port) == address:
+                return node
+        return None
+
+    def merge(self, address: Tuple[str, int], description: str) -> None:
+        """## Fold a peer's CLUSTER NODES reply into the local view"""
+        assert self.myself
+        changed: bool = False
+        for line in description.splitlines():
+            fields: List[str] = line.split()
+            if len(fields) < 8 or fields[0] == self.myself.id:
+                continue
+            node_id, flags, epoch = fields[0], fields[2], int(fields[6])
+            host, _, port = fields[1].split("@")[0].rpartition(":")
+            sender: bool = "myself" in flags.split(",")
+            node: Optional[ClusterNode] = self.nodes.get(node_id)
+            if node is None:
+                if sender:
+                    # the address we reached it at is the one to use
+                    host, port = address[0], str(address[1])
+                node = self.nodes[node_id] = ClusterNode(node_id, host, int(port))
+                self.handshakes.discard((node.host, node.port))
+                changed = True
+            if not sender:
+                # third-party news is only trusted for unassigned slots
+                for slot in self._parse_slots(fields[8:]):
+                    if self.slots[slot] is None:
+                        self.slots[slot] = node
+                        changed = True
+                continue
+            self.handshakes.discard(address)
+            node.link_up = True
+            node.pong_received = int(time.time() * 1000)
+            if epoch != node.config_epoch:
+                node.config_epoch = epoch
+                changed = True
+            self.current_epoch = max(self.current_epoch, epoch)
+            for slot in self._parse_slots(fields[8:]):
+                owner: Optional[ClusterNode] = self.slots[slot]
+                if owner is node:
+                    continue
+                if owner is None or epoch > owner.config_epoch:
+                    self.slots[slot] = node
+                    if owner is self.myself:
+                        self.migrating.pop(slot, None)
+                    changed = True
+        if changed:
+            self.save()
+
+    @staticmethod
+    def _parse_slots(fields: List[str]) -> List[int]:
+        slots: List[int] = []
+        for field in fields:
+            # migrating and importing markers only concern their own node
+            if field.startswith("["):
+                continue
+            first, _, last = field.partition("-")
+            slots.extend(range(int(first), int(last or first) + 1))
+        return slots
+
+    # nodes.conf
+
+    def save(self) -> None:
+        """## Have the next cron rewrite nodes.conf"""
+        self._config_dirty = True
+
+    def write_config(self) -> None:
+        """## Replace nodes.conf with the current table, durably"""
+        if self.config_file is None:
+            return
+        temp_file: str = f"{self.config_file}.tmp-{os.getpid()}"
+        with open(temp_file, "w") as f:
+            f.write(self.nodes_description())
+            f.write(f"vars currentEpoch {self.current_epoch} lastVoteEpoch 0\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.config_file)
+        fsync_directory(self.config_file)
+        self._config_dirty = False
+
+    def load(self, filename: str) -> None:
+        pending: List[List[str]] = []
+        with open(filename) as f:
+            for line in f:
+                fields: List[str] = line.split()
+                if not fields:
+                    continue
+                if fields[0] == "vars":
+                    self.current_epoch = int(fields[fields.index("currentEpoch") + 1])
+                    continue
+                host, _, port = fields[1].split("@")[0].rpartition(":")
+                node = ClusterNode(fields[0], host, int(port))
+                node.config_epoch = int(fields[6])
+                self.nodes[node.id] = node
+                if "myself" in fields[2].split(","):
+                    self.myself = node
+                pending.append(fields)
+        for fields in pending:
+            node = self.nodes[fields[0]]
+            for field in fields[8:]:
+                if field.startswith("["):
+                    slot, arrow, peer = field[1:-1].partition("->-")
+                    if not arrow:
+                        slot, _, peer = field[1:-1].partition("-<-")
+                        if peer in self.nodes:
+                            self.importing[int(slot)] = self.nodes[peer]
+                    elif peer in self.nodes:
+                        self.migrating[int(slot)] = self.nodes[peer]
+                    continue
+                for slot in self._parse_slots([field]):
+                    self.slots[slot] = node
+
+
+cluster: ClusterState = ClusterState()
@@ -1,29 +1,49 @@
 from abc import ABC, abstractmethod
 import asyncio
-import base64
-from dataclasses import asdict
-from typing import List, Tuple
-from app.handler.server_conf import ServerInfo
-from app.processor.rdb_file_processor import RDBFileProcessor
+import fnmatch
+import itertools
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import ClassVar, Dict, List, Tuple
+from app.handler.server_conf import ServerInfo, ServerRole
+from app.processor.append_only_file import aof
+from app.processor.cluster import CLUSTER_SLOTS, cluster, key_hash_slot
+from app.processor.command_stats import CommandStats
+from app.processor.rdb_file_processor import RDBError, dump_value, restore_value
+from app.processor.rdb_saver import rdb_saver
+from app.processor.replication import DisklessSync, replication
+from app.processor.replication_backlog import repl_backlog
 from app.processor.resp_coder import EMPTY_BYTE, RespCoder
 from app.storage.storage import (
-    STREAM_CONDITIONALS,
-    STREAM_LOCK,
     Entry,
+    KeyspaceStats,
+    PersistenceStats,
     RespDatatypes,
+    STREAM_ID_MAX,
+    PendingEntry,
+    SortedIDSet,
+    Stream,
+    StreamConsumer,
     StreamEntry,
+    StreamGroup,
+    StreamID,
+    StreamWaiter,
+    format_stream_id,
     kvPair,
+    stream_waiters,
 )
 from typing import Optional
 import time
+from time import perf_counter_ns
 import enum
-import sys
 import os
 
 
 class FollowupCode(enum.Enum):
     NO_FOLLOWUP = 0
     SEND_RDB = 1
+    # EOF-marked header of a snapshot streamed by a diskless sync
+    SEND_RDB_EOF = 2
 
 
 class Command(enum.Enum):
@@ -43,72 +63,181 @@ class Command(enum.Enum):
     GETACK = enum.auto()
     WAIT = enum.auto()
     KEYS = enum.auto()
+    SAVE = enum.auto()
+    BGSAVE = enum.auto()
+    LASTSAVE = enum.auto()
+    BGREWRITEAOF = enum.auto()
+    XGROUP = enum.auto()
+    XREADGROUP = enum.auto()
+    XACK = enum.auto()
+    XPENDING = enum.auto()
+    XCLAIM = enum.auto()
+    XAUTOCLAIM = enum.auto()
+    XTRIM = enum.auto()
+    XINFO = enum.auto()
+    DEL = enum.auto()
+    CLUSTER = enum.auto()
+    ASKING = enum.auto()
+    MIGRATE = enum.auto()
+    RESTORE = enum.auto()
+    LATENCY = enum.auto()
+
+
+class CommandFlag(enum.Flag):
+    NONE = 0
+    WRITE = enum.auto()
+    READONLY = enum.auto()
+    BLOCKING = enum.auto()
+    # runs in an importing slot as if the client had sent ASKING
+    ASKING = enum.auto()
+    # acts on all the keys of the server running it, not only on routed ones
+    KEYSPACE = enum.auto()
 
 
 class CommandProcessor(ABC):
     command: Command = Command.NONE
+    flags: CommandFlag = CommandFlag.NONE
+    request: List[bytes] = []
+    # the spec's counters, None for replies to requests that matched no command
+    stats: Optional[CommandStats] = None
+    # set by writes that can change the dataset and still reply with an error
+    effects_on_error: bool = False
 
     @abstractmethod
     async def response(self) -> Tuple[bytes, bytes]:
         pass
 
     @classmethod
-    def get_command(cls, input: bytes, server_info: ServerInfo):
-        command = input.decode()
-        commands: List[str] = command.split(RespCoder.TERMINATOR)
-        # all everything now including bulk strings
-        command_to_exec: str = commands[2].strip().upper()
-        # adjust to only extract command params from the format (len,param)
-        args: List = [val for idx, val in enumerate(commands[4:]) if idx % 2 == 0]
-        print(f"command: {command_to_exec}, args = {args}")
-        if command_to_exec == Command.ECHO.name:
-            return Echo(args)
-        elif command_to_exec == Command.PING.name:
-            return Ping([])
-        elif command_to_exec == Command.GET.name:
-            return Get(os.path.join(server_info.dir, server_info.dbfilename), args)
-        elif command_to_exec == Command.SET.name:
-            return Set(args)
-        elif command_to_exec == Command.TYPE.name:
-            return Type(args)
-        elif command_to_exec == Command.INFO.name:
-            args = [server_info]
-            return Info(args)
-        elif command_to_exec == Command.REPLCONF.name:
-            # args = [server_info]
-            # if Command.GETACK.name in args:
-            #         print("[***] Returning ack based data...")
-            #         return Replconf(["ACK", "0"])
-            return Replconf(args)
-        elif command_to_exec == Command.PSYNC.name:
-            args = [server_info, args]
-            return Psync(args)
-        elif command_to_exec == Command.XADD.name:
-            return Xadd(args)
-        elif command_to_exec == Command.XRANGE.name:
-            return XRange(args)
-        elif command_to_exec == Command.XREAD.name:
-            return XRead(args)
-        elif command_to_exec == Command.WAIT.name:
-            return Wait([str(len(server_info.replicas))])
-        elif command_to_exec == Command.CONFIG.name:
-            return Config(args, serverConf=server_info)
-        elif command_to_exec == Command.KEYS.name:
-            return Keys(
-                args,
-                rdb_file_name=os.path.join(server_info.dir, server_info.dbfilename),
-            )
-
-
-async def get_followup_response(followup_code: FollowupCode) -> bytes:
+    def from_args(
+        cls, args: List[bytes], server_info: ServerInfo
+    ) -> "CommandProcessor":
+        return cls(args)
+
+    @classmethod
+    def keys(cls, request: List[bytes], key_range: Tuple[int, int, int]) -> List[bytes]:
+        """## The key arguments of `request`
+
+        ### Args:
+            - `request (List[bytes])`: command name followed by its arguments
+            - `key_range (Tuple[int, int, int])`: the spec's first key, last key and step,
+              positions in `request` where a negative last key counts from the end
+        """
+        first, last, step = key_range
+        if not first or len(request) <= first:
+            return []
+        if last < 0:
+            last += len(request)
+        return request[first : last + 1 : step]
+
+    def aof_requests(self) -> List[List[bytes]]:
+        """## The requests that replay this command's effect from the append-only file
+
+        Commands whose outcome depends on time or on state that replay can't
+        reproduce log an equivalent deterministic form, or nothing at all.
+        """
+        return [self.request]
+
+    async def call(self) -> Tuple[bytes, bytes]:
+        """## Run the command along with the bookkeeping shared by every dispatch"""
+        started: int = perf_counter_ns()
+        response, followup = await self.response()
+        stats: Optional[CommandStats] = self.stats
+        if stats is not None:
+            stats.samples.append(perf_counter_ns() - started)
+        if response[:1] == b"-":
+            if stats is not None:
+                stats.failed_calls += 1
+            if self.effects_on_error:
+                self.propagate()
+        elif CommandFlag.WRITE in self.flags:
+            self.propagate()
+        return response, followup
+
+    def propagate(self) -> None:
+        """## Feed this command's effect to the append-only file and the replicas"""
+        requests: List[List[bytes]] = self.aof_requests()
+        if requests:
+            kvPair.dirty += 1
+        for request in requests:
+            # encoded once for the AOF and every replica
+            encoded: bytes = RespCoder.encode(request)
+            aof.feed(encoded)
+            replication.feed(encoded)
+
+    @classmethod
+    def get_command(
+        cls, request: List[bytes], server_info: ServerInfo
+    ) -> Optional["CommandProcessor"]:
+        """## Resolve a parsed request into its command processor
+
+        ### Args:
+            - `request (List[bytes])`: command name followed by its arguments, as produced by the parser
+            - `server_info (ServerInfo)`: server configuration handed to commands that need it
+
+        ### Returns:
+            - `Optional[CommandProcessor]`: processor for the request, an `ErrorReply` for unknown
+              commands or bad arity, or None for an empty request
+        """
+        if not request:
+            return None
+        spec: Optional[CommandSpec] = COMMAND_TABLE.get(request[0].upper())
+        if spec is None:
+            return ErrorReply(f"unknown command '{_printable(request[0])}'")
+        if not spec.accepts(len(request)):
+            spec.stats.rejected_calls += 1
+            return ErrorReply(
+                f"wrong number of arguments for '{_printable(request[0]).lower()}' command"
+            )
+        processor: CommandProcessor = spec.handler.from_args(request[1:], server_info)
+        processor.flags = spec.flags
+        processor.request = request
+        processor.stats = spec.stats
+        return processor
+
+    def reject(self) -> None:
+        """## Count a dispatch refused before the command ran"""
+        if self.stats is not None:
+            self.stats.rejected_calls += 1
+
+
+def command_keys(request: List[bytes]) -> List[bytes]:
+    """## The keys a request touches, empty for keyless or malformed requests"""
+    if not request:
+        return []
+    spec: Optional[CommandSpec] = COMMAND_TABLE.get(request[0].upper())
+    if spec is None or not spec.accepts(len(request)):
+        return []
+    return spec.handler.keys(request, spec.key_range)
+
+
+def command_flags(request: List[bytes]) -> CommandFlag:
+    """## The flags of the command a request names, none for unknown commands"""
+    if not request:
+        return CommandFlag.NONE
+    spec: Optional[CommandSpec] = COMMAND_TABLE.get(request[0].upper())
+    return CommandFlag.NONE if spec is None else spec.flags
+
+
+def _printable(arg: bytes) -> str:
+    """## Render a client-supplied argument inside an error or status line"""
+    return arg.decode(errors="replace")
+
+
+async def get_followup_response(
+    followup_code: FollowupCode, eof_mark: Optional[bytes] = None
+) -> bytes:
     if followup_code == FollowupCode.NO_FOLLOWUP:
         return EMPTY_BYTE
     elif followup_code == FollowupCode.SEND_RDB:
         return await Psync.rdb_sync()
+    elif followup_code == FollowupCode.SEND_RDB_EOF:
+        return await Psync.rdb_sync(eof_mark)
     return EMPTY_BYTE
 
 
 class Ping(CommandProcessor):
+    command = Command.PING
+
     async def response(self) -> Tuple[bytes, bytes]:
         return f"+PONG{RespCoder.TERMINATOR}".encode(), await get_followup_response(
             FollowupCode.NO_FOLLOWUP
@@ -123,9 +252,10 @@ class Echo(CommandProcessor):
 
     async def response(self) -> Tuple[bytes, bytes]:
         if isinstance(self.message, list):
-            self.message = "".join(self.message)
+            self.message = b"".join(self.message)
+        # a bulk reply, so payloads containing CR/LF come back intact
         return (
-            f"+{self.message}{RespCoder.TERMINATOR}".encode(),
+            RespCoder.encode(self.message),
             await get_followup_response(FollowupCode.NO_FOLLOWUP),
         )
 
@@ -135,61 +265,78 @@ class Echo(CommandProcessor):
 
 class Set(CommandProcessor):
     command = Command.SET
+    EXPIRY_OPTIONS: Dict[bytes, Tuple[int, bool]] = {
+        # option: (unit in ms, absolute)
+        b"EX": (1000, False),
+        b"PX": (1, False),
+        b"EXAT": (1000, True),
+        b"PXAT": (1, True),
+    }
 
     async def response(self) -> Tuple[bytes, bytes]:
-
-        val_len = len(self.val)
-        entry: Entry = Entry(self.val, val_len, self.px)
-        kvPair.add(self.key, entry)
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        kvPair.add(self.key, Entry(self.val), self.expires_at_ms)
         return f"+OK{RespCoder.TERMINATOR}".encode(), await get_followup_response(
             FollowupCode.NO_FOLLOWUP
         )
 
+    def aof_requests(self) -> List[List[bytes]]:
+        # relative expiries are logged as absolute deadlines so replay is exact
+        if self.expires_at_ms is None:
+            return [[b"SET", self.key, self.val]]
+        return [[b"SET", self.key, self.val, b"PXAT", b"%d" % self.expires_at_ms]]
+
     def __init__(self, message) -> None:
         self.message = message
         if not isinstance(self.message, list):
             raise Exception(f"cannot process {self.message}")
         if len(self.message) < 2:
             raise Exception(f"malfprmed key vals {self.message}")
-        self.key: str = self.message[0]
-        self.val: str = self.message[1]
-        if len(self.message) > 3:
-            self.px = int(self.message[3])
-        else:
-            self.px = None
+        self.key: bytes = self.message[0]
+        self.val: bytes = self.message[1]
+        self.expires_at_ms: Optional[int] = None
+        self.error: Optional[str] = None
+        options: List[bytes] = self.message[2:]
+        if len(options) % 2 or (
+            options and options[0].upper() not in self.EXPIRY_OPTIONS
+        ):
+            self.error = "syntax error"
+        elif options:
+            unit_ms, absolute = self.EXPIRY_OPTIONS[options[0].upper()]
+            try:
+                amount: int = int(options[1])
+            except ValueError:
+                self.error = "value is not an integer or out of range"
+                return
+            if amount <= 0:
+                self.error = "invalid expire time in 'set' command"
+                return
+            self.expires_at_ms = amount * unit_ms
+            if not absolute:
+                self.expires_at_ms += int(time.time() * 1000)
 
 
 class Get(CommandProcessor):
     command = Command.GET
 
     async def response(self) -> Tuple[bytes, bytes]:
-        key: str = "".join(self.message)
-        if self.rdb_file_name:
-            if os.path.exists(self.rdb_file_name):
-                rdb_file_processor = RDBFileProcessor(self.rdb_file_name)
-                response = rdb_file_processor.read_value_from_file(key)
-                return (
-                    response.encode(),
-                    await get_followup_response(FollowupCode.NO_FOLLOWUP),
-                )
+        key: bytes = self.message[0]
         val: Optional[Entry] = kvPair.get(key)
         if val:
-            found_ttl_ms: float = val.ttl_ms
-            curr_ttl_ms: float = time.time() * 1000
-            delta = curr_ttl_ms - found_ttl_ms
-            if delta <= 0 or val.infinite_alive:
-                return f"${val.len}{RespCoder.TERMINATOR}{val.value}{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            if val.type != RespDatatypes.STRING:
+                return RespCoder.WRONGTYPE_BYTES, await get_followup_response(
                     FollowupCode.NO_FOLLOWUP
                 )
-            else:
-                kvPair.remove(key)
-        return f"$-1{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            return RespCoder.encode(val.value), await get_followup_response(
+                FollowupCode.NO_FOLLOWUP
+            )
+        return RespCoder.NULL_BULK_STRING_BYTES, await get_followup_response(
             FollowupCode.NO_FOLLOWUP
         )
 
-    def __init__(self, rdb_file_name: str, message) -> None:
+    def __init__(self, message) -> None:
         self.message = message
-        self.rdb_file_name = rdb_file_name
 
 
 class Type(CommandProcessor):
@@ -199,11 +346,11 @@ class Type(CommandProcessor):
         self.message = message
 
     async def response(self) -> Tuple[bytes, bytes]:
-        lookup_key: str = self.message[0]
+        lookup_key: bytes = self.message[0]
         val: Optional[Entry] = kvPair.get(lookup_key)
         if val:
             return (
-                f"+{val.type}{RespCoder.TERMINATOR}".encode(),
+                f"+{val.type.type_name}{RespCoder.TERMINATOR}".encode(),
                 await get_followup_response(FollowupCode.NO_FOLLOWUP),
             )
         return f"+none{RespCoder.TERMINATOR}".encode(), await get_followup_response(
@@ -213,26 +360,94 @@ class Type(CommandProcessor):
 
 class Info(CommandProcessor):
     command = Command.INFO
+    SECTIONS: List[str] = [
+        "persistence",
+        "stats",
+        "replication",
+        "cluster",
+        "commandstats",
+        "latencystats",
+    ]
+    # only with INFO all/everything or when named, as in redis
+    NOT_DEFAULT: List[str] = ["commandstats", "latencystats"]
 
     def __init__(self, message) -> None:
         self.message = message
         self.server_info: ServerInfo = message[0]
+        self.sections: List[str] = [
+            _printable(section).lower() for section in message[1:]
+        ]
         self.info_keys = ["role", "master_replid", "master_repl_offset"]
 
+    @classmethod
+    def from_args(cls, args: List[bytes], server_info: ServerInfo) -> "Info":
+        return cls([server_info, *args])
+
     async def response(self) -> Tuple[bytes, bytes]:
-        print(f"info messag is : {self.server_info}")
+        requested: List[str] = self.sections
+        if not requested or "default" in requested:
+            requested = requested + [
+                s for s in self.SECTIONS if s not in self.NOT_DEFAULT
+            ]
+        if any(s in ("all", "everything") for s in requested):
+            requested = self.SECTIONS
         info_data: str = ""
-        server_info = asdict(self.server_info)
-        for key in self.info_keys:
-            if key == "role":
-                val = server_info[key].value
-            else:
-                val = str(server_info[key])
-            info: str = f"{key}:{val}{RespCoder.TERMINATOR}"
-            info_data += info
-        return RespCoder.encode_as_simple_str(
-            info_data
-        ).encode(), await get_followup_response(FollowupCode.NO_FOLLOWUP)
+        for section in self.SECTIONS:
+            if section not in requested:
+                continue
+            info_data += f"# {section.capitalize()}{RespCoder.TERMINATOR}"
+            for key, val in getattr(self, f"_{section}_section")():
+                info: str = f"{key}:{val}{RespCoder.TERMINATOR}"
+                info_data += info
+        return RespCoder.encode_as_simple_str(info_data), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def _replication_section(self) -> List[Tuple[str, str]]:
+        section: List[Tuple[str, str]] = [("role", self.server_info.role.value)]
+        section.extend(replication.info())
+        for key in self.info_keys[1:]:
+            section.append((key, str(getattr(self.server_info, key))))
+        section.extend(repl_backlog.info())
+        return section
+
+    def _cluster_section(self) -> List[Tuple[str, str]]:
+        return [("cluster_enabled", str(int(cluster.enabled)))]
+
+    def _commandstats_section(self) -> List[Tuple[str, str]]:
+        return [
+            (f"cmdstat_{name}", stats.info())
+            for name, stats in command_stats()
+            if stats.used
+        ]
+
+    def _latencystats_section(self) -> List[Tuple[str, str]]:
+        return [
+            (f"latency_percentiles_usec_{name}", stats.latency_info())
+            for name, stats in command_stats()
+            if stats.calls
+        ]
+
+    def _persistence_section(self) -> List[Tuple[str, str]]:
+        stats: PersistenceStats = kvPair.persistence_stats
+        section: List[Tuple[str, str]] = [
+            ("loading", "0"),
+            ("rdb_changes_since_last_save", str(kvPair.dirty)),
+        ]
+        for key, val in asdict(stats).items():
+            section.append((key, f"{val:.3f}" if isinstance(val, float) else str(val)))
+        section.extend(aof.info())
+        return section
+
+    def _stats_section(self) -> List[Tuple[str, str]]:
+        stats: KeyspaceStats = kvPair.keyspace_stats
+        return [
+            ("expired_keys", str(stats.expired_keys)),
+            (
+                "expire_cycle_cpu_milliseconds",
+                str(int(stats.expire_cycle_cpu_milliseconds)),
+            ),
+        ]
 
 
 class Replconf(CommandProcessor):
@@ -242,8 +457,23 @@ class Replconf(CommandProcessor):
     def __init__(self, message) -> None:
         self.message = message
         # self.server_info: ServerInfo = message[0]
+        # offset a replica reports with REPLCONF ACK <offset>
+        self.ack_offset: Optional[int] = None
+        # port a replica serves clients on, from REPLCONF listening-port <port>
+        self.listening_port: Optional[int] = None
+        option: bytes = message[0].lower() if message else b""
+        try:
+            if len(message) >= 2 and option == b"ack":
+                self.ack_offset = int(message[1])
+            elif len(message) >= 2 and option == b"listening-port":
+                self.listening_port = int(message[1])
+        except ValueError:
+            pass
 
     async def response(self) -> Tuple[bytes, bytes]:
+        if self.ack_offset is not None:
+            # the master never replies to acknowledgements
+            return EMPTY_BYTE, EMPTY_BYTE
         # if "ACK" in self.message:
         #     print(" IN replconf ack code")
         #     return "*3\r\n$8\r\nREPLCONF\r\n$3\r\nACK\r\n$1\r\n0\r\n".encode(),await get_followup_response(
@@ -252,10 +482,10 @@ class Replconf(CommandProcessor):
         # return self.OK_RESPONSE.encode(), await get_followup_response(
         #     FollowupCode.NO_FOLLOWUP
         # )
-        if "GETACK" in self.message:
+        if b"GETACK" in self.message:
             response = ["REPLCONF", "ACK", str(self.message[0])]
             return (
-                RespCoder.encode(response).encode(),
+                RespCoder.encode(response),
                 # "*3\r\n$8\r\nREPLCONF\r\n$3\r\nACK\r\n$1\r\n0\r\n".encode(),
                 await get_followup_response(FollowupCode.NO_FOLLOWUP),
             )
@@ -268,35 +498,262 @@ class Replconf(CommandProcessor):
 class Psync(CommandProcessor):
     command = Command.PSYNC
     FULLRESYNC: str = "FULLRESYNC"
-    EMPTY_RDB_FILE = b"UkVESVMwMDEx+glyZWRpcy12ZXIFNy4yLjD6CnJlZGlzLWJpdHPAQPoFY3RpbWXCbQi8ZfoIdXNlZC1tZW3CsMQQAPoIYW9mLWJhc2XAAP/wbjv+wP9aog=="
+    CONTINUE: str = "CONTINUE"
 
     def __init__(self, message) -> None:
         self.message = message
         self.server_info: ServerInfo = message[0]
         self.args: List = message[1]
+        # replication offset the replica is at once the reply is sent
+        self.sync_offset: Optional[int] = None
+        # set when the snapshot is streamed by a shared diskless sync
+        self.diskless_sync: Optional[DisklessSync] = None
+
+    @classmethod
+    def from_args(cls, args: List[bytes], server_info: ServerInfo) -> "Psync":
+        return cls([server_info, args])
 
     async def response(self) -> Tuple[bytes, bytes]:
-        print(f"Psync request on master....")
-        if (len(self.args) < 2) or (self.args[0] != "?" and self.args[1] != "-1"):
-            print("Invalid psync request")
-            return f"+ERR Invalid PSNC request with params {self.args[0]} and {self.args[1]}".encode(), await get_followup_response(
-                FollowupCode.NO_FOLLOWUP
+        if self.server_info.workers > 1:
+            # each worker only holds a slice of the keyspace
+            return (
+                f"-ERR replication is not supported with --workers{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
             )
+        replid, offset_arg = self.args[0], self.args[1]
         master_replid: str = self.server_info.master_replid
-        master_repl_offset: str = str(self.server_info.master_repl_offset)
-        return f"+{self.FULLRESYNC} {master_replid} {master_repl_offset}{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+        if replid == master_replid.encode():
+            try:
+                # the replica asks for the first byte it is missing
+                offset: int = int(offset_arg) - 1
+            except ValueError:
+                return (
+                    f"-ERR value is not an integer or out of range{RespCoder.TERMINATOR}".encode(),
+                    EMPTY_BYTE,
+                )
+            if repl_backlog.covers(offset):
+                logging.info(
+                    "Partial resynchronization accepted from offset %d", offset
+                )
+                self.sync_offset = offset
+                return (
+                    f"+{self.CONTINUE} {master_replid}{RespCoder.TERMINATOR}".encode(),
+                    await get_followup_response(FollowupCode.NO_FOLLOWUP),
+                )
+            logging.info(
+                "Partial resynchronization from offset %d not possible", offset
+            )
+        if not repl_backlog.active:
+            repl_backlog.create(self.server_info.master_repl_offset)
+        if self.server_info.repl_diskless_sync:
+            # FULLRESYNC goes out once the shared snapshot is forked, with
+            # the offset it reflects
+            self.diskless_sync = await replication.join_diskless_sync()
+            self.sync_offset = self.diskless_sync.offset
+            return f"+{self.FULLRESYNC} {master_replid} {self.sync_offset}{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+                FollowupCode.SEND_RDB_EOF, self.diskless_sync.eof_mark
+            )
+        # the snapshot is taken before anything else runs, so the replica
+        # continues from the offset it reflects
+        self.sync_offset = self.server_info.master_repl_offset
+        return f"+{self.FULLRESYNC} {master_replid} {self.sync_offset}{RespCoder.TERMINATOR}".encode(), await get_followup_response(
             FollowupCode.SEND_RDB
         )
 
     @classmethod
-    async def rdb_sync(cls) -> bytes:
-        with open(kvPair.rdb_file, "r") as f:
-            print("[*****] parsing file...")
-            rdb_content = base64.b64decode(cls.EMPTY_RDB_FILE)
-            rdb_length = len(rdb_content)
-            response: bytes = f"${rdb_length}\r\n".encode("utf-8") + rdb_content
-            print(f"PSYNC Command response: {response}")
-            return response
+    async def rdb_sync(cls, eof_mark: Optional[bytes] = None) -> bytes:
+        if eof_mark is not None:
+            # the payload and closing mark are streamed by the diskless sync
+            return b"$EOF:" + eof_mark + RespCoder.TERMINATOR.encode()
+        rdb_content = await rdb_saver.snapshot_bytes()
+        rdb_length = len(rdb_content)
+        response: bytes = f"${rdb_length}\r\n".encode("utf-8") + rdb_content
+        return response
+
+
+INVALID_STREAM_ID: bytes = (
+    b"-ERR Invalid stream ID specified as stream command argument\r\n"
+)
+
+
+def parse_stream_id(arg: bytes, default_seq: int = 0) -> StreamID:
+    """## Parse `<ms>-<seq>` or `<ms>` into a numeric stream ID
+
+    ### Args:
+        - `arg (bytes)`: ID as sent by the client
+        - `default_seq (int)`: sequence used when `arg` only has milliseconds
+
+    ### Raises:
+        - `ValueError`: when `arg` is not a valid ID
+    """
+    ms, sep, seq = arg.partition(b"-")
+    stream_id: StreamID = (int(ms), int(seq) if sep else default_seq)
+    if not (0 <= stream_id[0] <= STREAM_ID_MAX and 0 <= stream_id[1] <= STREAM_ID_MAX):
+        raise ValueError(f"stream ID out of range: {arg!r}")
+    return stream_id
+
+
+def stream_id_after(stream_id: StreamID) -> StreamID:
+    """## The smallest ID greater than `stream_id`"""
+    if stream_id[1] == STREAM_ID_MAX:
+        return stream_id[0] + 1, 0
+    return stream_id[0], stream_id[1] + 1
+
+
+def encode_stream_entries(entries: List[StreamEntry]) -> List:
+    return [[entry.stream_id, entry.fields] for entry in entries]
+
+
+def parse_stream_read_args(
+    command_name: str, args: List[bytes], noack_allowed: bool
+) -> Tuple[Optional[int], Optional[int], bool, List[bytes], List[bytes]]:
+    """## Parse `[COUNT n] [BLOCK ms] [NOACK] STREAMS key [key ...] id [id ...]`
+
+    ### Args:
+        - `command_name (str)`: command name used in error messages
+        - `args (List[bytes])`: the arguments, starting at the first option
+        - `noack_allowed (bool)`: whether NOACK is a valid option
+
+    ### Returns:
+        - `Tuple`: count, block timeout in ms (None when not blocking), noack, keys and IDs
+
+    ### Raises:
+        - `ValueError`: with the error message for the client
+    """
+    count: Optional[int] = None
+    block_ms: Optional[int] = None
+    noack: bool = False
+    i: int = 0
+    while i < len(args) and args[i].upper() != b"STREAMS":
+        option: bytes = args[i].upper()
+        if option == b"NOACK" and noack_allowed:
+            noack = True
+            i += 1
+            continue
+        if option not in (b"COUNT", b"BLOCK") or i + 1 >= len(args):
+            raise ValueError("syntax error")
+        try:
+            value: int = int(args[i + 1])
+        except ValueError:
+            raise ValueError("timeout is not an integer or out of range")
+        if option == b"COUNT":
+            count = value
+        elif value < 0:
+            raise ValueError("timeout is negative")
+        else:
+            block_ms = value
+        i += 2
+    streams: List[bytes] = args[i + 1 :]
+    if not streams or len(streams) % 2:
+        last_id: str = "'>'" if noack_allowed else "'$'"
+        raise ValueError(
+            f"Unbalanced '{command_name}' list of streams: for each stream key an ID or {last_id} must be specified."
+        )
+    half: int = len(streams) // 2
+    return count, block_ms, noack, streams[:half], streams[half:]
+
+
+class StreamLookupError(Exception):
+    """Raised with a ready-made error reply when a key or group can't be used."""
+
+    def __init__(self, reply: bytes) -> None:
+        super().__init__(reply)
+        self.reply: bytes = reply
+
+
+def get_stream(key: bytes) -> Optional[Stream]:
+    data: Optional[Entry] = kvPair.get(key)
+    if data is None:
+        return None
+    if data.type != RespDatatypes.STREAM:
+        raise StreamLookupError(RespCoder.WRONGTYPE_BYTES)
+    return data.value
+
+
+def get_group(
+    key: bytes, group_name: bytes, context: str = ""
+) -> Tuple[Stream, StreamGroup]:
+    stream: Optional[Stream] = get_stream(key)
+    group: Optional[StreamGroup] = (
+        stream.groups.get(group_name) if stream is not None else None
+    )
+    if stream is None or group is None:
+        raise StreamLookupError(
+            f"-NOGROUP No such key '{_printable(key)}' or consumer group '{_printable(group_name)}'{context}{RespCoder.TERMINATOR}".encode()
+        )
+    return stream, group
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+@dataclass
+class StreamTrim:
+    """The `MAXLEN|MINID [=|~] threshold [LIMIT count]` clause of XADD and XTRIM."""
+
+    # entries `~` evicts per call when no LIMIT is given
+    DEFAULT_LIMIT: ClassVar[int] = 100 * Stream.BLOCK_MAX_ENTRIES
+    max_len: Optional[int] = None
+    min_id: Optional[StreamID] = None
+    approximate: bool = False
+    limit: Optional[int] = None
+
+    def apply(self, stream: Stream) -> int:
+        return stream.trim(self.max_len, self.min_id, self.approximate, self.limit)
+
+
+def parse_stream_trim(args: List[bytes], i: int) -> Tuple[StreamTrim, int]:
+    """## Parse a trim clause whose strategy keyword sits at `args[i]`
+
+    ### Args:
+        - `args (List[bytes])`: the command arguments
+        - `i (int)`: index of `MAXLEN` or `MINID`
+
+    ### Returns:
+        - `Tuple[StreamTrim, int]`: the clause and the index right after it
+
+    ### Raises:
+        - `ValueError`: with the error message for the client
+    """
+    strategy: bytes = args[i].upper()
+    i += 1
+    trim = StreamTrim()
+    if i < len(args) and args[i] in (b"=", b"~"):
+        trim.approximate = args[i] == b"~"
+        i += 1
+    if i >= len(args):
+        raise ValueError("syntax error")
+    if strategy == b"MAXLEN":
+        try:
+            trim.max_len = int(args[i])
+        except ValueError:
+            raise ValueError("value is not an integer or out of range")
+        if trim.max_len < 0:
+            raise ValueError("The MAXLEN argument must be >= 0.")
+    else:
+        try:
+            trim.min_id = parse_stream_id(args[i])
+        except ValueError:
+            raise ValueError("Invalid stream ID specified as stream command argument")
+    i += 1
+    if i + 1 < len(args) and args[i].upper() == b"LIMIT":
+        try:
+            limit: int = int(args[i + 1])
+        except ValueError:
+            raise ValueError("value is not an integer or out of range")
+        if limit < 0:
+            raise ValueError("The LIMIT argument must be >= 0.")
+        if not trim.approximate:
+            raise ValueError(
+                "syntax error, LIMIT cannot be used without the special ~ option"
+            )
+        # LIMIT 0 lifts the cap on how much a single call evicts
+        trim.limit = limit or None
+        i += 2
+    elif trim.approximate:
+        trim.limit = StreamTrim.DEFAULT_LIMIT
+    return trim, i
 
 
 class Xadd(CommandProcessor):
@@ -308,115 +765,216 @@ class Xadd(CommandProcessor):
             raise Exception(f"cannot process {self.message}")
         if len(self.message) < 3:
             raise Exception(f"malformed key vals {self.message}")
-        self.stream_key: str = self.message[0]
-        self.stream_params: List[str] = self.message[1:]
+        self.stream_key: bytes = self.message[0]
+        self.nomkstream: bool = False
+        self.trim: Optional[StreamTrim] = None
+        self.error: Optional[str] = None
+        i: int = 1
+        try:
+            while i < len(message):
+                option: bytes = message[i].upper()
+                if option == b"NOMKSTREAM":
+                    self.nomkstream = True
+                    i += 1
+                elif option in (b"MAXLEN", b"MINID"):
+                    self.trim, i = parse_stream_trim(message, i)
+                else:
+                    break
+        except ValueError as e:
+            self.error = str(e)
+        # the ID followed by the field/value pairs
+        self.stream_params: List[bytes] = self.message[i:]
+        self.added_id: bytes = b""
+        self.trimmed: bool = False
+        self.length_after: int = 0
 
     async def response(self) -> Tuple[bytes, bytes]:
-        stream_id = self.stream_params[0]
-        if stream_id == "0-0":
-            return f"-ERR The ID specified in XADD must be greater than 0-0{RespCoder.TERMINATOR}".encode(), await get_followup_response(
-                FollowupCode.NO_FOLLOWUP
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        if len(self.stream_params) < 3 or len(self.stream_params) % 2 == 0:
+            return (
+                f"-ERR wrong number of arguments for 'xadd' command{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
             )
-        sentry_key: str = self.stream_params[1]
-        sentry_val: str = self.stream_params[2]
-        return await self._update_entry(
-            stream_id, sentry_key, sentry_val
-        ), await get_followup_response(FollowupCode.NO_FOLLOWUP)
+        stream_id: bytes = self.stream_params[0]
+        fields: List[bytes] = self.stream_params[1:]
+        return await self._update_entry(stream_id, fields), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
 
-    async def _update_entry(
-        self, stream_id: str, sentry_key: str, sentry_val: str
-    ) -> bytes:
-        # TODO: Fix this len logic to something more reasonable
-        val_len = 2
-        curr_id: str = ""
-        if data := kvPair.get(self.stream_key):
-            # handles the logic where key is found and it a valid stream
-            if data.type == RespDatatypes.STREAM.value and isinstance(data.value, list):
-                last_entry: StreamEntry = data.value[-1]
-                last_id: str = f"{last_entry.t_ms}-{last_entry.seq}"
-                stream_entry: StreamEntry = self._get_stream_entry(
-                    stream_id, sentry_key, sentry_val, last_entry
-                )
-                curr_id: str = stream_entry.stream_id
-                if curr_id <= last_id:
-                    return f"-ERR The ID specified in XADD is equal or smaller than the target stream top item{RespCoder.TERMINATOR}".encode()
-                else:
-                    print(f"stream_entry generated for next row = {stream_entry}")
-                    data.value.append(stream_entry)
-                    await self._notify_stream_add(self.stream_key)
-            else:
-                return f"+Not a valid stream key{RespCoder.TERMINATOR}".encode()
-        else:
+    async def _update_entry(self, stream_id: bytes, fields: List[bytes]) -> bytes:
+        data: Optional[Entry] = kvPair.get(self.stream_key)
+        if data is not None and data.type != RespDatatypes.STREAM:
+            return RespCoder.WRONGTYPE_BYTES
+        if data is None and self.nomkstream:
+            return RespCoder.NULL_BULK_STRING_BYTES
+        stream: Stream = data.value if data is not None else Stream()
+        if stream_id == b"*" and stream.last_id == (STREAM_ID_MAX, STREAM_ID_MAX):
+            return f"-ERR The stream has exhausted the last possible ID, unable to add more items{RespCoder.TERMINATOR}".encode()
+        try:
+            next_id: StreamID = self._next_id(stream_id, stream.last_id)
+        except ValueError:
+            return INVALID_STREAM_ID
+        if next_id == (0, 0):
+            return f"-ERR The ID specified in XADD must be greater than 0-0{RespCoder.TERMINATOR}".encode()
+        if next_id <= stream.last_id:
+            return f"-ERR The ID specified in XADD is equal or smaller than the target stream top item{RespCoder.TERMINATOR}".encode()
+        stream.append(StreamEntry(next_id, fields))
+        if data is None:
             ## This is equivalent to creating the cache entry for given key for the first time
-            stream_entry: StreamEntry = self._get_stream_entry(
-                stream_id, sentry_key, sentry_val, None
-            )
-            entry: Entry = Entry(
-                [stream_entry], val_len, ttl=None, type=RespDatatypes.STREAM.value
-            )
-            kvPair.add(self.stream_key, entry)
-            await self._notify_stream_add(self.stream_key)
-            curr_id: str = stream_entry.stream_id
-        return f"+{curr_id}{RespCoder.TERMINATOR}".encode()
-
-    async def _notify_stream_add(self, stream_key) -> None:
-        async with STREAM_LOCK:
-            print(f"stream_conditionals: {STREAM_CONDITIONALS}")
-            # Notify all the waiting XREAD commands for this key
-            if stream_key in STREAM_CONDITIONALS:
-                async with STREAM_CONDITIONALS[stream_key]:
-                    print(f"Notify all waiting XREAD commands for key: {stream_key}")
-                    STREAM_CONDITIONALS[stream_key].notify_all()
-
-    def _get_stream_entry(
-        self,
-        stream_id: str,
-        sentry_key: str,
-        sentry_val: str,
-        curr_entry: Optional[StreamEntry],
-    ) -> StreamEntry:
+            kvPair.add(self.stream_key, Entry(stream, RespDatatypes.STREAM))
+        if self.trim is not None:
+            self.trimmed = self.trim.apply(stream) > 0
+            self.length_after = len(stream)
+        stream_waiters.signal(self.stream_key, next_id)
+        self.added_id = format_stream_id(next_id)
+        return b"+%s\r\n" % self.added_id
+
+    def aof_requests(self) -> List[List[bytes]]:
+        if not self.added_id:
+            # NOMKSTREAM on a missing key
+            return []
+        # auto-generated IDs are logged as the ID that was actually assigned,
+        # and trimming as the exact length it left, since `~` depends on how
+        # the entries happen to be split into blocks
+        trim: List[bytes] = (
+            [b"MAXLEN", b"=", b"%d" % self.length_after] if self.trimmed else []
+        )
+        return [
+            [b"XADD", self.stream_key, *trim, self.added_id, *self.stream_params[1:]]
+        ]
+
+    def _next_id(self, stream_id: bytes, last_id: StreamID) -> StreamID:
         """
         This function handles the next seq generation based on :
-        - if the initial key does not exist
-            use the default sequence key [1 if sentry_t_ms == "0" else 0 ] id sentry_seq == "*" else sentry_seq
-        - if key exists in cache:
-            if provide seq == *:
-                generate next seq by incrementing sequence of last key if t_ms is same else just use the previous deafults
-            else:
-                use the sentry_seq provided
+        - `*`: current unix time in ms, or the last entry's ms if the clock went
+          back, with the next free sequence for that ms, moving on to the
+          next ms once the sequence is used up
+        - `<ms>-*`: the next free sequence for `ms` (starting at 1 for ms 0);
+          once used up, the last ID itself, which XADD then refuses
+        - `<ms>-<seq>` or `<ms>`: used as given
         ### Args:
-            - `sentry_t_ms (str)`: _description_
-            - `sentry_seq (str)`: _description_
-            - `sentry_key (str)`: _description_
-            - `sentry_val (str)`: _description_
-            - `curr_entry (Optional[StreamEntry])`: _description_
+            - `stream_id (bytes)`: ID argument of XADD
+            - `last_id (StreamID)`: last ID ever added to the stream, trimmed or not
 
         ### Returns:
-            - `StreamEntry`: newly generated stream sequence
+            - `StreamID`: ID for the new entry
         """
-        sentry_t_ms: str = str(int(time.time() * 1000))
-        sentry_seq: str = "0"
-        if stream_id != "*":
-            sentry_t_ms, sentry_seq = stream_id.split("-")
-
-        default_seq: int = 1 if sentry_t_ms == "0" else 0
-        if not curr_entry:
-            return StreamEntry(
-                t_ms=sentry_t_ms,
-                seq=default_seq if sentry_seq == "*" else int(sentry_seq),
-                entry_key=sentry_key,
-                entry_value=sentry_val,
+        if stream_id == b"*":
+            ms: int = int(time.time() * 1000)
+            if last_id[0] >= ms:
+                if last_id[1] == STREAM_ID_MAX:
+                    return last_id[0] + 1, 0
+                return last_id[0], last_id[1] + 1
+            return ms, 0
+        if stream_id.endswith(b"-*"):
+            ms = parse_stream_id(stream_id[:-2])[0]
+            if last_id[0] == ms:
+                return ms, min(last_id[1] + 1, STREAM_ID_MAX)
+            return ms, 1 if ms == 0 else 0
+        return parse_stream_id(stream_id)
+
+
+class XTrim(CommandProcessor):
+    command = Command.XTRIM
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.stream_key: bytes = message[0]
+        self.trim: Optional[StreamTrim] = None
+        self.error: Optional[str] = None
+        self.removed: int = 0
+        self.length_after: int = 0
+        try:
+            if message[1].upper() not in (b"MAXLEN", b"MINID"):
+                raise ValueError("syntax error")
+            self.trim, end = parse_stream_trim(message, 1)
+            if end != len(message):
+                raise ValueError("syntax error")
+        except ValueError as e:
+            self.error = str(e)
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        assert self.trim is not None
+        try:
+            stream: Optional[Stream] = get_stream(self.stream_key)
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        if stream is not None:
+            self.removed = self.trim.apply(stream)
+            self.length_after = len(stream)
+        return RespCoder.encode(self.removed), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def aof_requests(self) -> List[List[bytes]]:
+        if not self.removed:
+            return []
+        return [[b"XTRIM", self.stream_key, b"MAXLEN", b"=", b"%d" % self.length_after]]
+
+
+class XInfo(CommandProcessor):
+    command = Command.XINFO
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.subcommand: bytes = message[0].upper()
+        self.args: List[bytes] = message[1:]
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if self.subcommand != b"STREAM":
+            return (
+                f"-ERR unknown subcommand '{_printable(self.message[0])}'. Try XINFO HELP.{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
             )
-        else:
-            curr_t_ms: str = curr_entry.t_ms
-            curr_seq: int = curr_entry.seq
-            next_seq = default_seq if curr_t_ms != sentry_t_ms else curr_seq + 1
-            return StreamEntry(
-                t_ms=sentry_t_ms,
-                seq=int(sentry_seq) if sentry_seq != "*" else next_seq,
-                entry_key=sentry_key,
-                entry_value=sentry_val,
+        if len(self.args) != 1:
+            return (
+                f"-ERR wrong number of arguments for 'xinfo|stream' command{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
             )
+        try:
+            stream: Optional[Stream] = get_stream(self.args[0])
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        if stream is None:
+            return f"-ERR no such key{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        return RespCoder.encode(self._stream_info(stream)), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    @staticmethod
+    def _stream_info(stream: Stream) -> List:
+        first_id: Optional[StreamID] = stream.first_id()
+        first_entry: Optional[StreamEntry] = (
+            stream.get(first_id) if first_id is not None else None
+        )
+        last_entry: Optional[StreamEntry] = (
+            stream.get(stream.last_id) if len(stream) else None
+        )
+        return [
+            b"length",
+            len(stream),
+            b"radix-tree-keys",
+            len(stream.blocks()),
+            b"last-generated-id",
+            format_stream_id(stream.last_id),
+            b"max-deleted-entry-id",
+            format_stream_id(stream.max_deleted_id),
+            b"entries-added",
+            stream.entries_added,
+            b"recorded-first-entry-id",
+            format_stream_id(first_id or (0, 0)),
+            b"groups",
+            len(stream.groups),
+            b"memory-usage",
+            stream.memory_usage(),
+            b"first-entry",
+            encode_stream_entries([first_entry])[0] if first_entry else None,
+            b"last-entry",
+            encode_stream_entries([last_entry])[0] if last_entry else None,
+        ]
 
 
 class XRange(CommandProcessor):
@@ -424,147 +982,883 @@ class XRange(CommandProcessor):
 
     def __init__(self, message) -> None:
         self.message = message
-        self.stream_key: str = self.message[0]
-        self.args: List[str] = self.message[1:] if len(self.message) >= 2 else []
+        self.stream_key: bytes = self.message[0]
+        self.args: List[bytes] = self.message[1:]
 
     async def response(self) -> Tuple[bytes, bytes]:
+        try:
+            start, end, count = self._parse_args()
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
         entries: List[StreamEntry] = []
         if data := kvPair.get(self.stream_key):
-            if data.type == RespDatatypes.STREAM.value and isinstance(data.value, list):
-                start_range, end_range = self._find_range(data.value)
-                print(f"query range is : {start_range} to {end_range}")
-                entries = [
-                    entry
-                    for entry in data.value
-                    if self._is_in_range(entry, start_range, end_range)
-                ]
-                flatenned_entries: List = [entry.flattenned_entry for entry in entries]
-                return RespCoder.encode(
-                    flatenned_entries
-                ).encode(), await get_followup_response(FollowupCode.NO_FOLLOWUP)
-            else:
-                return (
-                    f"+Not a valid stream key{RespCoder.TERMINATOR}".encode(),
-                    await get_followup_response(FollowupCode.NO_FOLLOWUP),
+            if data.type != RespDatatypes.STREAM:
+                return RespCoder.WRONGTYPE_BYTES, await get_followup_response(
+                    FollowupCode.NO_FOLLOWUP
                 )
-        return "[]".encode(), await get_followup_response(FollowupCode.NO_FOLLOWUP)
-
-    def _find_range(self, data: List[StreamEntry]) -> Tuple[str, str]:
-        default_start_range: str = "0-1"
-        default_end_range: str = f"{sys.maxsize}-{sys.maxsize}"
-        if len(self.args) > 0:
-            start_range: str = (
-                data[0].stream_id if self.args[0] == "-" else self.args[0]
-            )
-            end_range: str = data[-1].stream_id if self.args[1] == "+" else self.args[1]
-            return start_range, end_range
-        return default_start_range, default_end_range
+            entries = data.value.range(start, end, count)
+        return RespCoder.encode(
+            encode_stream_entries(entries)
+        ), await get_followup_response(FollowupCode.NO_FOLLOWUP)
 
-    def _is_in_range(
-        self, entry: StreamEntry, start_range: str, end_range: str
-    ) -> bool:
-        stream_id: str = entry.stream_id
-        return stream_id >= start_range and stream_id <= end_range
+    def _parse_args(self) -> Tuple[StreamID, StreamID, Optional[int]]:
+        start: StreamID = (
+            (0, 0) if self.args[0] == b"-" else parse_stream_id(self.args[0])
+        )
+        end: StreamID = (
+            (STREAM_ID_MAX, STREAM_ID_MAX)
+            if self.args[1] == b"+"
+            else parse_stream_id(self.args[1], STREAM_ID_MAX)
+        )
+        count: Optional[int] = None
+        if len(self.args) == 4 and self.args[2].upper() == b"COUNT":
+            count = max(int(self.args[3]), 0)
+        elif len(self.args) != 2:
+            raise ValueError("syntax error")
+        return start, end, count
 
 
 class XRead(CommandProcessor):
     command = Command.XREAD
 
     def __init__(self, message) -> None:
-        self.message: List[str] = message
-        print(f"got xread args:{self.message}")
-        self.is_blocking: bool = True if message[0].lower() == "block" else False
-        self.block_wait_s: int = int(message[1]) // 1000 if self.is_blocking else -1
-        self.stream_keys = []
-        self.stream_start = []
-        streams: List[str] = message[3:] if self.is_blocking else self.message[1:]
-        self.stream_keys: List[str] = streams[: (len(streams) // 2)]
-        self.stream_start: List[str] = streams[(len(streams) // 2) :]
+        self.message: List[bytes] = message
+        self.count: Optional[int] = None
+        self.block_ms: Optional[int] = None
+        self.stream_keys: List[bytes] = []
+        self.stream_start: List[bytes] = []
+        self.error: Optional[str] = None
+        try:
+            self.count, self.block_ms, _, self.stream_keys, self.stream_start = (
+                parse_stream_read_args("xread", message, noack_allowed=False)
+            )
+        except ValueError as e:
+            self.error = str(e)
+
+    @classmethod
+    def keys(cls, request: List[bytes], key_range: Tuple[int, int, int]) -> List[bytes]:
+        try:
+            return parse_stream_read_args("xread", request[1:], noack_allowed=False)[3]
+        except ValueError:
+            return []
+
+    @property
+    def is_blocking(self) -> bool:
+        return self.block_ms is not None
 
     async def response(self) -> Tuple[bytes, bytes]:
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        for stream_key in self.stream_keys:
+            data: Optional[Entry] = kvPair.get(stream_key)
+            if data is not None and data.type != RespDatatypes.STREAM:
+                return RespCoder.WRONGTYPE_BYTES, EMPTY_BYTE
+        try:
+            after_ids: Dict[bytes, StreamID] = self._resolve_after_ids()
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
+        flattened_stream: List = self._read_streams(after_ids)
+        if not flattened_stream and self.is_blocking:
+            ## Block until an XADD crosses one of the requested IDs, for ever
+            ## with BLOCK 0, otherwise at most block_ms milliseconds
+            waiter = StreamWaiter(after_ids)
+            stream_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(
+                    waiter.future, self.block_ms / 1000 if self.block_ms else None
+                )
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                # also runs when the client disconnects and this is cancelled
+                stream_waiters.remove(waiter)
+            flattened_stream = self._read_streams(after_ids)
+        if not flattened_stream:
+            return (
+                RespCoder.NULL_BULK_STRING_BYTES,
+                await get_followup_response(FollowupCode.NO_FOLLOWUP),
+            )
+        return RespCoder.encode(flattened_stream), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def _resolve_after_ids(self) -> Dict[bytes, StreamID]:
+        """## Map every key to the ID its entries must come after
+
+        `$` stands for the last ID of the stream at the time of the call.
+        """
+        after_ids: Dict[bytes, StreamID] = {}
+        for stream_key, start in zip(self.stream_keys, self.stream_start):
+            if start != b"$":
+                after_ids[stream_key] = parse_stream_id(start)
+                continue
+            data: Optional[Entry] = kvPair.get(stream_key)
+            after_ids[stream_key] = data.value.last_id if data else (0, 0)
+        return after_ids
+
+    def _read_streams(self, after_ids: Dict[bytes, StreamID]) -> List:
+        """## Entries strictly after each given ID, for the keys that have any"""
         flattened_stream: List = []
-        for stream_key, stream_start in zip(self.stream_keys, self.stream_start):
-            flatenned_stream_for_key: List = [stream_key]
-
-            entries: List = await self._process_one_stream(stream_key, stream_start)
-            last_entry: StreamEntry = entries[-1]
-            if self.is_blocking:
-                ## Handle the case of blocking reads where in case of infitine timeouts - we discard all entries until next one
-                ## or, wait for a specified time before grabbing next entries
-                print(f"enabling blocking mode with timeout: {self.block_wait_s} sec")
-                if self.block_wait_s == 0:
-                    condition = None
-                    async with STREAM_LOCK:
-                        condition = asyncio.Condition()
-                        STREAM_CONDITIONALS[stream_key] = condition
-                    async with condition:
-                        await condition.wait()
+        for stream_key, after_id in after_ids.items():
+            data: Optional[Entry] = kvPair.get(stream_key)
+            if data is None or data.type != RespDatatypes.STREAM:
+                continue
+            entries: List[StreamEntry] = data.value.range(
+                stream_id_after(after_id), (STREAM_ID_MAX, STREAM_ID_MAX), self.count
+            )
+            if entries:
+                flattened_stream.append([stream_key, encode_stream_entries(entries)])
+        return flattened_stream
 
-                else:
-                    await asyncio.sleep(self.block_wait_s)
-                entries.clear()
-                next_seq: int = last_entry.seq + 1
-                next_stream_start: str = f"{last_entry.t_ms}-{next_seq}"
-                entries = await self._process_one_stream(stream_key, next_stream_start)
-                if len(entries) == 0:
-                    return (
-                        RespCoder.NULL_BULK_STRING_BYTES,
-                        await get_followup_response(FollowupCode.NO_FOLLOWUP),
-                    )
 
-            flatenned_entries: List = [entry.flattenned_entry for entry in entries]
-            flatenned_stream_for_key.append(flatenned_entries)
-            flattened_stream.append(flatenned_stream_for_key)
-        return RespCoder.encode(flattened_stream).encode(), await get_followup_response(
+class XGroup(CommandProcessor):
+    command = Command.XGROUP
+    MISSING_KEY: bytes = (
+        b"-ERR The XGROUP subcommand requires the key to exist. Note that for "
+        b"CREATE you may want to use the MKSTREAM option to create an empty "
+        b"stream automatically.\r\n"
+    )
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.subcommand: bytes = message[0].upper()
+        self.args: List[bytes] = message[1:]
+        # `$` resolved to a concrete ID, so replay doesn't depend on timing
+        self.resolved_id: Optional[StreamID] = None
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        handler = {
+            b"CREATE": (self._create, 3),
+            b"SETID": (self._set_id, 3),
+            b"DESTROY": (self._destroy, 2),
+            b"CREATECONSUMER": (self._create_consumer, 3),
+            b"DELCONSUMER": (self._delete_consumer, 3),
+        }.get(self.subcommand)
+        if handler is None:
+            return (
+                f"-ERR unknown subcommand '{_printable(self.message[0])}'. Try XGROUP HELP.{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        subcommand, min_args = handler
+        if len(self.args) < min_args:
+            return (
+                f"-ERR wrong number of arguments for 'xgroup|{_printable(self.subcommand).lower()}' command{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        try:
+            return subcommand(), await get_followup_response(FollowupCode.NO_FOLLOWUP)
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
+
+    def _create(self) -> bytes:
+        key, group_name, id_arg = self.args[:3]
+        options: List[bytes] = [option.upper() for option in self.args[3:]]
+        if any(option != b"MKSTREAM" for option in options):
+            return f"-ERR syntax error{RespCoder.TERMINATOR}".encode()
+        stream: Optional[Stream] = get_stream(key)
+        if stream is None and b"MKSTREAM" not in options:
+            return self.MISSING_KEY
+        if id_arg == b"$":
+            last_id: StreamID = stream.last_id if stream is not None else (0, 0)
+        else:
+            last_id = parse_stream_id(id_arg)
+        if stream is None:
+            stream = Stream()
+            kvPair.add(key, Entry(stream, RespDatatypes.STREAM))
+        if group_name in stream.groups:
+            return b"-BUSYGROUP Consumer Group name already exists\r\n"
+        stream.groups[group_name] = StreamGroup(group_name, last_id)
+        self.resolved_id = last_id
+        return f"+OK{RespCoder.TERMINATOR}".encode()
+
+    def _set_id(self) -> bytes:
+        key, group_name, id_arg = self.args[:3]
+        stream, group = get_group(key, group_name)
+        last_id: StreamID = (
+            stream.last_id if id_arg == b"$" else parse_stream_id(id_arg)
+        )
+        group.last_delivered_id = last_id
+        self.resolved_id = last_id
+        return f"+OK{RespCoder.TERMINATOR}".encode()
+
+    def _destroy(self) -> bytes:
+        key, group_name = self.args[:2]
+        stream: Optional[Stream] = get_stream(key)
+        if stream is None:
+            return self.MISSING_KEY
+        return RespCoder.encode(int(stream.groups.pop(group_name, None) is not None))
+
+    def _create_consumer(self) -> bytes:
+        key, group_name, consumer_name = self.args[:3]
+        _, group = get_group(key, group_name)
+        if consumer_name in group.consumers:
+            return RespCoder.encode(0)
+        group.consumer(consumer_name, _now_ms())
+        return RespCoder.encode(1)
+
+    def _delete_consumer(self) -> bytes:
+        key, group_name, consumer_name = self.args[:3]
+        _, group = get_group(key, group_name)
+        return RespCoder.encode(group.delete_consumer(consumer_name))
+
+    def aof_requests(self) -> List[List[bytes]]:
+        if self.resolved_id is None:
+            return [self.request]
+        return [
+            [*self.request[:4], format_stream_id(self.resolved_id), *self.request[5:]]
+        ]
+
+
+def _xclaim_request(
+    key: bytes,
+    group: StreamGroup,
+    consumer_name: bytes,
+    stream_id: StreamID,
+    pending: PendingEntry,
+) -> List[bytes]:
+    """## An absolute, forced claim recreating `pending`, the way Redis propagates it"""
+    return [
+        b"XCLAIM",
+        key,
+        group.name,
+        consumer_name,
+        b"0",
+        format_stream_id(stream_id),
+        b"TIME",
+        b"%d" % pending.delivery_time_ms,
+        b"RETRYCOUNT",
+        b"%d" % pending.delivery_count,
+        b"FORCE",
+        b"JUSTID",
+        b"LASTID",
+        format_stream_id(group.last_delivered_id),
+    ]
+
+
+class XReadGroup(CommandProcessor):
+    command = Command.XREADGROUP
+    NOGROUP_CONTEXT: str = " in XREADGROUP with GROUP option"
+
+    def __init__(self, message) -> None:
+        self.message: List[bytes] = message
+        self.count: Optional[int] = None
+        self.block_ms: Optional[int] = None
+        self.noack: bool = False
+        self.stream_keys: List[bytes] = []
+        self.stream_start: List[bytes] = []
+        self.error: Optional[str] = None
+        # IDs handed out as new entries, per key, for the append-only file
+        self.delivered: Dict[bytes, List[StreamID]] = {}
+        # pending IDs delivered again from the history, per key
+        self.redelivered: Dict[bytes, Tuple[StreamGroup, List[StreamID]]] = {}
+        # keys whose group got the consumer created by this read
+        self.created_consumer: List[bytes] = []
+        if message[0].upper() != b"GROUP":
+            self.error = "syntax error"
+            return
+        self.group_name: bytes = message[1]
+        self.consumer_name: bytes = message[2]
+        try:
+            (
+                self.count,
+                self.block_ms,
+                self.noack,
+                self.stream_keys,
+                self.stream_start,
+            ) = parse_stream_read_args("xreadgroup", message[3:], noack_allowed=True)
+        except ValueError as e:
+            self.error = str(e)
+
+    @classmethod
+    def keys(cls, request: List[bytes], key_range: Tuple[int, int, int]) -> List[bytes]:
+        try:
+            return parse_stream_read_args(
+                "xreadgroup", request[4:], noack_allowed=True
+            )[3]
+        except ValueError:
+            return []
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        try:
+            groups: Dict[bytes, Tuple[Stream, StreamGroup]] = self._lookup_groups()
+            history_ids: Dict[bytes, StreamID] = {
+                key: parse_stream_id(start)
+                for key, start in zip(self.stream_keys, self.stream_start)
+                if start != b">"
+            }
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
+        flattened_stream: List = self._read(groups, history_ids)
+        # only reads of new entries block; history reads always answer at once
+        if not flattened_stream and self.block_ms is not None:
+            loop = asyncio.get_running_loop()
+            deadline: Optional[float] = (
+                loop.time() + self.block_ms / 1000 if self.block_ms else None
+            )
+            while not flattened_stream:
+                timeout: Optional[float] = (
+                    deadline - loop.time() if deadline is not None else None
+                )
+                if timeout is not None and timeout <= 0:
+                    break
+                waiter = StreamWaiter(
+                    {key: group.last_delivered_id for key, (_, group) in groups.items()}
+                )
+                stream_waiters.add(waiter)
+                try:
+                    await asyncio.wait_for(waiter.future, timeout)
+                except asyncio.TimeoutError:
+                    break
+                finally:
+                    stream_waiters.remove(waiter)
+                try:
+                    # the group may have been destroyed while we waited
+                    groups = self._lookup_groups()
+                except StreamLookupError as e:
+                    return e.reply, EMPTY_BYTE
+                # another consumer of the group may have taken the entries
+                flattened_stream = self._read(groups, history_ids)
+        if not flattened_stream:
+            return (
+                RespCoder.NULL_BULK_STRING_BYTES,
+                await get_followup_response(FollowupCode.NO_FOLLOWUP),
+            )
+        return RespCoder.encode(flattened_stream), await get_followup_response(
             FollowupCode.NO_FOLLOWUP
         )
 
-    async def _process_one_stream(self, stream_key: str, stream_start: str) -> List:
-        print(f"processing stream_key: {stream_key} with stream_start: {stream_start}")
-        if data := kvPair.get(stream_key):
-            if data.type == RespDatatypes.STREAM.value and isinstance(data.value, list):
-                start_range, end_range = self._find_range(stream_start, data.value)
-                print(f"query range is : {start_range} to {end_range}")
-                entries = [
-                    entry
-                    for entry in data.value
-                    if self._is_in_range(entry, start_range, end_range)
+    def _lookup_groups(self) -> Dict[bytes, Tuple[Stream, StreamGroup]]:
+        return {
+            key: get_group(key, self.group_name, self.NOGROUP_CONTEXT)
+            for key in self.stream_keys
+        }
+
+    def _read(
+        self,
+        groups: Dict[bytes, Tuple[Stream, StreamGroup]],
+        history_ids: Dict[bytes, StreamID],
+    ) -> List:
+        now_ms: int = _now_ms()
+        flattened_stream: List = []
+        for key, (stream, group) in groups.items():
+            if self.consumer_name not in group.consumers:
+                self.created_consumer.append(key)
+            consumer: StreamConsumer = group.consumer(self.consumer_name, now_ms)
+            if key in history_ids:
+                flattened_stream.append(
+                    [
+                        key,
+                        self._read_history(
+                            key, stream, group, consumer, history_ids[key]
+                        ),
+                    ]
+                )
+                continue
+            entries: List[StreamEntry] = stream.range(
+                stream_id_after(group.last_delivered_id),
+                (STREAM_ID_MAX, STREAM_ID_MAX),
+                self.count,
+            )
+            if not entries:
+                continue
+            group.last_delivered_id = entries[-1].id
+            if not self.noack:
+                for entry in entries:
+                    group.deliver(entry.id, consumer, now_ms)
+            self.delivered.setdefault(key, []).extend(entry.id for entry in entries)
+            flattened_stream.append([key, encode_stream_entries(entries)])
+        return flattened_stream
+
+    def _read_history(
+        self,
+        key: bytes,
+        stream: Stream,
+        group: StreamGroup,
+        consumer: StreamConsumer,
+        after_id: StreamID,
+    ) -> List:
+        """## Entries already delivered to this consumer and still pending"""
+        now_ms: int = _now_ms()
+        replies: List = []
+        for stream_id in consumer.pending.irange(
+            stream_id_after(after_id), (STREAM_ID_MAX, STREAM_ID_MAX)
+        ):
+            if self.count and len(replies) >= self.count:
+                break
+            entry: Optional[StreamEntry] = stream.get(stream_id)
+            if entry is None:
+                replies.append([format_stream_id(stream_id), None])
+                continue
+            pending: PendingEntry = group.pending[stream_id]
+            pending.delivery_time_ms = now_ms
+            pending.delivery_count += 1
+            self.redelivered.setdefault(key, (group, []))[1].append(stream_id)
+            replies.append([entry.stream_id, entry.fields])
+        return replies
+
+    def aof_requests(self) -> List[List[bytes]]:
+        # logged as the deliveries it made, never as a read that could block
+        requests: List[List[bytes]] = [
+            [b"XGROUP", b"CREATECONSUMER", key, self.group_name, self.consumer_name]
+            for key in self.created_consumer
+        ]
+        for key, (group, ids) in self.redelivered.items():
+            for stream_id in ids:
+                pending: Optional[PendingEntry] = group.pending.get(stream_id)
+                if pending is not None:
+                    requests.append(
+                        _xclaim_request(
+                            key, group, self.consumer_name, stream_id, pending
+                        )
+                    )
+        for key, ids in self.delivered.items():
+            last_id: bytes = format_stream_id(ids[-1])
+            if self.noack:
+                requests.append([b"XGROUP", b"SETID", key, self.group_name, last_id])
+                continue
+            requests.append(
+                [
+                    b"XCLAIM",
+                    key,
+                    self.group_name,
+                    self.consumer_name,
+                    b"0",
+                    *(format_stream_id(stream_id) for stream_id in ids),
+                    b"FORCE",
+                    b"JUSTID",
+                    b"LASTID",
+                    last_id,
                 ]
-                return entries
+            )
+        return requests
+
+
+class XAck(CommandProcessor):
+    command = Command.XACK
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.acked: int = 0
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        key, group_name = self.message[:2]
+        try:
+            ids: List[StreamID] = [parse_stream_id(arg) for arg in self.message[2:]]
+            _, group = get_group(key, group_name)
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
+        except StreamLookupError as e:
+            if e.reply == RespCoder.WRONGTYPE_BYTES:
+                return e.reply, EMPTY_BYTE
+            # acknowledging in a missing group is not an error
+            return RespCoder.encode(0), EMPTY_BYTE
+        self.acked = sum(group.ack(stream_id) for stream_id in ids)
+        return RespCoder.encode(self.acked), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def aof_requests(self) -> List[List[bytes]]:
+        return [self.request] if self.acked else []
+
+
+class XPending(CommandProcessor):
+    command = Command.XPENDING
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        key, group_name = self.message[:2]
+        try:
+            _, group = get_group(key, group_name)
+            if len(self.message) == 2:
+                reply: List = self._summary(group)
             else:
-                return [f"Not a valid stream key"]
-        return []
+                reply = self._extended(group, self.message[2:])
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        except ValueError as e:
+            return f"-ERR {e}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        return RespCoder.encode(reply), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def _summary(self, group: StreamGroup) -> List:
+        if not group.pending:
+            return [0, None, None, None]
+        first_id: Optional[StreamID] = group.pending_ids.first()
+        last_id: Optional[StreamID] = group.pending_ids.last()
+        assert first_id is not None and last_id is not None
+        consumers: List = [
+            [consumer.name, str(len(consumer.pending))]
+            for consumer in group.consumers.values()
+            if len(consumer.pending)
+        ]
+        return [
+            len(group.pending),
+            format_stream_id(first_id),
+            format_stream_id(last_id),
+            consumers,
+        ]
+
+    def _extended(self, group: StreamGroup, args: List[bytes]) -> List:
+        min_idle_ms: int = 0
+        if args[0].upper() == b"IDLE":
+            if len(args) < 2:
+                raise ValueError("syntax error")
+            try:
+                min_idle_ms = int(args[1])
+            except ValueError:
+                raise ValueError("value is not an integer or out of range")
+            args = args[2:]
+        if len(args) not in (3, 4):
+            raise ValueError("syntax error")
+        try:
+            start: StreamID = (0, 0) if args[0] == b"-" else parse_stream_id(args[0])
+            end: StreamID = (
+                (STREAM_ID_MAX, STREAM_ID_MAX)
+                if args[1] == b"+"
+                else parse_stream_id(args[1], STREAM_ID_MAX)
+            )
+        except ValueError:
+            raise ValueError("Invalid stream ID specified as stream command argument")
+        try:
+            count: int = int(args[2])
+        except ValueError:
+            raise ValueError("value is not an integer or out of range")
+        if len(args) == 4:
+            consumer: Optional[StreamConsumer] = group.consumers.get(args[3])
+            if consumer is None:
+                return []
+            ids: SortedIDSet = consumer.pending
+        else:
+            ids = group.pending_ids
+        now_ms: int = _now_ms()
+        reply: List = []
+        for stream_id in ids.irange(start, end):
+            if len(reply) >= count:
+                break
+            pending: PendingEntry = group.pending[stream_id]
+            idle_ms: int = now_ms - pending.delivery_time_ms
+            if idle_ms < min_idle_ms:
+                continue
+            reply.append(
+                [
+                    format_stream_id(stream_id),
+                    pending.consumer.name,
+                    idle_ms,
+                    pending.delivery_count,
+                ]
+            )
+        return reply
+
+
+class StreamClaim(CommandProcessor):
+    """Shared logic of XCLAIM and XAUTOCLAIM."""
 
-    def _find_range(
+    def __init__(self, message) -> None:
+        self.message = message
+        self.stream_key: bytes = message[0]
+        self.group_name: bytes = message[1]
+        self.consumer_name: bytes = message[2]
+        self.group: Optional[StreamGroup] = None
+        self.claimed: List[StreamID] = []
+        # pending IDs whose entries no longer exist in the stream
+        self.deleted: List[StreamID] = []
+        self.created_consumer: bool = False
+
+    def _consumer(self, group: StreamGroup, now_ms: int) -> StreamConsumer:
+        self.created_consumer = self.consumer_name not in group.consumers
+        return group.consumer(self.consumer_name, now_ms)
+
+    def _claim(
         self,
-        stream_start: str,
-        data: List[StreamEntry],
-    ) -> Tuple[str, str]:
-        start_range: str = stream_start
-        end_range: str = data[-1].stream_id
-        if stream_start == "-":
-            start_range = "0-1"
-        elif len(stream_start) == 1:
-            start_range = f"{stream_start}-0"
-        return start_range, end_range
-
-    def _is_in_range(
-        self, entry: StreamEntry, start_range: str, end_range: str
-    ) -> bool:
-        stream_id: str = entry.stream_id
-        return stream_id >= start_range and stream_id <= end_range
+        stream: Stream,
+        group: StreamGroup,
+        consumer: StreamConsumer,
+        stream_id: StreamID,
+        delivery_time_ms: int,
+        retry_count: Optional[int],
+        justid: bool,
+    ) -> Optional[StreamEntry]:
+        entry: Optional[StreamEntry] = stream.get(stream_id)
+        if entry is None:
+            group.ack(stream_id)
+            self.deleted.append(stream_id)
+            return None
+        pending: Optional[PendingEntry] = group.pending.get(stream_id)
+        delivery_count: int = pending.delivery_count if pending else 1
+        if retry_count is not None:
+            delivery_count = retry_count
+        elif not justid:
+            delivery_count += 1
+        group.deliver(stream_id, consumer, delivery_time_ms, delivery_count)
+        self.claimed.append(stream_id)
+        return entry
+
+    def aof_requests(self) -> List[List[bytes]]:
+        # one absolute, forced claim per entry, the way Redis propagates them
+        if self.group is None:
+            return []
+        requests: List[List[bytes]] = []
+        if self.created_consumer:
+            requests.append(
+                [
+                    b"XGROUP",
+                    b"CREATECONSUMER",
+                    self.stream_key,
+                    self.group_name,
+                    self.consumer_name,
+                ]
+            )
+        for stream_id in self.claimed:
+            pending: Optional[PendingEntry] = self.group.pending.get(stream_id)
+            if pending is not None:
+                requests.append(
+                    _xclaim_request(
+                        self.stream_key,
+                        self.group,
+                        self.consumer_name,
+                        stream_id,
+                        pending,
+                    )
+                )
+        if self.deleted:
+            requests.append(
+                [
+                    b"XACK",
+                    self.stream_key,
+                    self.group_name,
+                    *(format_stream_id(stream_id) for stream_id in self.deleted),
+                ]
+            )
+        return requests
+
+
+class XClaim(StreamClaim):
+    command = Command.XCLAIM
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        try:
+            min_idle_ms: int = int(self.message[3])
+        except ValueError:
+            return (
+                f"-ERR Invalid min-idle-time argument for XCLAIM{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        ids: List[StreamID] = []
+        i: int = 4
+        while i < len(self.message):
+            try:
+                ids.append(parse_stream_id(self.message[i]))
+            except ValueError:
+                break
+            i += 1
+        now_ms: int = _now_ms()
+        delivery_time_ms: int = now_ms
+        retry_count: Optional[int] = None
+        force, justid = False, False
+        last_id: Optional[StreamID] = None
+        while i < len(self.message):
+            option: bytes = self.message[i].upper()
+            if option == b"FORCE":
+                force = True
+            elif option == b"JUSTID":
+                justid = True
+            elif option in (b"IDLE", b"TIME", b"RETRYCOUNT", b"LASTID") and i + 1 < len(
+                self.message
+            ):
+                i += 1
+                value: bytes = self.message[i]
+                try:
+                    if option == b"IDLE":
+                        delivery_time_ms = now_ms - int(value)
+                    elif option == b"TIME":
+                        delivery_time_ms = int(value)
+                    elif option == b"RETRYCOUNT":
+                        retry_count = int(value)
+                    else:
+                        last_id = parse_stream_id(value)
+                except ValueError:
+                    return (
+                        INVALID_STREAM_ID
+                        if option == b"LASTID"
+                        else (
+                            f"-ERR value is not an integer or out of range{RespCoder.TERMINATOR}".encode()
+                        )
+                    ), EMPTY_BYTE
+            else:
+                return (
+                    f"-ERR Unrecognized XCLAIM option '{_printable(self.message[i])}'{RespCoder.TERMINATOR}".encode(),
+                    EMPTY_BYTE,
+                )
+            i += 1
+        try:
+            stream, group = get_group(self.stream_key, self.group_name)
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        self.group = group
+        if last_id is not None and last_id > group.last_delivered_id:
+            group.last_delivered_id = last_id
+        consumer: StreamConsumer = self._consumer(group, now_ms)
+        reply: List = []
+        for stream_id in ids:
+            pending: Optional[PendingEntry] = group.pending.get(stream_id)
+            if pending is None and not force:
+                continue
+            if pending is not None and now_ms - pending.delivery_time_ms < min_idle_ms:
+                continue
+            entry: Optional[StreamEntry] = self._claim(
+                stream,
+                group,
+                consumer,
+                stream_id,
+                delivery_time_ms,
+                retry_count,
+                justid,
+            )
+            if entry is not None:
+                reply.append(
+                    entry.stream_id if justid else [entry.stream_id, entry.fields]
+                )
+        return RespCoder.encode(reply), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+
+class XAutoClaim(StreamClaim):
+    command = Command.XAUTOCLAIM
+    DEFAULT_COUNT: int = 100
+    # pending entries looked at per requested entry, as in Redis
+    ATTEMPTS_FACTOR: int = 10
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        try:
+            min_idle_ms: int = int(self.message[3])
+        except ValueError:
+            return (
+                f"-ERR Invalid min-idle-time argument for XAUTOCLAIM{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        try:
+            start: StreamID = (
+                (0, 0) if self.message[4] == b"-" else parse_stream_id(self.message[4])
+            )
+            count: int = self.DEFAULT_COUNT
+            justid: bool = False
+            options: List[bytes] = self.message[5:]
+            while options:
+                option: bytes = options.pop(0).upper()
+                if option == b"JUSTID":
+                    justid = True
+                elif option == b"COUNT" and options:
+                    try:
+                        count = int(options.pop(0))
+                    except ValueError:
+                        return (
+                            f"-ERR value is not an integer or out of range{RespCoder.TERMINATOR}".encode(),
+                            EMPTY_BYTE,
+                        )
+                    if count < 1:
+                        return (
+                            f"-ERR COUNT must be > 0{RespCoder.TERMINATOR}".encode(),
+                            EMPTY_BYTE,
+                        )
+                else:
+                    return (
+                        f"-ERR syntax error{RespCoder.TERMINATOR}".encode(),
+                        EMPTY_BYTE,
+                    )
+        except ValueError:
+            return INVALID_STREAM_ID, EMPTY_BYTE
+        try:
+            stream, group = get_group(self.stream_key, self.group_name)
+        except StreamLookupError as e:
+            return e.reply, EMPTY_BYTE
+        self.group = group
+        now_ms: int = _now_ms()
+        consumer: StreamConsumer = self._consumer(group, now_ms)
+        scanned: List[StreamID] = list(
+            itertools.islice(
+                group.pending_ids.irange(start, (STREAM_ID_MAX, STREAM_ID_MAX)),
+                count * self.ATTEMPTS_FACTOR,
+            )
+        )
+        reply: List = []
+        next_start: StreamID = (0, 0)
+        for stream_id in scanned:
+            if len(reply) >= count:
+                next_start = stream_id
+                break
+            pending: PendingEntry = group.pending[stream_id]
+            if now_ms - pending.delivery_time_ms < min_idle_ms:
+                continue
+            entry: Optional[StreamEntry] = self._claim(
+                stream, group, consumer, stream_id, now_ms, None, justid
+            )
+            if entry is not None:
+                reply.append(
+                    entry.stream_id if justid else [entry.stream_id, entry.fields]
+                )
+        else:
+            if scanned:
+                following: Optional[StreamID] = next(
+                    group.pending_ids.irange(
+                        stream_id_after(scanned[-1]), (STREAM_ID_MAX, STREAM_ID_MAX)
+                    ),
+                    None,
+                )
+                next_start = following or (0, 0)
+        return RespCoder.encode(
+            [
+                format_stream_id(next_start),
+                reply,
+                [format_stream_id(stream_id) for stream_id in self.deleted],
+            ]
+        ), await get_followup_response(FollowupCode.NO_FOLLOWUP)
 
 
 class Wait(CommandProcessor):
     command = Command.WAIT
 
-    def __init__(self, message) -> None:
+    def __init__(self, message, server_info: Optional[ServerInfo] = None) -> None:
         self.message = message
+        self.server_info: Optional[ServerInfo] = server_info
+        # replication offset of the client's last write, set by the connection
+        self.target_offset: int = 0
+        self.error: Optional[str] = None
+        try:
+            self.numreplicas: int = int(message[0])
+            self.timeout_ms: int = int(message[1])
+        except ValueError:
+            self.error = "value is not an integer or out of range"
+            return
+        if self.timeout_ms < 0:
+            self.error = "timeout is negative"
+
+    @classmethod
+    def from_args(cls, args: List[bytes], server_info: ServerInfo) -> "Wait":
+        return cls(args, server_info)
 
     async def response(self) -> Tuple[bytes, bytes]:
-        return (
-            RespCoder.encode(int(self.message[0])).encode(),
-            await get_followup_response(FollowupCode.NO_FOLLOWUP),
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        if self.server_info and self.server_info.role == ServerRole.SLAVE:
+            return (
+                f"-ERR WAIT cannot be used with replica instances.{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        acked: int = await replication.wait_for_acks(
+            self.target_offset, self.numreplicas, self.timeout_ms
+        )
+        return RespCoder.encode(acked), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
         )
 
 
@@ -575,40 +1869,620 @@ class Config(CommandProcessor):
         self.message = message
         self.serverConf: ServerInfo | None = serverConf
 
+    @classmethod
+    def from_args(cls, args: List[bytes], server_info: ServerInfo) -> "Config":
+        return cls(args, serverConf=server_info)
+
     async def response(self) -> Tuple[bytes, bytes]:
+        if self.message[0].upper() == b"RESETSTAT":
+            for _, stats in command_stats():
+                stats.reset()
+            kvPair.keyspace_stats = KeyspaceStats()
+            return f"+OK{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
         if len(self.message) < 2:
             raise Exception("invalid args")
-        if self.message[0] == "GET":
-            arg = self.message[1]
-            print(f"in getm with {arg}")
+        if self.message[0].upper() == b"GET":
+            arg: str = _printable(self.message[1])
             return (
-                RespCoder.encode(
-                    [f"{arg}", f"{getattr(self.serverConf,arg)}"]
-                ).encode(),
+                RespCoder.encode([f"{arg}", f"{getattr(self.serverConf,arg)}"]),
                 await get_followup_response(FollowupCode.NO_FOLLOWUP),
             )
         raise Exception("invalid args")
 
 
 class Keys(CommandProcessor):
-    command = Command.CONFIG
+    command = Command.KEYS
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        pattern: bytes = self.message[0]
+        keys: List[bytes] = [
+            key for key in kvPair.keys() if fnmatch.fnmatchcase(key, pattern)
+        ]
+        return (
+            RespCoder.encode(keys),
+            await get_followup_response(FollowupCode.NO_FOLLOWUP),
+        )
+
+
+class Save(CommandProcessor):
+    command = Command.SAVE
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if rdb_saver.child_pid is not None:
+            return (
+                f"-ERR Background save already in progress{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        try:
+            rdb_saver.save()
+        except OSError as e:
+            return f"-ERR {e}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        return f"+OK{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+
+class BgSave(CommandProcessor):
+    command = Command.BGSAVE
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if not rdb_saver.bgsave():
+            return (
+                f"-ERR Background save already in progress{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        return (
+            f"+Background saving started{RespCoder.TERMINATOR}".encode(),
+            await get_followup_response(FollowupCode.NO_FOLLOWUP),
+        )
+
+
+class LastSave(CommandProcessor):
+    command = Command.LASTSAVE
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        return (
+            RespCoder.encode(kvPair.persistence_stats.rdb_last_save_time),
+            await get_followup_response(FollowupCode.NO_FOLLOWUP),
+        )
+
+
+class BgRewriteAof(CommandProcessor):
+    command = Command.BGREWRITEAOF
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if not aof.enabled:
+            return (
+                f"-ERR Background append only file rewriting needs appendonly yes{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        if not aof.bgrewrite():
+            return (
+                f"-ERR Background append only file rewriting already in progress{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        return (
+            f"+Background append only file rewriting started{RespCoder.TERMINATOR}".encode(),
+            await get_followup_response(FollowupCode.NO_FOLLOWUP),
+        )
+
+
+class Del(CommandProcessor):
+    command = Command.DEL
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.deleted: List[bytes] = []
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        for key in self.message:
+            if kvPair.has(key):
+                kvPair.remove(key)
+                self.deleted.append(key)
+        return RespCoder.encode(len(self.deleted)), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def aof_requests(self) -> List[List[bytes]]:
+        return [[b"DEL", *self.deleted]] if self.deleted else []
+
+
+class Restore(CommandProcessor):
+    """`RESTORE key ttl payload [REPLACE] [ABSTTL]`, also run as RESTORE-ASKING
+    by MIGRATE."""
 
-    def __init__(self, message, rdb_file_name: Optional[str] = None) -> None:
+    command = Command.RESTORE
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.key: bytes = message[0]
+        self.payload: bytes = message[2]
+        self.expires_at_ms: Optional[int] = None
+        self.error: Optional[str] = None
+        options: List[bytes] = [option.upper() for option in message[3:]]
+        if any(option not in (b"REPLACE", b"ABSTTL") for option in options):
+            self.error = "syntax error"
+            return
+        self.replace: bool = b"REPLACE" in options
+        try:
+            ttl: int = int(message[1])
+        except ValueError:
+            self.error = "value is not an integer or out of range"
+            return
+        if ttl < 0:
+            self.error = "Invalid TTL value, must be >= 0"
+        elif ttl:
+            self.expires_at_ms = ttl
+            if b"ABSTTL" not in options:
+                self.expires_at_ms += int(time.time() * 1000)
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        if not self.replace and kvPair.has(self.key):
+            return b"-BUSYKEY Target key name already exists.\r\n", EMPTY_BYTE
+        try:
+            entry: Entry = restore_value(self.payload)
+        except RDBError as e:
+            return f"-ERR {e}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        kvPair.add(self.key, entry, self.expires_at_ms)
+        return f"+OK{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+    def aof_requests(self) -> List[List[bytes]]:
+        return [
+            [
+                b"RESTORE",
+                self.key,
+                b"%d" % (self.expires_at_ms or 0),
+                self.payload,
+                b"REPLACE",
+                b"ABSTTL",
+            ]
+        ]
+
+
+class Migrate(CommandProcessor):
+    """`MIGRATE host port key|"" destination-db timeout [COPY] [REPLACE] [KEYS key ...]`
+
+    Values travel as RESTORE-ASKING requests carrying DUMP payloads, all
+    pipelined on one connection. Unless COPY is given, a key the target
+    accepted is deleted here, provided it wasn't written meanwhile.
+    """
+
+    command = Command.MIGRATE
+    IOERR: bytes = b"-IOERR error or timeout reading to target instance\r\n"
+    MODIFIED: bytes = (
+        b"-ERR Keys were modified while migrating and kept here, "
+        b"MIGRATE them again with REPLACE\r\n"
+    )
+    # some keys may be deleted here even though others failed
+    effects_on_error = True
+
+    def __init__(self, message) -> None:
         self.message = message
-        if rdb_file_name:
-            self.rdb_file_name: str = rdb_file_name
+        self.error: Optional[str] = None
+        self.migrate_keys: List[bytes] = []
+        # keys deleted here once the target accepted them
+        self.moved: List[bytes] = []
+        self.host: str = _printable(message[0])
+        self.copy: bool = False
+        self.replace: bool = False
+        keys: Optional[List[bytes]] = None
+        # options end at KEYS, everything after it is a key name
+        for position in range(5, len(message)):
+            option: bytes = message[position].upper()
+            if option == b"COPY":
+                self.copy = True
+            elif option == b"REPLACE":
+                self.replace = True
+            elif option == b"KEYS":
+                keys = message[position + 1 :]
+                break
+            else:
+                self.error = "syntax error"
+                return
+        try:
+            self.port: int = int(message[1])
+            self.timeout_ms: int = int(message[4])
+        except ValueError:
+            self.error = "value is not an integer or out of range"
+            return
+        if message[3] != b"0":
+            self.error = "only database 0 is served"
+            return
+        if keys is not None:
+            if message[2]:
+                self.error = "When using MIGRATE KEYS option, the key argument must be set to the empty string"
+                return
+            self.migrate_keys = keys
         else:
-            raise Exception("rdb file name must be specified")
+            self.migrate_keys = [message[2]]
+        if self.timeout_ms <= 0:
+            self.timeout_ms = 1000
+
+    @classmethod
+    def keys(cls, request: List[bytes], key_range: Tuple[int, int, int]) -> List[bytes]:
+        # runs where the keys are, even while their slot is migrating away
+        return []
 
     async def response(self) -> Tuple[bytes, bytes]:
-        if os.path.exists(self.rdb_file_name):
-            if "*" in self.message:
-                rdb_file_processor = RDBFileProcessor(self.rdb_file_name)
-                keys = rdb_file_processor.read_keys_from_file()
-                resp_response = RespCoder.encode(keys)
-                return (
-                    resp_response.encode(),
-                    await get_followup_response(FollowupCode.NO_FOLLOWUP),
-                )
+        if self.error:
+            return f"-ERR {self.error}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        dumps: Dict[bytes, Tuple[Entry, Optional[int], bytes]] = {}
+        for key in self.migrate_keys:
+            entry: Optional[Entry] = kvPair.get(key)
+            if entry is not None:
+                dumps[key] = (entry, kvPair.get_expiry(key), dump_value(entry))
+        if not dumps:
+            return f"+NOKEY{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+        requests = bytearray()
+        for key, (_, expires_at_ms, payload) in dumps.items():
+            request: List[bytes] = [
+                b"RESTORE-ASKING",
+                key,
+                b"%d" % (expires_at_ms or 0),
+                payload,
+                b"ABSTTL",
+            ]
+            if self.replace:
+                request.append(b"REPLACE")
+            requests += RespCoder.encode(request)
+        timeout_s: float = self.timeout_ms / 1000
+        error: Optional[bytes] = None
+        accepted: List[bytes] = []
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout_s
+            )
+            try:
+                writer.write(bytes(requests))
+                await writer.drain()
+                for key in dumps:
+                    reply: bytes = await asyncio.wait_for(reader.readline(), timeout_s)
+                    if not reply:
+                        raise ConnectionResetError("target closed the connection")
+                    if reply.startswith(b"-"):
+                        error = reply
+                        continue
+                    accepted.append(key)
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.error("MIGRATE to %s:%d failed: %s", self.host, self.port, e)
+            return self.IOERR, EMPTY_BYTE
+        modified: bool = False
+        if not self.copy:
+            for key in accepted:
+                # the loop ran other clients while the target answered, so
+                # only delete what still matches the payload that was sent
+                entry, expires_at_ms, payload = dumps[key]
+                current: Optional[Entry] = kvPair.get(key)
+                if current is None:
+                    continue
+                if (
+                    current is not entry
+                    or kvPair.get_expiry(key) != expires_at_ms
+                    or dump_value(current) != payload
+                ):
+                    modified = True
+                    continue
+                kvPair.remove(key)
+                self.moved.append(key)
+        if error is not None:
+            return (
+                b"-ERR Target instance replied with error: " + error[1:],
+                EMPTY_BYTE,
+            )
+        if modified:
+            return self.MODIFIED, EMPTY_BYTE
+        return f"+OK{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
 
-        raise Exception("invalid args")
+    def aof_requests(self) -> List[List[bytes]]:
+        return [[b"DEL", *self.moved]] if self.moved else []
+
+
+class Asking(CommandProcessor):
+    command = Command.ASKING
+
+    def __init__(self, message) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if not cluster.enabled:
+            return Cluster.DISABLED, EMPTY_BYTE
+        return f"+OK{RespCoder.TERMINATOR}".encode(), await get_followup_response(
+            FollowupCode.NO_FOLLOWUP
+        )
+
+
+class Cluster(CommandProcessor):
+    command = Command.CLUSTER
+    DISABLED: bytes = b"-ERR This instance has cluster support disabled\r\n"
+    INVALID_SLOT: bytes = b"-ERR Invalid or out of range slot\r\n"
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.subcommand: bytes = message[0].upper()
+        self.args: List[bytes] = message[1:]
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if not cluster.enabled:
+            return self.DISABLED, EMPTY_BYTE
+        handler = {
+            b"INFO": (self._info, 0),
+            b"MYID": (self._myid, 0),
+            b"NODES": (self._nodes, 0),
+            b"SLOTS": (self._slots, 0),
+            b"SHARDS": (self._shards, 0),
+            b"KEYSLOT": (self._keyslot, 1),
+            b"COUNTKEYSINSLOT": (self._count_keys_in_slot, 1),
+            b"GETKEYSINSLOT": (self._get_keys_in_slot, 2),
+            b"ADDSLOTS": (self._add_slots, 1),
+            b"ADDSLOTSRANGE": (self._add_slots_range, 2),
+            b"SETSLOT": (self._set_slot, 2),
+            b"MEET": (self._meet, 2),
+        }.get(self.subcommand)
+        if handler is None:
+            return (
+                f"-ERR unknown subcommand '{_printable(self.message[0])}'. Try CLUSTER HELP.{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        subcommand, min_args = handler
+        if len(self.args) < min_args:
+            return (
+                f"-ERR wrong number of arguments for 'cluster|{_printable(self.subcommand).lower()}' command{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        try:
+            return subcommand(), await get_followup_response(FollowupCode.NO_FOLLOWUP)
+        except ValueError:
+            return self.INVALID_SLOT, EMPTY_BYTE
+
+    @staticmethod
+    def _parse_slot(arg: bytes) -> int:
+        slot: int = int(arg)
+        if not 0 <= slot < CLUSTER_SLOTS:
+            raise ValueError(f"slot out of range: {slot}")
+        return slot
+
+    def _info(self) -> bytes:
+        return RespCoder.encode(
+            "".join(f"{key}:{val}{RespCoder.TERMINATOR}" for key, val in cluster.info())
+        )
+
+    def _myid(self) -> bytes:
+        assert cluster.myself
+        return RespCoder.encode(cluster.myself.id)
+
+    def _nodes(self) -> bytes:
+        return RespCoder.encode(cluster.nodes_description())
+
+    def _slots(self) -> bytes:
+        return RespCoder.encode(cluster.slots_reply())
+
+    def _shards(self) -> bytes:
+        return RespCoder.encode(cluster.shards_reply())
+
+    def _keyslot(self) -> bytes:
+        return RespCoder.encode(key_hash_slot(self.args[0]))
+
+    def _count_keys_in_slot(self) -> bytes:
+        slot: int = self._parse_slot(self.args[0])
+        return RespCoder.encode(kvPair.count_keys_in_slot(slot))
+
+    def _get_keys_in_slot(self) -> bytes:
+        slot: int = self._parse_slot(self.args[0])
+        count: int = int(self.args[1])
+        if count < 0:
+            return b"-ERR Invalid number of keys\r\n"
+        return RespCoder.encode(kvPair.keys_in_slot(slot, count))
+
+    def _add_slots(self) -> bytes:
+        return self._assign([self._parse_slot(arg) for arg in self.args])
+
+    def _add_slots_range(self) -> bytes:
+        if len(self.args) % 2:
+            return f"-ERR wrong number of arguments for 'cluster|addslotsrange' command{RespCoder.TERMINATOR}".encode()
+        slots: List[int] = []
+        for i in range(0, len(self.args), 2):
+            first, last = self._parse_slot(self.args[i]), self._parse_slot(
+                self.args[i + 1]
+            )
+            if first > last:
+                return f"-ERR start slot number {first} is greater than end slot number {last}{RespCoder.TERMINATOR}".encode()
+            slots.extend(range(first, last + 1))
+        return self._assign(slots)
+
+    def _assign(self, slots: List[int]) -> bytes:
+        if len(set(slots)) != len(slots):
+            return b"-ERR Slot specified multiple times\r\n"
+        error: Optional[str] = cluster.add_slots(slots)
+        if error:
+            return f"-ERR {error}{RespCoder.TERMINATOR}".encode()
+        return f"+OK{RespCoder.TERMINATOR}".encode()
+
+    def _set_slot(self) -> bytes:
+        slot: int = self._parse_slot(self.args[0])
+        action: bytes = self.args[1].upper()
+        node_id: Optional[str] = (
+            _printable(self.args[2]) if len(self.args) > 2 else None
+        )
+        if action != b"STABLE" and node_id is None:
+            return f"-ERR Invalid CLUSTER SETSLOT action or number of arguments. Try CLUSTER HELP{RespCoder.TERMINATOR}".encode()
+        error: Optional[str] = cluster.set_slot(slot, action, node_id)
+        if error:
+            return f"-ERR {error}{RespCoder.TERMINATOR}".encode()
+        return f"+OK{RespCoder.TERMINATOR}".encode()
+
+    def _meet(self) -> bytes:
+        try:
+            port: int = int(self.args[1])
+        except ValueError:
+            return f"-ERR Invalid base port specified: {_printable(self.args[1])}{RespCoder.TERMINATOR}".encode()
+        cluster.meet(_printable(self.args[0]), port)
+        return f"+OK{RespCoder.TERMINATOR}".encode()
+
+
+class Latency(CommandProcessor):
+    command = Command.LATENCY
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.subcommand: bytes = message[0].upper()
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        if self.subcommand != b"HISTOGRAM":
+            return (
+                f"-ERR unknown subcommand '{_printable(self.message[0])}'. Try LATENCY HELP.{RespCoder.TERMINATOR}".encode(),
+                EMPTY_BYTE,
+            )
+        wanted: List[str] = [_printable(name).lower() for name in self.message[1:]]
+        reply: List = []
+        for name, stats in command_stats():
+            if not stats.calls or (wanted and name not in wanted):
+                continue
+            histogram: List = []
+            for bound, count in stats.histogram.cumulative():
+                histogram.extend([bound, count])
+            reply.extend([name, ["calls", stats.calls, "histogram_usec", histogram]])
+        return RespCoder.encode(reply), EMPTY_BYTE
+
+
+class ErrorReply(CommandProcessor):
+    command = Command.NONE
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    async def response(self) -> Tuple[bytes, bytes]:
+        return f"-ERR {self.message}{RespCoder.TERMINATOR}".encode(), EMPTY_BYTE
+
+
+@dataclass(frozen=True)
+class CommandSpec:
+    """Dispatch entry for a command.
+
+    `arity` follows the Redis convention and counts the command name itself:
+    a positive value is an exact argument count, a negative one a minimum.
+    """
+
+    handler: type[CommandProcessor]
+    arity: int
+    flags: CommandFlag = CommandFlag.NONE
+    # first key, last key and step, as positions in the request
+    key_range: Tuple[int, int, int] = (0, 0, 0)
+    stats: CommandStats = field(default_factory=CommandStats, compare=False)
+
+    def accepts(self, argc: int) -> bool:
+        if self.arity >= 0:
+            return argc == self.arity
+        return argc >= -self.arity
+
+
+# keyed by the upper-cased command name exactly as it arrives on the wire
+COMMAND_TABLE: Dict[bytes, CommandSpec] = {
+    Command.PING.name.encode(): CommandSpec(Ping, -1),
+    Command.ECHO.name.encode(): CommandSpec(Echo, 2),
+    Command.SET.name.encode(): CommandSpec(
+        Set, -3, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.GET.name.encode(): CommandSpec(
+        Get, 2, CommandFlag.READONLY, key_range=(1, 1, 1)
+    ),
+    Command.TYPE.name.encode(): CommandSpec(
+        Type, 2, CommandFlag.READONLY, key_range=(1, 1, 1)
+    ),
+    Command.INFO.name.encode(): CommandSpec(Info, -1, CommandFlag.KEYSPACE),
+    Command.CONFIG.name.encode(): CommandSpec(Config, -2),
+    Command.REPLCONF.name.encode(): CommandSpec(Replconf, -1),
+    Command.PSYNC.name.encode(): CommandSpec(Psync, -3),
+    Command.XADD.name.encode(): CommandSpec(
+        Xadd, -5, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.XRANGE.name.encode(): CommandSpec(
+        XRange, -4, CommandFlag.READONLY, key_range=(1, 1, 1)
+    ),
+    Command.XREAD.name.encode(): CommandSpec(
+        XRead, -4, CommandFlag.READONLY | CommandFlag.BLOCKING
+    ),
+    Command.WAIT.name.encode(): CommandSpec(Wait, 3, CommandFlag.BLOCKING),
+    Command.KEYS.name.encode(): CommandSpec(
+        Keys, 2, CommandFlag.READONLY | CommandFlag.KEYSPACE
+    ),
+    Command.SAVE.name.encode(): CommandSpec(Save, 1, CommandFlag.KEYSPACE),
+    Command.BGSAVE.name.encode(): CommandSpec(BgSave, -1, CommandFlag.KEYSPACE),
+    Command.LASTSAVE.name.encode(): CommandSpec(LastSave, 1, CommandFlag.KEYSPACE),
+    Command.BGREWRITEAOF.name.encode(): CommandSpec(
+        BgRewriteAof, 1, CommandFlag.KEYSPACE
+    ),
+    Command.XGROUP.name.encode(): CommandSpec(
+        XGroup, -2, CommandFlag.WRITE, key_range=(2, 2, 1)
+    ),
+    Command.XREADGROUP.name.encode(): CommandSpec(
+        XReadGroup, -7, CommandFlag.WRITE | CommandFlag.BLOCKING
+    ),
+    Command.XACK.name.encode(): CommandSpec(
+        XAck, -4, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.XPENDING.name.encode(): CommandSpec(
+        XPending, -3, CommandFlag.READONLY, key_range=(1, 1, 1)
+    ),
+    Command.XCLAIM.name.encode(): CommandSpec(
+        XClaim, -6, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.XAUTOCLAIM.name.encode(): CommandSpec(
+        XAutoClaim, -6, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.XTRIM.name.encode(): CommandSpec(
+        XTrim, -4, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    Command.XINFO.name.encode(): CommandSpec(
+        XInfo, -2, CommandFlag.READONLY, key_range=(2, 2, 1)
+    ),
+    Command.DEL.name.encode(): CommandSpec(
+        Del, -2, CommandFlag.WRITE, key_range=(1, -1, 1)
+    ),
+    Command.CLUSTER.name.encode(): CommandSpec(Cluster, -2),
+    Command.ASKING.name.encode(): CommandSpec(Asking, 1),
+    Command.MIGRATE.name.encode(): CommandSpec(
+        Migrate, -6, CommandFlag.WRITE | CommandFlag.KEYSPACE
+    ),
+    Command.RESTORE.name.encode(): CommandSpec(
+        Restore, -4, CommandFlag.WRITE, key_range=(1, 1, 1)
+    ),
+    b"RESTORE-ASKING": CommandSpec(
+        Restore, -4, CommandFlag.WRITE | CommandFlag.ASKING, key_range=(1, 1, 1)
+    ),
+    Command.LATENCY.name.encode(): CommandSpec(Latency, -2),
+}
+
+
+def fold_command_stats() -> None:
+    """## Move the durations calls have recorded into the stats, from the cron"""
+    for spec in COMMAND_TABLE.values():
+        spec.stats.fold()
+
+
+def command_stats() -> List[Tuple[str, CommandStats]]:
+    """## Every command's stats by lower-cased name, with pending samples folded in"""
+    fold_command_stats()
+    return [(name.decode().lower(), spec.stats) for name, spec in COMMAND_TABLE.items()]
@@ -0,0 +1,137 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import repeat
+from operator import floordiv
+from typing import List, Tuple
+
+# linear sub-buckets per power of two, which bounds the error to 1/16
+SUB_BUCKET_BITS: int = 4
+SUB_BUCKETS: int = 1 << SUB_BUCKET_BITS
+# latencies from 2^MAX_MAGNITUDE usec (about 13 days) on share the last bucket
+MAX_MAGNITUDE: int = 40
+HISTOGRAM_SIZE: int = (MAX_MAGNITUDE - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+
+# percentiles INFO latencystats reports
+LATENCY_PERCENTILES: Tuple[float, ...] = (50.0, 99.0, 99.9)
+
+
+def bucket_index(usec: int) -> int:
+    """## The histogram bucket `usec` falls into
+
+    Values under `SUB_BUCKETS` get a bucket each. Past that, every power
+    of two is split in `SUB_BUCKETS` equal parts, as in an HDR histogram.
+    """
+    if usec < SUB_BUCKETS:
+        return usec
+    shift: int = usec.bit_length() - SUB_BUCKET_BITS - 1
+    return min(
+        ((shift + 1) << SUB_BUCKET_BITS) + (usec >> shift) - SUB_BUCKETS,
+        HISTOGRAM_SIZE - 1,
+    )
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """## Smallest and largest latency, in usec, counted in bucket `index`"""
+    if index < SUB_BUCKETS:
+        return index, index
+    shift: int = (index >> SUB_BUCKET_BITS) - 1
+    lower: int = (SUB_BUCKETS + (index & (SUB_BUCKETS - 1))) << shift
+    return lower, lower + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in microseconds."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * HISTOGRAM_SIZE
+        self.total: int = 0
+
+    def percentile(self, percent: float) -> float:
+        """## The latency `percent` of the samples are at or under, 0 when empty
+
+        Reported as the middle of the bucket the percentile falls in.
+        """
+        if not self.total:
+            return 0.0
+        rank: float = self.total * percent / 100
+        seen: int = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                lower, upper = bucket_bounds(index)
+                return (lower + upper) / 2
+        return float(bucket_bounds(HISTOGRAM_SIZE - 1)[1])
+
+    def cumulative(self) -> List[Tuple[int, int]]:
+        """## Samples at or under each power of two usec, from the first non-empty one"""
+        points: List[Tuple[int, int]] = []
+        seen: int = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            # every bucket sits within one power of two, keyed by its top
+            bound: int = 1 << (max(bucket_bounds(index)[1], 1) - 1).bit_length()
+            if points and points[-1][0] == bound:
+                points[-1] = (bound, seen)
+            else:
+                points.append((bound, seen))
+        return points
+
+
+@dataclass
+class CommandStats:
+    """What INFO commandstats and latencystats report for one command.
+
+    `rejected_calls` never reached the command, like arity errors, cluster
+    redirects or writes on a replica; `failed_calls` ran and replied with
+    an error. Only executions are timed.
+
+    A call only appends its duration to `samples`; `fold` moves them into
+    the totals and the histogram in bulk, from the server cron and before
+    anything is reported, which keeps the per-call cost to an append.
+    """
+
+    calls: int = 0
+    nanoseconds: int = 0
+    rejected_calls: int = 0
+    failed_calls: int = 0
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # nanoseconds each call took, since the last fold
+    samples: List[int] = field(default_factory=list)
+
+    def fold(self) -> None:
+        samples: List[int] = self.samples
+        if not samples:
+            return
+        self.samples = []
+        self.calls += len(samples)
+        self.nanoseconds += sum(samples)
+        # few distinct microsecond values, so bucket each of them only once
+        counts: List[int] = self.histogram.counts
+        for usec, count in Counter(map(floordiv, samples, repeat(1000))).items():
+            counts[bucket_index(usec)] += count
+        self.histogram.total += len(samples)
+
+    def reset(self) -> None:
+        self.calls = self.nanoseconds = self.rejected_calls = self.failed_calls = 0
+        self.histogram = LatencyHistogram()
+        self.samples = []
+
+    @property
+    def used(self) -> bool:
+        return bool(self.calls or self.rejected_calls or self.failed_calls)
+
+    def info(self) -> str:
+        usec: int = self.nanoseconds // 1000
+        per_call: float = usec / self.calls if self.calls else 0.0
+        return (
+            f"calls={self.calls},usec={usec},usec_per_call={per_call:.2f},"
+            f"rejected_calls={self.rejected_calls},failed_calls={self.failed_calls}"
+        )
+
+    def latency_info(self) -> str:
+        return ",".join(
+            f"p{percent:g}={self.histogram.percentile(percent):.3f}"
+            for percent in LATENCY_PERCENTILES
+        )
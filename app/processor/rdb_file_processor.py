@@ -1,117 +1,899 @@
-from datetime import datetime
+import enum
+import mmap
 import os
-from typing import Any, Dict, List
+import struct
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from app.storage.storage import (
+    Entry,
+    PersistenceStats,
+    RespDatatypes,
+    Storage,
+    PendingEntry,
+    STREAM_ID_MAX,
+    Stream,
+    StreamBlock,
+    StreamEntry,
+    StreamGroup,
+    StreamID,
+)
 
-def convert_unix_timestamp_to_datetime(timestamp, is_ms=True):
-    # Convert milliseconds to seconds
-    if is_ms:
-        timestamp = timestamp / 1000
-    # Create datetime object from Unix epoch
-    dt = datetime.fromtimestamp(timestamp)
-    return dt
 
+class RDBError(Exception):
+    pass
 
-class RDBFileProcessor:
-    NO_CONTENT_RESPONSE: str = "$-1\r\n"
 
-    def __init__(self, filename: str):
+class RDBOpcode(enum.IntEnum):
+    FUNCTION2 = 0xF5
+    MODULE_AUX = 0xF7
+    FREQ = 0xF8
+    IDLE = 0xF9
+    AUX = 0xFA
+    RESIZEDB = 0xFB
+    EXPIRETIME_MS = 0xFC
+    EXPIRETIME = 0xFD
+    SELECTDB = 0xFE
+    EOF = 0xFF
+
+
+class RDBType(enum.IntEnum):
+    STRING = 0
+    LIST = 1
+    SET = 2
+    ZSET = 3
+    HASH = 4
+    ZSET_2 = 5
+    HASH_ZIPMAP = 9
+    LIST_ZIPLIST = 10
+    SET_INTSET = 11
+    ZSET_ZIPLIST = 12
+    HASH_ZIPLIST = 13
+    LIST_QUICKLIST = 14
+    STREAM_LISTPACKS = 15
+    HASH_LISTPACK = 16
+    ZSET_LISTPACK = 17
+    LIST_QUICKLIST_2 = 18
+    STREAM_LISTPACKS_2 = 19
+    SET_LISTPACK = 20
+    STREAM_LISTPACKS_3 = 21
+
+
+RDB_ENC_INT8 = 0
+RDB_ENC_INT16 = 1
+RDB_ENC_INT32 = 2
+RDB_ENC_LZF = 3
+
+QUICKLIST_NODE_PLAIN = 1
+STREAM_ITEM_FLAG_DELETED = 1
+STREAM_ITEM_FLAG_SAMEFIELDS = 2
+
+
+CRC64_POLY: int = 0x95AC9329AC4BC9B5
+
+
+def _crc64_tables() -> List[List[int]]:
+    """## Slicing-by-8 tables for CRC-64/Jones, as redis uses
+
+    `tables[0]` is the classic byte table; `tables[k][b]` is the CRC of byte
+    `b` followed by `k` zero bytes, so eight bytes fold in one step.
+    """
+    table: List[int] = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ CRC64_POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    tables: List[List[int]] = [table]
+    for _ in range(7):
+        tables.append([table[crc & 0xFF] ^ (crc >> 8) for crc in tables[-1]])
+    return tables
+
+
+CRC64_TABLES: List[List[int]] = _crc64_tables()
+CRC64_TABLE: List[int] = CRC64_TABLES[0]
+
+
+def _crc64_sliced(data, crc: int = 0) -> int:
+    t0, t1, t2, t3, t4, t5, t6, t7 = CRC64_TABLES
+    view = memoryview(data).cast("B")
+    words_end: int = len(view) & ~7
+    for (word,) in struct.iter_unpack("<Q", view[:words_end]):
+        crc ^= word
+        crc = (
+            t7[crc & 0xFF]
+            ^ t6[(crc >> 8) & 0xFF]
+            ^ t5[(crc >> 16) & 0xFF]
+            ^ t4[(crc >> 24) & 0xFF]
+            ^ t3[(crc >> 32) & 0xFF]
+            ^ t2[(crc >> 40) & 0xFF]
+            ^ t1[(crc >> 48) & 0xFF]
+            ^ t0[crc >> 56]
+        )
+    for byte in view[words_end:]:
+        crc = t0[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+try:
+    # crcmod's C extension runs at hundreds of MB/s, the loop above at ~7
+    import crcmod
+    import crcmod._crcfunext  # only there when the C extension is built
+
+    # crcmod wants the polynomial unreflected, with its x^64 term
+    _crc64_c = crcmod.mkCrcFun(0x1AD93D23594C935A9, initCrc=0, rev=True, xorOut=0)
+except ImportError:
+    _crc64_c = None
+
+
+def crc64(data, crc: int = 0) -> int:
+    """## CRC-64/Jones of `data`, continuing from `crc`
+
+    Uses crcmod's C implementation when it is installed, a pure Python
+    slicing-by-8 loop otherwise. Without crcmod, verifying large dumps on
+    load is slow; `--rdbchecksum no` skips it.
+    """
+    if _crc64_c is not None:
+        return _crc64_c(data, crc)
+    return _crc64_sliced(data, crc)
+
+
+def lzf_decompress(data: bytes, expected_len: int) -> bytes:
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        ctrl: int = data[i]
+        i += 1
+        if ctrl < 32:
+            # literal run of ctrl + 1 bytes
+            out += data[i : i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        length: int = ctrl >> 5
+        if length == 7:
+            length += data[i]
+            i += 1
+        ref: int = len(out) - ((ctrl & 0x1F) << 8) - data[i] - 1
+        i += 1
+        length += 2
+        if ref < 0:
+            raise RDBError("Invalid LZF back reference")
+        if ref + length <= len(out):
+            out += out[ref : ref + length]
+        else:
+            # overlapping copy repeats the bytes it is producing
+            for offset in range(length):
+                out.append(out[ref + offset])
+    if len(out) != expected_len:
+        raise RDBError(f"LZF length mismatch: {len(out)} != {expected_len}")
+    return bytes(out)
+
+
+def _int_to_bytes(value: int) -> bytes:
+    return str(value).encode()
+
+
+def parse_ziplist(data: bytes) -> List[bytes]:
+    items: List[bytes] = []
+    i: int = 10  # zlbytes, zltail, zllen
+    while data[i] != 0xFF:
+        i += 5 if data[i] == 0xFE else 1  # prevlen
+        enc: int = data[i]
+        kind: int = enc >> 6
+        if kind == 0:
+            length, i = enc & 0x3F, i + 1
+        elif kind == 1:
+            length, i = ((enc & 0x3F) << 8) | data[i + 1], i + 2
+        elif kind == 2:
+            length, i = int.from_bytes(data[i + 1 : i + 5], "big"), i + 5
+        else:
+            i += 1
+            if enc == 0xC0:
+                value, size = int.from_bytes(data[i : i + 2], "little", signed=True), 2
+            elif enc == 0xD0:
+                value, size = int.from_bytes(data[i : i + 4], "little", signed=True), 4
+            elif enc == 0xE0:
+                value, size = int.from_bytes(data[i : i + 8], "little", signed=True), 8
+            elif enc == 0xF0:
+                value, size = int.from_bytes(data[i : i + 3], "little", signed=True), 3
+            elif enc == 0xFE:
+                value, size = int.from_bytes(data[i : i + 1], "little", signed=True), 1
+            elif 0xF1 <= enc <= 0xFD:
+                value, size = (enc & 0x0F) - 1, 0
+            else:
+                raise RDBError(f"Unknown ziplist encoding {enc:#x}")
+            items.append(_int_to_bytes(value))
+            i += size
+            continue
+        items.append(bytes(data[i : i + length]))
+        i += length
+    return items
+
+
+def _listpack_backlen_size(entry_len: int) -> int:
+    if entry_len <= 127:
+        return 1
+    if entry_len < 16383:
+        return 2
+    if entry_len < 2097151:
+        return 3
+    if entry_len < 268435455:
+        return 4
+    return 5
+
+
+def parse_listpack(data: bytes) -> List[bytes]:
+    items: List[bytes] = []
+    i: int = 6  # total bytes, number of elements
+    while data[i] != 0xFF:
+        start: int = i
+        enc: int = data[i]
+        value: Optional[int] = None
+        if enc & 0x80 == 0:
+            value, i = enc & 0x7F, i + 1
+        elif enc & 0xC0 == 0x80:
+            length: int = enc & 0x3F
+            items.append(bytes(data[i + 1 : i + 1 + length]))
+            i += 1 + length
+        elif enc & 0xE0 == 0xC0:
+            value = ((enc & 0x1F) << 8) | data[i + 1]
+            if value >= 1 << 12:
+                value -= 1 << 13
+            i += 2
+        elif enc & 0xF0 == 0xE0:
+            length = ((enc & 0x0F) << 8) | data[i + 1]
+            items.append(bytes(data[i + 2 : i + 2 + length]))
+            i += 2 + length
+        elif enc == 0xF0:
+            length = int.from_bytes(data[i + 1 : i + 5], "little")
+            items.append(bytes(data[i + 5 : i + 5 + length]))
+            i += 5 + length
+        elif 0xF1 <= enc <= 0xF4:
+            size: int = {0xF1: 2, 0xF2: 3, 0xF3: 4, 0xF4: 8}[enc]
+            value = int.from_bytes(data[i + 1 : i + 1 + size], "little", signed=True)
+            i += 1 + size
+        else:
+            raise RDBError(f"Unknown listpack encoding {enc:#x}")
+        if value is not None:
+            items.append(_int_to_bytes(value))
+        i += _listpack_backlen_size(i - start)
+    return items
+
+
+def parse_intset(data: bytes) -> List[bytes]:
+    width: int = int.from_bytes(data[0:4], "little")
+    count: int = int.from_bytes(data[4:8], "little")
+    return [
+        _int_to_bytes(
+            int.from_bytes(
+                data[8 + n * width : 8 + (n + 1) * width], "little", signed=True
+            )
+        )
+        for n in range(count)
+    ]
+
+
+def parse_zipmap(data: bytes) -> Dict[bytes, bytes]:
+    pairs: Dict[bytes, bytes] = {}
+    i: int = 1  # zmlen
+
+    def read_len(i: int) -> Tuple[int, int]:
+        if data[i] < 254:
+            return data[i], i + 1
+        return int.from_bytes(data[i + 1 : i + 5], "little"), i + 5
+
+    while data[i] != 0xFF:
+        key_len, i = read_len(i)
+        key = bytes(data[i : i + key_len])
+        i += key_len
+        val_len, i = read_len(i)
+        free: int = data[i]
+        i += 1
+        pairs[key] = bytes(data[i : i + val_len])
+        i += val_len + free
+    return pairs
+
+
+class RDBReader:
+    """Single forward pass over an RDB payload (bytes or an mmap).
+
+    Every read advances `pos`, so the whole file is decoded in time linear in
+    its size and strings are only copied out once.
+    """
+
+    def __init__(self, data) -> None:
+        self.data = data
+        self.pos: int = 0
+        self.version: int = 0
+
+    def read(self, size: int) -> bytes:
+        end: int = self.pos + size
+        if end > len(self.data):
+            raise RDBError("Unexpected end of RDB file")
+        chunk: bytes = self.data[self.pos : end]
+        self.pos = end
+        return chunk
+
+    def read_byte(self) -> int:
+        if self.pos >= len(self.data):
+            raise RDBError("Unexpected end of RDB file")
+        value: int = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def read_length_with_encoding(self) -> Tuple[int, bool]:
+        first: int = self.read_byte()
+        kind: int = first >> 6
+        if kind == 0:
+            return first & 0x3F, False
+        if kind == 1:
+            return ((first & 0x3F) << 8) | self.read_byte(), False
+        if kind == 3:
+            return first & 0x3F, True
+        if first == 0x80:
+            return int.from_bytes(self.read(4), "big"), False
+        if first == 0x81:
+            return int.from_bytes(self.read(8), "big"), False
+        raise RDBError(f"Unknown length encoding {first:#x}")
+
+    def read_length(self) -> int:
+        length, is_encoded = self.read_length_with_encoding()
+        if is_encoded:
+            raise RDBError("Unexpected encoded length")
+        return length
+
+    def read_string(self) -> bytes:
+        length, is_encoded = self.read_length_with_encoding()
+        if not is_encoded:
+            return self.read(length)
+        if length == RDB_ENC_INT8:
+            return _int_to_bytes(int.from_bytes(self.read(1), "little", signed=True))
+        if length == RDB_ENC_INT16:
+            return _int_to_bytes(int.from_bytes(self.read(2), "little", signed=True))
+        if length == RDB_ENC_INT32:
+            return _int_to_bytes(int.from_bytes(self.read(4), "little", signed=True))
+        if length == RDB_ENC_LZF:
+            compressed_len: int = self.read_length()
+            uncompressed_len: int = self.read_length()
+            return lzf_decompress(self.read(compressed_len), uncompressed_len)
+        raise RDBError(f"Unknown string encoding {length}")
+
+    def read_double(self) -> float:
+        length: int = self.read_byte()
+        if length == 253:
+            return float("nan")
+        if length == 254:
+            return float("inf")
+        if length == 255:
+            return float("-inf")
+        return float(self.read(length))
+
+    def read_binary_double(self) -> float:
+        return struct.unpack("<d", self.read(8))[0]
+
+    def read_stream_id(self) -> Tuple[int, int]:
+        raw: bytes = self.read(16)
+        return int.from_bytes(raw[:8], "big"), int.from_bytes(raw[8:], "big")
+
+    def read_value(self, value_type: int) -> Tuple[RespDatatypes, Any]:
+        if value_type == RDBType.STRING:
+            return RespDatatypes.STRING, self.read_string()
+        if value_type == RDBType.LIST:
+            return RespDatatypes.LIST, [
+                self.read_string() for _ in range(self.read_length())
+            ]
+        if value_type == RDBType.LIST_ZIPLIST:
+            return RespDatatypes.LIST, parse_ziplist(self.read_string())
+        if value_type in (RDBType.LIST_QUICKLIST, RDBType.LIST_QUICKLIST_2):
+            items: List[bytes] = []
+            for _ in range(self.read_length()):
+                if value_type == RDBType.LIST_QUICKLIST:
+                    items.extend(parse_ziplist(self.read_string()))
+                elif self.read_length() == QUICKLIST_NODE_PLAIN:
+                    items.append(self.read_string())
+                else:
+                    items.extend(parse_listpack(self.read_string()))
+            return RespDatatypes.LIST, items
+        if value_type == RDBType.SET:
+            return RespDatatypes.SET, {
+                self.read_string() for _ in range(self.read_length())
+            }
+        if value_type == RDBType.SET_INTSET:
+            return RespDatatypes.SET, set(parse_intset(self.read_string()))
+        if value_type == RDBType.SET_LISTPACK:
+            return RespDatatypes.SET, set(parse_listpack(self.read_string()))
+        if value_type in (RDBType.ZSET, RDBType.ZSET_2):
+            read_score = (
+                self.read_double
+                if value_type == RDBType.ZSET
+                else self.read_binary_double
+            )
+            zset: Dict[bytes, float] = {}
+            for _ in range(self.read_length()):
+                member: bytes = self.read_string()
+                zset[member] = read_score()
+            return RespDatatypes.ZSET, zset
+        if value_type in (RDBType.ZSET_ZIPLIST, RDBType.ZSET_LISTPACK):
+            parse = (
+                parse_ziplist if value_type == RDBType.ZSET_ZIPLIST else parse_listpack
+            )
+            flat: List[bytes] = parse(self.read_string())
+            return RespDatatypes.ZSET, {
+                flat[n]: float(flat[n + 1]) for n in range(0, len(flat), 2)
+            }
+        if value_type == RDBType.HASH:
+            hash_value: Dict[bytes, bytes] = {}
+            for _ in range(self.read_length()):
+                field: bytes = self.read_string()
+                hash_value[field] = self.read_string()
+            return RespDatatypes.HASH, hash_value
+        if value_type == RDBType.HASH_ZIPMAP:
+            return RespDatatypes.HASH, parse_zipmap(self.read_string())
+        if value_type in (RDBType.HASH_ZIPLIST, RDBType.HASH_LISTPACK):
+            parse = (
+                parse_ziplist if value_type == RDBType.HASH_ZIPLIST else parse_listpack
+            )
+            flat = parse(self.read_string())
+            return RespDatatypes.HASH, {
+                flat[n]: flat[n + 1] for n in range(0, len(flat), 2)
+            }
+        if value_type in (
+            RDBType.STREAM_LISTPACKS,
+            RDBType.STREAM_LISTPACKS_2,
+            RDBType.STREAM_LISTPACKS_3,
+        ):
+            return RespDatatypes.STREAM, self.read_stream(value_type)
+        raise RDBError(f"Unsupported RDB value type {value_type}")
+
+    def read_stream(self, value_type: int) -> Stream:
+        stream = Stream()
+        for _ in range(self.read_length()):
+            master_key: bytes = self.read_string()
+            master_ms = int.from_bytes(master_key[:8], "big")
+            master_seq = int.from_bytes(master_key[8:16], "big")
+            lp: List[bytes] = parse_listpack(self.read_string())
+            # master entry: count, deleted, master field count, fields..., 0
+            num_master_fields: int = int(lp[2])
+            master_fields: List[bytes] = lp[3 : 3 + num_master_fields]
+            i: int = 3 + num_master_fields + 1
+            while i < len(lp):
+                flags: int = int(lp[i])
+                # deltas are stored wrapped to 64 bits
+                ms: int = (master_ms + int(lp[i + 1])) & STREAM_ID_MAX
+                seq: int = (master_seq + int(lp[i + 2])) & STREAM_ID_MAX
+                i += 3
+                fields: List[bytes] = []
+                if flags & STREAM_ITEM_FLAG_SAMEFIELDS:
+                    for field in master_fields:
+                        fields += [field, lp[i]]
+                        i += 1
+                else:
+                    num_fields: int = int(lp[i])
+                    fields = lp[i + 1 : i + 1 + 2 * num_fields]
+                    i += 1 + 2 * num_fields
+                i += 1  # lp-count of this entry
+                if not flags & STREAM_ITEM_FLAG_DELETED:
+                    stream.append(StreamEntry((ms, seq), fields))
+        self.read_length()  # length
+        last_id: Tuple[int, int] = (self.read_length(), self.read_length())
+        stream.last_id = max(stream.last_id, last_id)
+        if value_type >= RDBType.STREAM_LISTPACKS_2:
+            self.read_length(), self.read_length()  # first id
+            stream.max_deleted_id = (self.read_length(), self.read_length())
+            stream.entries_added = self.read_length()
+        for _ in range(self.read_length()):
+            group_name: bytes = self.read_string()
+            group = StreamGroup(group_name, (self.read_length(), self.read_length()))
+            stream.groups[group_name] = group
+            if value_type >= RDBType.STREAM_LISTPACKS_2:
+                self.read_length()  # entries read
+            # the group PEL comes first, its owners are set from the consumers
+            unowned: Dict[Tuple[int, int], Tuple[int, int]] = {}
+            for _ in range(self.read_length()):
+                stream_id: Tuple[int, int] = self.read_stream_id()
+                delivery_time_ms: int = int.from_bytes(self.read(8), "little")
+                unowned[stream_id] = (delivery_time_ms, self.read_length())
+            for _ in range(self.read_length()):
+                consumer_name: bytes = self.read_string()
+                consumer = group.consumer(
+                    consumer_name, int.from_bytes(self.read(8), "little")
+                )
+                if value_type >= RDBType.STREAM_LISTPACKS_3:
+                    self.read(8)  # active time
+                for _ in range(self.read_length()):
+                    stream_id = self.read_stream_id()
+                    delivery_time_ms, delivery_count = unowned.pop(stream_id)
+                    group.deliver(stream_id, consumer, delivery_time_ms, delivery_count)
+        return stream
+
+    def entries(
+        self, verify_checksum: bool = True
+    ) -> Iterator[Tuple[int, bytes, RespDatatypes, Any, Optional[int]]]:
+        """## Yield `(db, key, type, value, expires_at_ms)` for every key in the file"""
+        magic: bytes = self.read(9)
+        if magic[:5] != b"REDIS":
+            raise RDBError("Wrong signature trying to load DB from file")
+        self.version = int(magic[5:])
+        db: int = 0
+        expires_at_ms: Optional[int] = None
+        while True:
+            opcode: int = self.read_byte()
+            if opcode == RDBOpcode.EOF:
+                break
+            if opcode == RDBOpcode.SELECTDB:
+                db = self.read_length()
+            elif opcode == RDBOpcode.RESIZEDB:
+                self.read_length(), self.read_length()
+            elif opcode == RDBOpcode.AUX:
+                self.read_string(), self.read_string()
+            elif opcode == RDBOpcode.EXPIRETIME_MS:
+                expires_at_ms = int.from_bytes(self.read(8), "little")
+            elif opcode == RDBOpcode.EXPIRETIME:
+                expires_at_ms = int.from_bytes(self.read(4), "little") * 1000
+            elif opcode == RDBOpcode.IDLE:
+                self.read_length()
+            elif opcode == RDBOpcode.FREQ:
+                self.read_byte()
+            elif opcode == RDBOpcode.FUNCTION2:
+                self.read_string()
+            elif opcode == RDBOpcode.MODULE_AUX:
+                raise RDBError("Module data in RDB files is not supported")
+            else:
+                key: bytes = self.read_string()
+                value_type, value = self.read_value(opcode)
+                yield db, key, value_type, value, expires_at_ms
+                expires_at_ms = None
+        if self.version >= 5:
+            body_end: int = self.pos
+            expected: int = int.from_bytes(self.read(8), "little")
+            # a zero checksum means the writer ran with rdbchecksum disabled
+            if verify_checksum and expected and self.checksum(body_end) != expected:
+                raise RDBError("Wrong RDB checksum")
+
+    def checksum(self, end: int, chunk_size: int = 1 << 20) -> int:
+        crc: int = 0
+        for start in range(0, end, chunk_size):
+            crc = crc64(self.data[start : min(start + chunk_size, end)], crc)
+        return crc
+
+
+def load_rdb(data, storage: Storage, verify_checksum: bool = True) -> PersistenceStats:
+    """## Replace the keyspace of `storage` with the live keys of an RDB payload
+
+    The keys are read into a fresh `Storage` that is swapped in only once
+    the whole payload, checksum included, was read. A corrupt payload
+    raises with `storage` untouched.
+
+    ### Args:
+        - `data`: the whole payload, as bytes, a memoryview or an mmap
+        - `storage (Storage)`: keyspace to replace
+        - `verify_checksum (bool)`: check the CRC64 trailer
+
+    ### Returns:
+        - `PersistenceStats`: load statistics, also kept on `storage.persistence_stats`
+    """
+    stats: PersistenceStats = storage.persistence_stats
+    started: float = time.perf_counter()
+    now_ms: float = time.time() * 1000
+    keys_loaded, keys_expired = 0, 0
+    loaded = Storage()
+    reader = RDBReader(data)
+    for db, key, value_type, value, expires_at_ms in reader.entries(verify_checksum):
+        # only database 0 is served
+        if db != 0:
+            continue
+        if expires_at_ms is not None and expires_at_ms <= now_ms:
+            keys_expired += 1
+            continue
+        # keys, members and values stay exactly the bytes found in the dump
+        loaded.add(key, Entry(value, value_type), expires_at_ms)
+        keys_loaded += 1
+    storage.swap_keyspace(loaded)
+    stats.rdb_last_load_keys_loaded = keys_loaded
+    stats.rdb_last_load_keys_expired = keys_expired
+    stats.rdb_last_load_bytes_read = reader.pos
+    stats.rdb_last_load_time_ms = (time.perf_counter() - started) * 1000
+    return stats
+
+
+class RDBFileProcessor:
+    def __init__(self, filename: str, verify_checksum: bool = True):
         self.filename = filename
+        self.verify_checksum = verify_checksum
 
-    def read_keys_from_file(self) -> List[Any]:
-        keys: List[Any] = []
-        if os.path.exists(self.filename):
-            kv_pair, expiry_ts = self.get_printable_words()
-            # print(f"[***LGGGG****] printable chars are {printable_strings}")
-            # print(f"[LG****] printable chars are: {printable_strings}")
-            # only get first key
-            keys = list(kv_pair.keys())
-        return keys
-
-    def read_value_from_file(self, query_key: str) -> str:
-        query_ts = datetime.now()
-        response = self.NO_CONTENT_RESPONSE
-        if os.path.exists(self.filename):
-            kv_pair, expiry_ts = self.get_printable_words()
-            for kv, expiry in zip(kv_pair.keys(), expiry_ts):
-                if query_key == kv:
-                    value = kv_pair[query_key]
-                    is_expired = True if (expiry and expiry < query_ts) else False
-                    if not is_expired:
-                        response = f"${len(value)}\r\n{value}\r\n"
-        return response
-
-    def get_printable_words(self) -> tuple[dict[Any, Any], list[Any]]:
+    def load(self, storage: Storage) -> PersistenceStats:
+        """## Replace the keyspace of `storage` with the live keys of the dump
+
+        ### Args:
+            - `storage (Storage)`: keyspace to replace
+
+        ### Returns:
+            - `PersistenceStats`: load statistics, also kept on `storage.persistence_stats`
+        """
         with open(self.filename, "rb") as f:
-            data = f.read()
-            # print(data)
-            expiry_times = []
-            idx = data.index(251) + 3  # index of '\xfb'
-            kv_pair: Dict[Any, Any] = {}
-            while data[idx] != 255:
-                offset_fd = -1
-                offset_fc = -1
-                no_expiry_time = True
-                expiry_time = None
-                # check if either fd or fc are in the substring, and calculate the corresponding expiry timestamp
-                if 252 in data[idx:]:
-                    # print("in fc")
-                    offset_fc = data[idx:].index(252)
-                    # print(f"offset_fc = {offset_fc}")
-                    if offset_fc > 2:
-                        offset_fc = -1
-                    else:  # calculate expiry time in ms
-                        no_expiry_time = False
-                        ms = 0
-                        idx = idx + offset_fc + 1
-                        for i in range(8):
-                            # print(data[idx], end=" ")
-                            ms += data[idx] << (i * 8)
-                            idx += 1
-                        # print()
-                        expiry_time = convert_unix_timestamp_to_datetime(ms)
-                        expiry_times.append(expiry_time)
-                if 253 in data[idx:]:
-                    # print("in fd")
-                    offset_fd = data[idx:].index(253)
-                    if offset_fd > 2:
-                        offset_fd = -1
-                    else:  # calculate expiry time in ms
-                        no_expiry_time = False
-                        sec = 0
-                        idx = idx + offset_fd + 1
-                        for i in range(4):
-                            sec += data[idx] << (i * 8)
-                            idx += 1
-                        expiry_time = convert_unix_timestamp_to_datetime(sec, False)
-                        expiry_times.append(expiry_time)
-                if no_expiry_time:
-                    expiry_times.append(None)
-                # key-value pairs
-                idx += 1
-                # print(f"key_len index = {idx}", data[idx])
-                key_len = int(data[idx])
-                # print(f"key_len = {key_len}")
-                idx += 1
-                key = data[idx : idx + key_len].decode()
-                idx += key_len
-                val_len = int(data[idx])
-                idx += 1
-                value = data[idx : idx + val_len].decode()
-                kv_pair[key] = value
-                idx += val_len
-                # print(f"key = {key}",f"value = {value}")
-
-            if len(kv_pair) != len(expiry_times):
-                raise Exception("mismatched kv pair and expiry timestamps ")
-
-            return kv_pair, expiry_times
-
-    def _extract_kv_pairs(self, parsed_list: List[str]):
-        start_index = parsed_list.index("@") + 1
-        result_dict = {}
-        for i in range(start_index, len(parsed_list), 2):
-            key = parsed_list[i]
-            value = parsed_list[i + 1]
-            result_dict[key] = value
-        return result_dict
+            if os.fstat(f.fileno()).st_size == 0:
+                raise RDBError("Empty RDB file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return load_rdb(data, storage, self.verify_checksum)
+
+
+RDB_VERSION: bytes = b"0011"
+
+
+def fsync_directory(filename: str) -> None:
+    """## Sync the directory of `filename`, which makes a rename to it durable"""
+    fd: int = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _encode_stream_id(stream_id: Tuple[int, int]) -> bytes:
+    return stream_id[0].to_bytes(8, "big") + stream_id[1].to_bytes(8, "big")
+
+
+def _stream_delta(value: int, master: int) -> int:
+    """## `value - master` wrapped to a signed 64-bit integer, as redis stores it"""
+    return ((value - master + (1 << 63)) & STREAM_ID_MAX) - (1 << 63)
+
+
+def encode_length(length: int) -> bytes:
+    if length < 1 << 6:
+        return bytes([length])
+    if length < 1 << 14:
+        return bytes([0x40 | (length >> 8), length & 0xFF])
+    if length < 1 << 32:
+        return b"\x80" + length.to_bytes(4, "big")
+    return b"\x81" + length.to_bytes(8, "big")
+
+
+def encode_string(value: bytes) -> bytes:
+    # short canonical integers are stored in their integer encoding
+    if 0 < len(value) <= 11:
+        try:
+            number: int = int(value)
+        except ValueError:
+            number = None  # type: ignore
+        if number is not None and str(number).encode() == value:
+            if -(1 << 7) <= number < 1 << 7:
+                return b"\xc0" + number.to_bytes(1, "little", signed=True)
+            if -(1 << 15) <= number < 1 << 15:
+                return b"\xc1" + number.to_bytes(2, "little", signed=True)
+            if -(1 << 31) <= number < 1 << 31:
+                return b"\xc2" + number.to_bytes(4, "little", signed=True)
+    return encode_length(len(value)) + value
+
+
+def _listpack_entry(value) -> bytes:
+    if isinstance(value, int) and 0 <= value < 128:
+        encoded: bytes = bytes([value])
+    elif isinstance(value, int):
+        encoded = b"\xf4" + value.to_bytes(8, "little", signed=True)
+    elif len(value) < 64:
+        encoded = bytes([0x80 | len(value)]) + value
+    elif len(value) < 4096:
+        encoded = bytes([0xE0 | (len(value) >> 8), len(value) & 0xFF]) + value
+    else:
+        encoded = b"\xf0" + len(value).to_bytes(4, "little") + value
+    # backlen: most significant 7-bit group first, every later byte flagged
+    entry_len: int = len(encoded)
+    size: int = _listpack_backlen_size(entry_len)
+    backlen: bytes = bytes([entry_len >> (7 * (size - 1))]) + bytes(
+        ((entry_len >> (7 * shift)) & 0x7F) | 0x80 for shift in range(size - 2, -1, -1)
+    )
+    return encoded + backlen
+
+
+def encode_listpack(items: List) -> bytes:
+    body: bytes = b"".join(_listpack_entry(item) for item in items)
+    num_elements: int = min(len(items), 0xFFFF)
+    return (
+        (len(body) + 7).to_bytes(4, "little")
+        + num_elements.to_bytes(2, "little")
+        + body
+        + b"\xff"
+    )
+
+
+class RDBFileWriter:
+    """Serializes a `Storage` keyspace into the RDB format.
+
+    Output is produced in chunks through `write`, so a dump can be streamed
+    into a file or a socket without being held in memory as a whole.
+    """
+
+    CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, storage: Storage, checksum: bool = True) -> None:
+        self.storage = storage
+        self.checksum = checksum
+
+    def chunks(self) -> Iterator[bytes]:
+        crc: int = 0
+        buffer = bytearray()
+        for part in self._parts():
+            buffer += part
+            if len(buffer) >= self.CHUNK_SIZE:
+                if self.checksum:
+                    crc = crc64(buffer, crc)
+                yield bytes(buffer)
+                buffer.clear()
+        buffer.append(RDBOpcode.EOF)
+        if self.checksum:
+            crc = crc64(buffer, crc)
+        buffer += crc.to_bytes(8, "little")
+        yield bytes(buffer)
+
+    def dumps(self) -> bytes:
+        return b"".join(self.chunks())
+
+    def save(self, filename: str) -> int:
+        """## Atomically write the dump to `filename`
+
+        ### Returns:
+            - `int`: number of bytes written
+        """
+        directory: str = os.path.dirname(filename) or "."
+        temp_file: str = os.path.join(directory, f"temp-{os.getpid()}.rdb")
+        written: int = 0
+        try:
+            with open(temp_file, "wb") as f:
+                for chunk in self.chunks():
+                    f.write(chunk)
+                    written += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, filename)
+            fsync_directory(filename)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        return written
+
+    def _parts(self) -> Iterator[bytes]:
+        yield b"REDIS" + RDB_VERSION
+        for aux_key, aux_val in (
+            (b"redis-ver", b"7.2.0"),
+            (b"redis-bits", b"64"),
+            (b"ctime", str(int(time.time())).encode()),
+        ):
+            yield bytes([RDBOpcode.AUX]) + encode_string(aux_key)
+            yield encode_string(aux_val)
+        if not len(self.storage):
+            return
+        # RESIZEDB is only a sizing hint, so keys expiring meanwhile don't matter
+        yield bytes([RDBOpcode.SELECTDB]) + encode_length(0)
+        yield bytes([RDBOpcode.RESIZEDB]) + encode_length(len(self.storage))
+        yield encode_length(self.storage.expires_count())
+        now_ms: int = int(time.time() * 1000)
+        for key, entry in self.storage.items():
+            expires_at_ms: Optional[int] = self.storage.get_expiry(key)
+            if expires_at_ms is not None:
+                if expires_at_ms <= now_ms:
+                    continue
+                yield bytes([RDBOpcode.EXPIRETIME_MS]) + expires_at_ms.to_bytes(
+                    8, "little"
+                )
+            value_type, payload = self._encode_value(entry)
+            yield bytes([value_type]) + encode_string(key)
+            yield from payload
+
+    def _encode_value(self, entry: Entry) -> Tuple[RDBType, Iterator[bytes]]:
+        value = entry.value
+        if entry.type == RespDatatypes.STRING:
+            return RDBType.STRING, iter([encode_string(value)])
+        if entry.type == RespDatatypes.LIST:
+            return RDBType.LIST, self._encode_sequence(value)
+        if entry.type == RespDatatypes.SET:
+            return RDBType.SET, self._encode_sequence(value)
+        if entry.type == RespDatatypes.HASH:
+            return RDBType.HASH, self._encode_pairs(value.items(), encode_string)
+        if entry.type == RespDatatypes.ZSET:
+            return RDBType.ZSET_2, self._encode_pairs(
+                value.items(), lambda score: struct.pack("<d", score)
+            )
+        if entry.type == RespDatatypes.STREAM:
+            return RDBType.STREAM_LISTPACKS_2, self._encode_stream(value)
+        raise RDBError(f"Cannot serialize values of type {entry.type}")
+
+    def _encode_sequence(self, items) -> Iterator[bytes]:
+        yield encode_length(len(items))
+        for item in items:
+            yield encode_string(item)
+
+    def _encode_pairs(self, pairs, encode_value) -> Iterator[bytes]:
+        pairs = list(pairs)
+        yield encode_length(len(pairs))
+        for field, val in pairs:
+            yield encode_string(field)
+            yield encode_value(val)
+
+    def _encode_stream(self, stream: Stream) -> Iterator[bytes]:
+        # every in-memory block becomes one listpack node
+        blocks: List[StreamBlock] = [block for block in stream.blocks() if len(block)]
+        yield encode_length(len(blocks))
+        for block in blocks:
+            node: List[StreamEntry] = list(block)
+            master_ms, master_seq = node[0].id
+            master_fields: List[bytes] = node[0].fields[0::2]
+            items: List = [len(node), 0, len(master_fields), *master_fields]
+            items.append(0)
+            for stream_entry in node:
+                fields: List[bytes] = stream_entry.fields
+                ms_diff: int = _stream_delta(stream_entry.id[0], master_ms)
+                seq_diff: int = _stream_delta(stream_entry.id[1], master_seq)
+                if fields[0::2] == master_fields:
+                    values: List[bytes] = fields[1::2]
+                    items += [STREAM_ITEM_FLAG_SAMEFIELDS, ms_diff, seq_diff, *values]
+                    items.append(len(values) + 3)
+                else:
+                    items += [0, ms_diff, seq_diff, len(fields) // 2]
+                    items += fields
+                    items.append(len(fields) + 4)
+            yield encode_string(_encode_stream_id((master_ms, master_seq)))
+            yield encode_string(encode_listpack(items))
+        yield encode_length(len(stream))
+        first_id: StreamID = stream.first_id() or (0, 0)
+        for part in (
+            *stream.last_id,
+            *first_id,
+            *stream.max_deleted_id,
+            stream.entries_added,
+        ):
+            yield encode_length(part)
+        yield encode_length(len(stream.groups))
+        for group in stream.groups.values():
+            yield encode_string(group.name)
+            yield encode_length(group.last_delivered_id[0])
+            yield encode_length(group.last_delivered_id[1])
+            # entries read isn't tracked, all ones is redis' "unknown"
+            yield encode_length(STREAM_ID_MAX)
+            yield encode_length(len(group.pending))
+            for stream_id in group.pending_ids:
+                pending: PendingEntry = group.pending[stream_id]
+                yield _encode_stream_id(stream_id) + pending.delivery_time_ms.to_bytes(
+                    8, "little"
+                ) + encode_length(pending.delivery_count)
+            yield encode_length(len(group.consumers))
+            for consumer in group.consumers.values():
+                yield encode_string(consumer.name)
+                yield consumer.seen_time_ms.to_bytes(8, "little")
+                yield encode_length(len(consumer.pending))
+                yield b"".join(
+                    _encode_stream_id(stream_id) for stream_id in consumer.pending
+                )
+
+
+DUMP_PAYLOAD_ERROR: str = "DUMP payload version or checksum are wrong"
+
+
+def dump_value(entry: Entry) -> bytes:
+    """## Serialize one value the way DUMP does, for MIGRATE and RESTORE
+
+    The payload is the RDB type and encoded value, then the RDB version as
+    two little endian bytes and a CRC64 of everything before it.
+    """
+    value_type, parts = RDBFileWriter(Storage())._encode_value(entry)
+    payload: bytes = (
+        bytes([value_type]) + b"".join(parts) + int(RDB_VERSION).to_bytes(2, "little")
+    )
+    return payload + crc64(payload).to_bytes(8, "little")
+
+
+def restore_value(payload: bytes) -> Entry:
+    """## Decode a payload made by `dump_value`
+
+    ### Raises:
+        - `RDBError`: when the payload is truncated, from a newer RDB version or fails its checksum
+    """
+    if len(payload) < 11:
+        raise RDBError(DUMP_PAYLOAD_ERROR)
+    version: int = int.from_bytes(payload[-10:-8], "little")
+    checksum: int = int.from_bytes(payload[-8:], "little")
+    if version > int(RDB_VERSION) or crc64(payload[:-8]) != checksum:
+        raise RDBError(DUMP_PAYLOAD_ERROR)
+    reader = RDBReader(payload[:-10])
+    value_type, value = reader.read_value(reader.read_byte())
+    return Entry(value, value_type)
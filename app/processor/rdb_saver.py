@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+from app.processor.rdb_file_processor import RDBFileWriter
+from app.storage.storage import PersistenceStats, Storage, kvPair
+
+
+def _read_all(fd: int) -> bytes:
+    with os.fdopen(fd, "rb") as pipe:
+        return pipe.read()
+
+
+async def _wait_child(pid: int) -> int:
+    _, status = await asyncio.to_thread(os.waitpid, pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+class RDBSaver:
+    """Coordinates SAVE, BGSAVE and the `save <seconds> <changes>` rules.
+
+    Background snapshots run in a forked child, which sees a copy-on-write
+    image of the keyspace frozen at fork time while the parent keeps serving
+    clients.
+    """
+
+    BGSAVE_RETRY_DELAY_S: int = 5
+    # bytes read from the snapshot pipe at a time when streaming it
+    SNAPSHOT_CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, storage: Storage) -> None:
+        self.storage: Storage = storage
+        self.filename: Optional[str] = None
+        self.save_params: List[Tuple[int, int]] = []
+        self.checksum: bool = True
+        self.child_pid: Optional[int] = None
+        self._last_bgsave_try: float = 0.0
+
+    def configure(
+        self, filename: str, save_params: List[Tuple[int, int]], checksum: bool
+    ) -> None:
+        self.filename = filename
+        self.save_params = save_params
+        self.checksum = checksum
+
+    @property
+    def stats(self) -> PersistenceStats:
+        return self.storage.persistence_stats
+
+    def save(self) -> None:
+        assert self.filename, "rdb file name must be configured"
+        dirty_before: int = self.storage.dirty
+        RDBFileWriter(self.storage, self.checksum).save(self.filename)
+        self.storage.dirty -= dirty_before
+        self.stats.rdb_last_save_time = int(time.time())
+        self.stats.rdb_last_bgsave_status = "ok"
+
+    def bgsave(self) -> bool:
+        """## Fork a child that writes the snapshot
+
+        ### Returns:
+            - `bool`: False if a background save is already running
+        """
+        assert self.filename, "rdb file name must be configured"
+        if self.child_pid is not None:
+            return False
+        self._last_bgsave_try = time.time()
+        dirty_before: int = self.storage.dirty
+        pid: int = os.fork()
+        if pid == 0:
+            try:
+                RDBFileWriter(self.storage, self.checksum).save(self.filename)
+                os._exit(0)
+            except BaseException as e:
+                logging.error("Background saving failed: %s", e)
+                os._exit(1)
+        self.child_pid = pid
+        self.stats.rdb_bgsave_in_progress = 1
+        logging.info("Background saving started by pid %d", pid)
+        asyncio.create_task(self._reap_bgsave(pid, dirty_before, time.time()))
+        return True
+
+    async def _reap_bgsave(self, pid: int, dirty_before: int, started: float) -> None:
+        exit_code: int = await _wait_child(pid)
+        self.child_pid = None
+        self.stats.rdb_bgsave_in_progress = 0
+        self.stats.rdb_last_bgsave_time_sec = int(time.time() - started)
+        if exit_code == 0:
+            self.storage.dirty -= dirty_before
+            self.stats.rdb_last_save_time = int(time.time())
+            self.stats.rdb_last_bgsave_status = "ok"
+            logging.info("Background saving terminated with success")
+        else:
+            self.stats.rdb_last_bgsave_status = "err"
+            logging.error("Background saving error, child exited with %d", exit_code)
+
+    def fork_snapshot(self) -> Tuple[int, int]:
+        """## Fork a child that serializes the keyspace into a pipe
+
+        The snapshot reflects the keyspace at the time of the call.
+
+        ### Returns:
+            - `Tuple[int, int]`: the child's pid and the read end of the pipe
+        """
+        read_fd, write_fd = os.pipe()
+        pid: int = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                with os.fdopen(write_fd, "wb") as pipe:
+                    for chunk in RDBFileWriter(self.storage, self.checksum).chunks():
+                        pipe.write(chunk)
+                os._exit(0)
+            except BaseException as e:
+                logging.error("Snapshot for replicas failed: %s", e)
+                os._exit(1)
+        os.close(write_fd)
+        return pid, read_fd
+
+    async def stream_snapshot(self, pid: int, read_fd: int) -> AsyncIterator[bytes]:
+        """## Yield a forked snapshot as the child writes it, see `fork_snapshot`"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=self.SNAPSHOT_CHUNK_SIZE)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", 0)
+        )
+        completed: bool = False
+        try:
+            while chunk := await reader.read(self.SNAPSHOT_CHUNK_SIZE):
+                yield chunk
+            completed = True
+        finally:
+            # a child still writing gets EPIPE and exits
+            transport.close()
+            exit_code: int = await _wait_child(pid)
+        if completed and exit_code != 0:
+            raise Exception(f"snapshot child exited with {exit_code}")
+
+    async def snapshot_bytes(self) -> bytes:
+        """## Serialize the keyspace in a forked child and collect it over a pipe"""
+        pid, read_fd = self.fork_snapshot()
+        snapshot: bytes = await asyncio.to_thread(_read_all, read_fd)
+        exit_code: int = await _wait_child(pid)
+        if exit_code != 0:
+            raise Exception(f"snapshot child exited with {exit_code}")
+        return snapshot
+
+    def cron(self) -> None:
+        if self.child_pid is not None or not self.filename:
+            return
+        now: float = time.time()
+        if (
+            self.stats.rdb_last_bgsave_status != "ok"
+            and now - self._last_bgsave_try < self.BGSAVE_RETRY_DELAY_S
+        ):
+            return
+        for seconds, changes in self.save_params:
+            if (
+                self.storage.dirty >= changes
+                and now - self.stats.rdb_last_save_time >= seconds
+            ):
+                logging.info("%d changes in %d seconds. Saving...", changes, seconds)
+                self.bgsave()
+                return
+
+
+rdb_saver: RDBSaver = RDBSaver(kvPair)
@@ -0,0 +1,487 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+
+from app.handler.connection import Connection
+from app.handler.server_conf import ServerInfo, ServerRole
+from app.processor.rdb_saver import rdb_saver
+from app.processor.replication_backlog import repl_backlog
+from app.processor.resp_coder import RespCoder
+
+
+class ReplicaLink:
+    """An attached replica, fed by a writer task of its own.
+
+    The master only ever appends to the link's queue, so a replica that
+    reads slowly delays nobody but itself. Its output buffer, queued bytes
+    plus what the transport still holds, is checked against the
+    `client-output-buffer-limit replica` limits and the link is dropped
+    once it crosses the hard limit, or stays above the soft one for too
+    long.
+    """
+
+    def __init__(
+        self,
+        writer: Connection,
+        limits: Tuple[int, int, int],
+        offset: int,
+        listening_port: Optional[int] = None,
+    ) -> None:
+        self.writer: Connection = writer
+        self.addr = writer.get_extra_info("peername")
+        # the port the replica serves clients on, from REPLCONF listening-port
+        self.listening_port: Optional[int] = listening_port
+        # highest offset the replica confirmed with REPLCONF ACK
+        self.ack_offset: int = offset
+        self.ack_time: float = time.time()
+        # hard limit, soft limit (bytes, 0 disables) and soft limit seconds
+        self.limits: Tuple[int, int, int] = limits
+        self.closed: bool = False
+        self._chunks: Deque[bytes] = deque()
+        self._queued_bytes: int = 0
+        self._soft_limit_since: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task = asyncio.create_task(self._write_loop())
+
+    @property
+    def output_buffer_size(self) -> int:
+        return self._queued_bytes + self.writer.transport.get_write_buffer_size()
+
+    def send(self, data: bytes) -> None:
+        if self.closed or not data:
+            return
+        self._chunks.append(data)
+        self._queued_bytes += len(data)
+        self._ready.set()
+        self.enforce_limits()
+
+    def enforce_limits(self) -> None:
+        if self.closed:
+            return
+        hard, soft, soft_seconds = self.limits
+        size: int = self.output_buffer_size
+        if soft and size >= soft:
+            now: float = time.monotonic()
+            if self._soft_limit_since is None:
+                self._soft_limit_since = now
+            over_soft: bool = now - self._soft_limit_since >= soft_seconds
+        else:
+            self._soft_limit_since = None
+            over_soft = False
+        if over_soft or (hard and size >= hard):
+            logging.warning(
+                "Replica %s scheduled to be closed for overcoming of "
+                "output buffer limits (%d bytes)",
+                self.addr,
+                size,
+            )
+            self.close()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._chunks:
+                    data: bytes = self._chunks.popleft()
+                    self._queued_bytes -= len(data)
+                    self.writer.write(data)
+                await self.writer.drain()
+        except ConnectionError as e:
+            logging.error("Failed to write to replica %s: %s", self.addr, e)
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._chunks.clear()
+        self._queued_bytes = 0
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        # whatever is still buffered is useless, the replica has to resync
+        self.writer.transport.abort()
+
+
+@dataclass
+class MasterLinkState:
+    """What a replica knows about its link to the master, reported by INFO."""
+
+    host: str
+    port: int
+    up: bool = False
+    sync_in_progress: bool = False
+    # time.time() of the last bytes read from the master, 0 before any
+    last_io: float = 0.0
+    down_since: float = field(default_factory=time.time)
+
+    def info(self) -> List[Tuple[str, str]]:
+        now: float = time.time()
+        section: List[Tuple[str, str]] = [
+            ("master_host", self.host),
+            ("master_port", str(self.port)),
+            ("master_link_status", "up" if self.up else "down"),
+            (
+                "master_last_io_seconds_ago",
+                str(int(now - self.last_io)) if self.last_io else "-1",
+            ),
+            ("master_sync_in_progress", str(int(self.sync_in_progress))),
+        ]
+        if not self.up:
+            section.append(
+                ("master_link_down_since_seconds", str(int(now - self.down_since)))
+            )
+        return section
+
+
+class AckWaiter:
+    """A WAIT call parked until `numreplicas` replicas acknowledge `offset`."""
+
+    __slots__ = ("offset", "numreplicas", "future")
+
+    def __init__(self, offset: int, numreplicas: int) -> None:
+        self.offset: int = offset
+        self.numreplicas: int = numreplicas
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class DisklessSync:
+    """One snapshot streamed to every replica that asked for a full sync
+    within `repl-diskless-sync-delay`.
+
+    The child's output is written to all sockets as it comes, with no size
+    known up front, so the payload is framed as a `$EOF:<mark>` line, the
+    snapshot, then the same 40 byte random mark.
+    """
+
+    def __init__(self) -> None:
+        self.eof_mark: bytes = os.urandom(20).hex().encode()
+        # replication offset the snapshot reflects, set when it is forked
+        self.offset: int = 0
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.replicas: List[ReplicaLink] = []
+        # replicas that joined and haven't attached or given up yet
+        self.joining: int = 0
+        self._all_attached = asyncio.Event()
+
+    def join(self) -> None:
+        self.joining += 1
+        self._all_attached.clear()
+
+    def withdraw(self) -> None:
+        self.joining -= 1
+        if not self.joining:
+            self._all_attached.set()
+
+    def add(self, replica: ReplicaLink) -> None:
+        self.replicas.append(replica)
+        self.withdraw()
+
+    async def wait_attached(self) -> None:
+        if self.joining:
+            await self._all_attached.wait()
+
+    async def send(self, data: bytes) -> None:
+        """## Write `data` to every replica, paced by the slowest one"""
+        live: List[ReplicaLink] = [
+            replica for replica in self.replicas if not replica.closed
+        ]
+        for replica in live:
+            replica.writer.write(data)
+        results = await asyncio.gather(
+            *(replica.writer.drain() for replica in live), return_exceptions=True
+        )
+        for replica, result in zip(live, results):
+            if isinstance(result, Exception):
+                logging.error(
+                    "Diskless sync to replica %s failed: %s", replica.addr, result
+                )
+                replica.close()
+        self.replicas = [replica for replica in self.replicas if not replica.closed]
+
+
+class ReplicationFeed:
+    """Turns executed writes into the replication stream.
+
+    Requests are encoded once by the caller and collected in one shared
+    buffer; at the end of the event loop iteration the buffer becomes a
+    single chunk handed to every replica's queue, so fan-out costs one
+    append per replica no matter how many writes it carries.
+
+    WAIT callers share ACK rounds: a `REPLCONF GETACK *` is queued at most
+    once per loop iteration, and only when a waiter needs an offset past
+    the one the last round asked about.
+    """
+
+    GETACK_REQUEST: bytes = RespCoder.encode([b"REPLCONF", b"GETACK", b"*"])
+    PING_REQUEST: bytes = RespCoder.encode([b"PING"])
+    # the master pings its replicas this often so an idle link still shows life
+    REPL_PING_PERIOD_S: float = 10.0
+
+    def __init__(self) -> None:
+        self.config: Optional[ServerInfo] = None
+        self.replicas: List[ReplicaLink] = []
+        self._pending = bytearray()
+        self._flush_scheduled: bool = False
+        self._ack_waiters: List[AckWaiter] = []
+        # master offset the last GETACK round will be answered with
+        self._acks_requested_at: int = -1
+        self._getack_scheduled: bool = False
+        self._last_ping: float = time.monotonic()
+        # diskless sync still accepting replicas
+        self._diskless_sync: Optional[DisklessSync] = None
+        # set on replicas only
+        self.master_link: Optional[MasterLinkState] = None
+
+    def configure(self, config: ServerInfo) -> None:
+        self.config = config
+
+    def feed(self, data: bytes) -> None:
+        """## Append an encoded request to the replication stream"""
+        if self.config is None or self.config.role != ServerRole.MASTER:
+            return
+        # nobody could ever read this part of the stream
+        if not repl_backlog.active and not self.replicas:
+            return
+        self.config.master_repl_offset += len(data)
+        repl_backlog.feed(data)
+        if not self.replicas:
+            return
+        self._pending += data
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        chunk: bytes = bytes(self._pending)
+        self._pending.clear()
+        for replica in self.replicas:
+            replica.send(chunk)
+        self._discard_closed()
+
+    def attach(
+        self,
+        writer: Connection,
+        offset: int,
+        listening_port: Optional[int] = None,
+        diskless_sync: Optional[DisklessSync] = None,
+    ) -> Optional[ReplicaLink]:
+        """## Start streaming to a replica that has applied everything up to `offset`
+
+        Writes made while its sync reply or snapshot was on the way are
+        replayed from the backlog first. A replica in a diskless sync only
+        joins the stream once the shared snapshot has been sent.
+        """
+        assert self.config, "replication must be configured"
+        if diskless_sync is not None:
+            replica = ReplicaLink(
+                writer,
+                self.config.replica_output_buffer_limit,
+                offset,
+                listening_port,
+            )
+            diskless_sync.add(replica)
+            return replica
+        # the backlog already holds what is pending, don't send it twice
+        self.flush()
+        missed: Optional[bytes] = repl_backlog.read_from(offset)
+        if missed is None:
+            logging.warning("Backlog overrun while syncing replica, dropping it")
+            writer.close()
+            return None
+        replica = ReplicaLink(
+            writer,
+            self.config.replica_output_buffer_limit,
+            offset,
+            listening_port,
+        )
+        replica.send(missed)
+        self.replicas.append(replica)
+        return replica
+
+    async def join_diskless_sync(self) -> DisklessSync:
+        """## Wait for the diskless sync this replica will share, and its offset
+
+        The first replica opens a batch and starts the delay; every replica
+        asking before it runs gets the same snapshot. Once this returns the
+        caller must `attach` with the batch, or the sync waits for it.
+        """
+        assert self.config, "replication must be configured"
+        batch: Optional[DisklessSync] = self._diskless_sync
+        if batch is None:
+            batch = self._diskless_sync = DisklessSync()
+            asyncio.get_running_loop().call_later(
+                self.config.repl_diskless_sync_delay, self._start_diskless_sync, batch
+            )
+        batch.join()
+        try:
+            await asyncio.shield(batch.started)
+        except BaseException:
+            batch.withdraw()
+            raise
+        return batch
+
+    def _start_diskless_sync(self, batch: DisklessSync) -> None:
+        assert self.config, "replication must be configured"
+        self._diskless_sync = None
+        if not batch.joining:
+            return
+        try:
+            pid, read_fd = rdb_saver.fork_snapshot()
+        except OSError as e:
+            batch.started.set_exception(e)
+            return
+        batch.offset = self.config.master_repl_offset
+        batch.started.set_result(None)
+        logging.info("Starting diskless sync at offset %d", batch.offset)
+        asyncio.create_task(self._stream_diskless_sync(batch, pid, read_fd))
+
+    async def _stream_diskless_sync(
+        self, batch: DisklessSync, pid: int, read_fd: int
+    ) -> None:
+        await batch.wait_attached()
+        try:
+            async with contextlib.aclosing(
+                rdb_saver.stream_snapshot(pid, read_fd)
+            ) as chunks:
+                async for chunk in chunks:
+                    await batch.send(chunk)
+                    if not batch.replicas:
+                        logging.warning("Diskless sync aborted, no replica left")
+                        return
+            await batch.send(batch.eof_mark)
+        except Exception as e:
+            logging.error("Diskless sync failed: %s", e)
+            for replica in batch.replicas:
+                replica.close()
+            return
+        # the backlog already holds what is pending, don't send it twice
+        self.flush()
+        missed: Optional[bytes] = repl_backlog.read_from(batch.offset)
+        for replica in batch.replicas:
+            if missed is None:
+                logging.warning("Backlog overrun while syncing replica, dropping it")
+                replica.close()
+                continue
+            replica.send(missed)
+            self.replicas.append(replica)
+        self._discard_closed()
+
+    def detach(self, writer: Connection) -> bool:
+        for replica in self.replicas:
+            if replica.writer is writer:
+                replica.close()
+                self._discard_closed()
+                return True
+        return False
+
+    def ack(self, writer: Connection, offset: int) -> None:
+        """## Record a `REPLCONF ACK` received on a replica's connection"""
+        for replica in self.replicas:
+            if replica.writer is writer:
+                replica.ack_offset = max(replica.ack_offset, offset)
+                replica.ack_time = time.time()
+                break
+        for waiter in self._ack_waiters:
+            if (
+                not waiter.future.done()
+                and self.count_acked(waiter.offset) >= waiter.numreplicas
+            ):
+                waiter.future.set_result(None)
+
+    def count_acked(self, offset: int) -> int:
+        return sum(1 for replica in self.replicas if replica.ack_offset >= offset)
+
+    async def wait_for_acks(
+        self, offset: int, numreplicas: int, timeout_ms: int
+    ) -> int:
+        """## Wait until `numreplicas` replicas acknowledged `offset`
+
+        ### Args:
+            - `offset (int)`: replication offset of the caller's last write
+            - `numreplicas (int)`: replicas to wait for
+            - `timeout_ms (int)`: give up after this long, 0 waits for ever
+
+        ### Returns:
+            - `int`: replicas that acknowledged `offset` when the wait ended
+        """
+        if self.count_acked(offset) >= numreplicas:
+            return self.count_acked(offset)
+        waiter = AckWaiter(offset, numreplicas)
+        self._ack_waiters.append(waiter)
+        self.request_acks(offset)
+        try:
+            await asyncio.wait_for(
+                waiter.future, timeout_ms / 1000 if timeout_ms else None
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # also runs when the client goes away and the wait is cancelled
+            self._ack_waiters.remove(waiter)
+        return self.count_acked(offset)
+
+    def request_acks(self, offset: int) -> None:
+        # a round already on its way will be answered past `offset`
+        if offset <= self._acks_requested_at or self._getack_scheduled:
+            return
+        self._getack_scheduled = True
+        asyncio.get_running_loop().call_soon(self._send_getack)
+
+    def _send_getack(self) -> None:
+        self._getack_scheduled = False
+        assert self.config, "replication must be configured"
+        target: int = self.config.master_repl_offset
+        if all(replica.ack_offset >= target for replica in self.replicas):
+            return
+        self._acks_requested_at = target
+        self.feed(self.GETACK_REQUEST)
+
+    def cron(self) -> None:
+        for replica in self.replicas:
+            replica.enforce_limits()
+        self._discard_closed()
+        if (
+            self.replicas
+            and time.monotonic() - self._last_ping >= self.REPL_PING_PERIOD_S
+        ):
+            self._last_ping = time.monotonic()
+            self.feed(self.PING_REQUEST)
+
+    def info(self) -> List[Tuple[str, str]]:
+        if self.master_link is not None:
+            assert self.config, "replication must be configured"
+            return [
+                *self.master_link.info(),
+                ("slave_repl_offset", str(self.config.master_repl_offset)),
+                ("slave_read_only", "1"),
+                ("connected_slaves", "0"),
+            ]
+        section: List[Tuple[str, str]] = [("connected_slaves", str(len(self.replicas)))]
+        now: float = time.time()
+        for index, replica in enumerate(self.replicas):
+            ip: str = replica.addr[0] if replica.addr else "?"
+            port = replica.listening_port or (replica.addr[1] if replica.addr else 0)
+            section.append(
+                (
+                    f"slave{index}",
+                    f"ip={ip},port={port},state=online,"
+                    f"offset={replica.ack_offset},lag={int(now - replica.ack_time)}",
+                )
+            )
+        return section
+
+    def _discard_closed(self) -> None:
+        if any(replica.closed for replica in self.replicas):
+            self.replicas = [replica for replica in self.replicas if not replica.closed]
+
+
+replication: ReplicationFeed = ReplicationFeed()
@@ -0,0 +1,85 @@
+from typing import List, Optional, Tuple
+
+
+class ReplicationBacklog:
+    """Fixed-size circular buffer holding the tail of the replication stream.
+
+    Offsets are replication offsets: the number of stream bytes produced
+    before a given point. A replica that has applied everything up to an
+    offset still inside the buffer can resume with `+CONTINUE` and only
+    receive what it missed, instead of a full snapshot.
+
+    The buffer is only allocated once the first replica asks to sync.
+    """
+
+    def __init__(self) -> None:
+        self.size: int = 1024 * 1024
+        self._buffer: Optional[bytearray] = None
+        # position in _buffer the next byte is written to
+        self._index: int = 0
+        self.histlen: int = 0
+        # replication offset right after the last byte held
+        self.end_offset: int = 0
+
+    def configure(self, size: int) -> None:
+        self.size = size
+
+    @property
+    def active(self) -> bool:
+        return self._buffer is not None
+
+    def create(self, offset: int) -> None:
+        """## Allocate the buffer, starting empty at replication offset `offset`"""
+        self._buffer = bytearray(self.size)
+        self._index = 0
+        self.histlen = 0
+        self.end_offset = offset
+
+    def feed(self, data: bytes) -> None:
+        if self._buffer is None:
+            return
+        self.end_offset += len(data)
+        # only the last `size` bytes can survive anyway
+        view = memoryview(data)[-self.size :]
+        head: int = min(len(view), self.size - self._index)
+        self._buffer[self._index : self._index + head] = view[:head]
+        self._buffer[: len(view) - head] = view[head:]
+        self._index = (self._index + len(view)) % self.size
+        self.histlen = min(self.histlen + len(view), self.size)
+
+    def covers(self, offset: int) -> bool:
+        """## Whether the stream from `offset` up to now is still held"""
+        return (
+            self._buffer is not None
+            and self.end_offset - self.histlen <= offset <= self.end_offset
+        )
+
+    def read_from(self, offset: int) -> Optional[bytes]:
+        """## The stream bytes produced after replication offset `offset`
+
+        ### Returns:
+            - `Optional[bytes]`: None when that part of the stream was already overwritten
+        """
+        if self._buffer is None or not self.covers(offset):
+            return None
+        count: int = self.end_offset - offset
+        start: int = (self._index - count) % self.size
+        if start + count <= self.size:
+            return bytes(self._buffer[start : start + count])
+        return bytes(self._buffer[start:]) + bytes(
+            self._buffer[: count - (self.size - start)]
+        )
+
+    def info(self) -> List[Tuple[str, str]]:
+        return [
+            ("repl_backlog_active", str(int(self.active))),
+            ("repl_backlog_size", str(self.size)),
+            (
+                "repl_backlog_first_byte_offset",
+                str(self.end_offset - self.histlen + 1 if self.active else 0),
+            ),
+            ("repl_backlog_histlen", str(self.histlen)),
+        ]
+
+
+repl_backlog: ReplicationBacklog = ReplicationBacklog()
@@ -1,58 +1,174 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
 class RespCoder:
     TERMINATOR: str = "\r\n"
     NULL_BULK_STRING_BYTES: bytes = b"$-1\r\n"
+    WRONGTYPE_BYTES: bytes = (
+        b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+    )
 
     @classmethod
-    def encode(cls, data) -> str:
+    def encode(cls, data) -> bytes:
+        """## Encode a reply; bulk string lengths are counted in bytes
+
+        `str` items are UTF-8 encoded, `bytes` items are written untouched and
+        None becomes a null bulk string.
+        """
+        if data is None:
+            return cls.NULL_BULK_STRING_BYTES
         if isinstance(data, int):
-            return f":+{data}{cls.TERMINATOR}"
+            return b":+%d\r\n" % data
         if isinstance(data, str):
-            return f"${len(data)}{cls.TERMINATOR}{data}{cls.TERMINATOR}"
+            data = data.encode()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return b"$%d\r\n%s\r\n" % (len(data), data)
         elif isinstance(data, list):
-            encoded_str: List = []
+            encoded: List[bytes] = [b"*%d\r\n" % len(data)]
             for entry in data:
-                encoded_str.append(RespCoder.encode(entry))
-            joined_str: str = "".join(encoded_str)
-            return f"*{len(encoded_str)}{cls.TERMINATOR}{joined_str}"
-        return ""
+                encoded.append(RespCoder.encode(entry))
+            return b"".join(encoded)
+        return b""
 
     @classmethod
-    def encode_as_simple_str(cls, data: str) -> str:
-        return f"${len(data)}{cls.TERMINATOR}{data}{cls.TERMINATOR}"
+    def encode_as_simple_str(cls, data: str) -> bytes:
+        return cls.encode(data)
+
+
+# longest inline request or length line accepted before a newline, as redis
+INLINE_MAX_SIZE: int = 64 * 1024
+# redis' default proto-max-bulk-len
+BULK_MAX_LEN: int = 512 * 1024 * 1024
+# redis refuses multibulk counts that don't fit a C int
+MULTIBULK_MAX_LEN: int = (1 << 31) - 1
+# "-" and 19 digits hold any signed 64-bit length
+LENGTH_MAX_DIGITS: int = 20
+
+
+class RespProtocolError(Exception):
+    """Malformed input; `commands` holds the frames that completed before it."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.commands: List[Tuple[List[bytes], int]] = []
+
 
+class RespParser:
+    """Incremental RESP request parser, one instance per connection.
 
-def parse_input_array_bytes(data: bytes) -> List[Tuple[bytes, int]]:
-    commands = []
-    i = 0
-    n = len(data)
+    Bytes are appended to a rolling buffer with `feed`; every complete frame
+    (multibulk array or inline command) is returned together with its size in
+    bytes, while a trailing partial frame stays buffered until the rest of it
+    arrives. Consumed bytes are only discarded once per `feed` call, so large
+    pipelines and multi-megabyte bulk strings are never re-sliced per command.
+    Arguments come out as the exact `bytes` received, with no decoding.
+    """
 
-    while i < n:
-        if data[i : i + 1] == b"*":
-            command_start = i
-            # Read the number of elements in the array
-            end_of_line = data.index(b"\r\n", i)
-            num_elements = int(data[i + 1 : end_of_line].decode())
+    def __init__(self) -> None:
+        self._buffer: bytearray = bytearray()
+        self._pos: int = 0
+        # buffer length required before a pending partial frame can complete
+        self._need: int = 0
+
+    def feed(self, data: bytes) -> List[Tuple[List[bytes], int]]:
+        self._buffer += data
+        commands: List[Tuple[List[bytes], int]] = []
+        if len(self._buffer) < self._need:
+            return commands
+        self._need = 0
+        try:
+            while self._pos < len(self._buffer):
+                start: int = self._pos
+                if self._buffer[start] == 0x2A:  # b"*"
+                    parsed = self._parse_multibulk(start)
+                else:
+                    parsed = self._parse_inline(start)
+                if parsed is None:
+                    break
+                command, end = parsed
+                self._pos = end
+                if command:
+                    commands.append((command, end - start))
+        except RespProtocolError as e:
+            e.commands = commands
+            raise
+        if self._pos:
+            del self._buffer[: self._pos]
+            self._need = max(self._need - self._pos, 0)
+            self._pos = 0
+        return commands
+
+    def _read_line(self, start: int) -> Optional[int]:
+        end_of_line: int = self._buffer.find(b"\r\n", start)
+        if end_of_line == -1:
+            if len(self._buffer) - start > INLINE_MAX_SIZE:
+                raise RespProtocolError("Protocol error: too big count string")
+            self._need = len(self._buffer) + 1
+            return None
+        return end_of_line
+
+    def _parse_length(self, start: int, end: int, limit: int, kind: str) -> int:
+        """## Length on a `*` or `$` line, at most `limit`
+
+        Only an optional `-` followed by ASCII digits is taken, as redis'
+        string2ll does; `int()` alone would also accept signs, spaces and
+        underscores.
+        """
+        digits: bytearray = self._buffer[start:end]
+        unsigned: bytearray = digits[1:] if digits[:1] == b"-" else digits
+        if unsigned.isdigit() and len(digits) <= LENGTH_MAX_DIGITS:
+            length: int = int(digits)
+            if length <= limit:
+                return length
+        raise RespProtocolError(f"Protocol error: invalid {kind} length")
+
+    def _parse_multibulk(self, start: int) -> Optional[Tuple[List[bytes], int]]:
+        end_of_line = self._read_line(start)
+        if end_of_line is None:
+            return None
+        num_elements: int = self._parse_length(
+            start + 1, end_of_line, MULTIBULK_MAX_LEN, "multibulk"
+        )
+        i: int = end_of_line + 2
+        command: List[bytes] = []
+        for _ in range(num_elements):
+            if i >= len(self._buffer):
+                self._need = i + 1
+                return None
+            if self._buffer[i] != 0x24:  # b"$"
+                raise RespProtocolError(
+                    f"Protocol error: expected '$', got {chr(self._buffer[i])!r}"
+                )
+            end_of_line = self._read_line(i)
+            if end_of_line is None:
+                return None
+            str_length: int = self._parse_length(
+                i + 1, end_of_line, BULK_MAX_LEN, "bulk"
+            )
+            if str_length < 0:
+                # a null bulk carries no argument, redis refuses it in requests
+                raise RespProtocolError("Protocol error: invalid bulk length")
             i = end_of_line + 2
+            if len(self._buffer) < i + str_length + 2:
+                self._need = i + str_length + 2
+                return None
+            command.append(bytes(self._buffer[i : i + str_length]))
+            i += str_length + 2  # Move to the end of the string and skip \r\n
+        return command, i
+
+    def _parse_inline(self, start: int) -> Optional[Tuple[List[bytes], int]]:
+        end_of_line: int = self._buffer.find(b"\n", start)
+        if end_of_line == -1:
+            if len(self._buffer) - start > INLINE_MAX_SIZE:
+                raise RespProtocolError("Protocol error: too big inline request")
+            self._need = len(self._buffer) + 1
+            return None
+        return bytes(self._buffer[start:end_of_line]).split(), end_of_line + 1
+
 
-            # Read the specified number of elements
-            command = []
-            for _ in range(num_elements):
-                if data[i : i + 1] == b"$":
-                    # Read the length of the next string
-                    end_of_line = data.index(b"\r\n", i)
-                    str_length = int(data[i + 1 : end_of_line].decode())
-                    i = end_of_line + 2
-
-                    # Read the string of the specified length
-                    argument = data[i : i + str_length].decode()
-                    command.append(argument)
-                    i += str_length + 2  # Move to the end of the string and skip \r\n
-            command_end = i
-            commands.append((command, command_end - command_start))
-    return commands
+def parse_input_array_bytes(data: bytes) -> List[Tuple[List[bytes], int]]:
+    """Parse a buffer that is known to hold only complete frames."""
+    return RespParser().feed(data)
 
 
 PING_REQUEST_STR: str = "ping"
@@ -1,74 +1,784 @@
-from _collections_abc import dict_keys
+from _collections_abc import dict_items
+import array
 import asyncio
-from dataclasses import dataclass
+import bisect
+from dataclasses import dataclass, field
 import enum
-from typing import Dict, List, Optional
+import heapq
+import sys
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 import time
 
+# (milliseconds, sequence)
+StreamID = Tuple[int, int]
+STREAM_ID_MAX: int = (1 << 64) - 1
+# range of the signed 64-bit deltas a block stores its IDs as
+STREAM_DELTA_MIN: int = -(1 << 63)
+STREAM_DELTA_MAX: int = (1 << 63) - 1
+
+
+def format_stream_id(stream_id: StreamID) -> bytes:
+    return b"%d-%d" % stream_id
+
 
-@dataclass
 class StreamEntry:
-    def __init__(self, t_ms, seq, entry_key, entry_value) -> None:
-        self.t_ms = t_ms
-        self.seq = seq
-        self.entry_key = entry_key
-        self.entry_value = entry_value
-        self.stream_id: str = f"{self.t_ms}-{self.seq}"
-        self.flattenned_entry: List = [
-            f"{self.stream_id}",
-            [self.entry_key, self.entry_value],
-        ]
+    __slots__ = ("id", "fields")
 
+    def __init__(self, id: StreamID, fields: List[bytes]) -> None:
+        self.id: StreamID = id
+        # field1, value1, field2, value2, ...
+        self.fields: List[bytes] = fields
 
-class RespDatatypes(enum.Enum):
-    STRING = "string"
-    STREAM = "stream"
+    @property
+    def stream_id(self) -> bytes:
+        return format_stream_id(self.id)
 
 
-class Entry:
-    def __init__(
+class StreamBlock:
+    """Up to `Stream.BLOCK_MAX_ENTRIES` consecutive entries stored by column.
+
+    Modelled on a stream listpack node: IDs are kept as deltas from the
+    block's master ID, field names are stored once per distinct schema and
+    referenced by index, and all values share one byte buffer addressed by
+    end offsets. An entry only costs a few machine words plus its value
+    bytes; `StreamEntry` objects are built on demand when read.
+
+    Entries trimmed off the front are only skipped over through `start`;
+    their space is given back when the whole block is dropped.
+    """
+
+    __slots__ = (
+        "master_id",
+        "start",
+        "_ms_deltas",
+        "_seq_deltas",
+        "_schema_ids",
+        "_schemas",
+        "_first_value",
+        "_value_ends",
+        "_values",
+    )
+
+    def __init__(self, master_id: StreamID) -> None:
+        self.master_id: StreamID = master_id
+        # index of the first live entry
+        self.start: int = 0
+        self._ms_deltas: array.array = array.array("q")
+        self._seq_deltas: array.array = array.array("q")
+        # index into _schemas for every entry
+        self._schema_ids: array.array = array.array("B")
+        self._schemas: List[Tuple[bytes, ...]] = []
+        # index into _value_ends of each entry's first value
+        self._first_value: array.array = array.array("I")
+        self._value_ends: array.array = array.array("I")
+        self._values: bytearray = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._ms_deltas) - self.start
+
+    def __iter__(self) -> Iterator[StreamEntry]:
+        for index in range(self.start, self.end):
+            yield self.entry_at(index)
+
+    @property
+    def end(self) -> int:
+        """## Index one past the last entry"""
+        return len(self._ms_deltas)
+
+    def first_id(self) -> StreamID:
+        return self.id_at(self.start)
+
+    def last_id(self) -> StreamID:
+        return self.id_at(self.end - 1)
+
+    def fits(self, stream_id: StreamID) -> bool:
+        """## Whether both parts of `stream_id` are in delta range of `master_id`
+
+        IDs go up to 2^64 - 1 while the deltas are signed 64-bit, so an ID
+        far from the master ID needs a block of its own.
+        """
+        return (
+            STREAM_DELTA_MIN <= stream_id[0] - self.master_id[0] <= STREAM_DELTA_MAX
+            and STREAM_DELTA_MIN <= stream_id[1] - self.master_id[1] <= STREAM_DELTA_MAX
+        )
+
+    def append(self, entry: StreamEntry) -> None:
+        """## Add `entry`, whose ID the caller checked `fits`"""
+        names: Tuple[bytes, ...] = tuple(entry.fields[0::2])
+        if self._schema_ids and self._schemas[self._schema_ids[-1]] == names:
+            schema_id: int = self._schema_ids[-1]
+        elif names in self._schemas:
+            schema_id = self._schemas.index(names)
+        else:
+            schema_id = len(self._schemas)
+            self._schemas.append(names)
+        self._ms_deltas.append(entry.id[0] - self.master_id[0])
+        self._seq_deltas.append(entry.id[1] - self.master_id[1])
+        self._schema_ids.append(schema_id)
+        self._first_value.append(len(self._value_ends))
+        for value in entry.fields[1::2]:
+            self._values += value
+            self._value_ends.append(len(self._values))
+
+    def id_at(self, index: int) -> StreamID:
+        return (
+            self.master_id[0] + self._ms_deltas[index],
+            self.master_id[1] + self._seq_deltas[index],
+        )
+
+    def entry_at(self, index: int) -> StreamEntry:
+        names: Tuple[bytes, ...] = self._schemas[self._schema_ids[index]]
+        first: int = self._first_value[index]
+        start: int = self._value_ends[first - 1] if first else 0
+        fields: List[bytes] = []
+        for position, name in enumerate(names, first):
+            end: int = self._value_ends[position]
+            fields.append(name)
+            fields.append(bytes(self._values[start:end]))
+            start = end
+        return StreamEntry(self.id_at(index), fields)
+
+    def bisect(self, stream_id: StreamID) -> int:
+        """## Index of the first live entry whose ID is not lower than `stream_id`"""
+        return bisect.bisect_left(
+            range(self.end), stream_id, lo=self.start, key=self.id_at
+        )
+
+    def drop_head(self, count: int) -> None:
+        self.start += count
+
+    def memory_usage(self) -> int:
+        return (
+            sys.getsizeof(self)
+            + sum(
+                sys.getsizeof(column)
+                for column in (
+                    self._ms_deltas,
+                    self._seq_deltas,
+                    self._schema_ids,
+                    self._first_value,
+                    self._value_ends,
+                    self._values,
+                )
+            )
+            + sys.getsizeof(self._schemas)
+            + sum(
+                sys.getsizeof(schema) + sum(sys.getsizeof(name) for name in schema)
+                for schema in self._schemas
+            )
+        )
+
+
+class Stream:
+    """Entries of a stream kept in ID order, split into fixed-size blocks.
+
+    Like the radix tree of listpacks Redis uses, a lookup first bisects the
+    first ID of every block and then bisects inside a single block, so
+    finding where a range starts is O(log n) and a range read only touches
+    the entries it returns.
+
+    Trimming drops blocks from the front by advancing `_head`; the block
+    lists are compacted once the dropped prefix outgrows the live part, so
+    capping a stream costs amortized O(1) per removed block.
+    """
+
+    BLOCK_MAX_ENTRIES: int = 100
+
+    def __init__(self) -> None:
+        self._blocks: List[StreamBlock] = []
+        self._block_first_ids: List[StreamID] = []
+        # index of the first live block, the ones before it were trimmed
+        self._head: int = 0
+        self.length: int = 0
+        self.last_id: StreamID = (0, 0)
+        self.max_deleted_id: StreamID = (0, 0)
+        self.entries_added: int = 0
+        self.groups: Dict[bytes, StreamGroup] = {}
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[StreamEntry]:
+        for index in range(self._head, len(self._blocks)):
+            yield from self._blocks[index]
+
+    def blocks(self) -> List[StreamBlock]:
+        return self._blocks[self._head :]
+
+    def first_id(self) -> Optional[StreamID]:
+        return self._block_first_ids[self._head] if self.length else None
+
+    def append(self, entry: StreamEntry) -> None:
+        """## Add `entry`, whose ID must be greater than `last_id`"""
+        if (
+            self._head == len(self._blocks)
+            or self._blocks[-1].end >= self.BLOCK_MAX_ENTRIES
+            or not self._blocks[-1].fits(entry.id)
+        ):
+            self._blocks.append(StreamBlock(entry.id))
+            self._block_first_ids.append(entry.id)
+        self._blocks[-1].append(entry)
+        self.length += 1
+        self.entries_added += 1
+        self.last_id = entry.id
+
+    def range(
+        self, start: StreamID, end: StreamID, count: Optional[int] = None
+    ) -> List[StreamEntry]:
+        """## Entries with `start <= id <= end`, at most `count` of them"""
+        result: List[StreamEntry] = []
+        if not self.length or start > end or count == 0:
+            return result
+        block_index: int = max(
+            bisect.bisect_right(self._block_first_ids, start, lo=self._head) - 1,
+            self._head,
+        )
+        position: int = self._blocks[block_index].bisect(start)
+        for index in range(block_index, len(self._blocks)):
+            block: StreamBlock = self._blocks[index]
+            for offset in range(position, block.end):
+                if block.id_at(offset) > end:
+                    return result
+                result.append(block.entry_at(offset))
+                if count is not None and len(result) >= count:
+                    return result
+            if index + 1 < len(self._blocks):
+                position = self._blocks[index + 1].start
+        return result
+
+    def get(self, stream_id: StreamID) -> Optional[StreamEntry]:
+        found: List[StreamEntry] = self.range(stream_id, stream_id, 1)
+        return found[0] if found else None
+
+    def trim(
         self,
-        value,
-        len: int,
-        ttl: Optional[int] = None,
-        type: str = RespDatatypes.STRING.value,
-        stream_id: Optional[str] = None,
+        max_len: Optional[int] = None,
+        min_id: Optional[StreamID] = None,
+        approximate: bool = False,
+        limit: Optional[int] = None,
+    ) -> int:
+        """## Evict the oldest entries down to `max_len`, or those below `min_id`
+
+        ### Args:
+            - `max_len (Optional[int])`: number of entries to keep
+            - `min_id (Optional[StreamID])`: entries with a lower ID are evicted
+            - `approximate (bool)`: only drop whole blocks, which may keep a few
+              more entries than asked for
+            - `limit (Optional[int])`: evict at most this many entries, only
+              honoured when `approximate` is set
+
+        ### Returns:
+            - `int`: number of entries evicted
+        """
+        removed: int = 0
+        while self._head < len(self._blocks):
+            block: StreamBlock = self._blocks[self._head]
+            if max_len is not None:
+                excess: int = self.length - max_len
+            else:
+                assert min_id is not None
+                excess = block.bisect(min_id) - block.start
+            if excess <= 0:
+                break
+            if excess >= len(block):
+                if limit is not None and removed + len(block) > limit:
+                    break
+                removed += len(block)
+                self.length -= len(block)
+                self.max_deleted_id = block.last_id()
+                # let go of the entries now, the slot goes on compaction
+                self._blocks[self._head] = _DROPPED_BLOCK
+                self._head += 1
+                continue
+            if approximate:
+                break
+            block.drop_head(excess)
+            removed += excess
+            self.length -= excess
+            self.max_deleted_id = block.id_at(block.start - 1)
+            self._block_first_ids[self._head] = block.first_id()
+            break
+        if self._head and self._head * 2 >= len(self._blocks):
+            del self._blocks[: self._head]
+            del self._block_first_ids[: self._head]
+            self._head = 0
+        return removed
+
+    def memory_usage(self) -> int:
+        """## Approximate bytes held by the stream, consumer groups excluded"""
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self._blocks)
+            + sys.getsizeof(self._block_first_ids)
+            + sum(
+                self._blocks[index].memory_usage()
+                for index in range(self._head, len(self._blocks))
+            )
+        )
+
+
+# placeholder for blocks trimmed off a stream ahead of compaction
+_DROPPED_BLOCK: StreamBlock = StreamBlock((0, 0))
+
+
+class SortedIDSet:
+    """Stream IDs kept sorted in bounded sublists.
+
+    Stands in for the radix trees Redis indexes pending entries with: a
+    lookup bisects the sublists' maxima and then one sublist, and inserts or
+    removals only shift that sublist, so they stay cheap with millions of
+    IDs. IDs delivered in order take the append fast path.
+    """
+
+    LOAD: int = 1000
+
+    def __init__(self) -> None:
+        self._lists: List[List[StreamID]] = []
+        self._maxes: List[StreamID] = []
+        self._len: int = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[StreamID]:
+        for sublist in self._lists:
+            yield from sublist
+
+    def add(self, stream_id: StreamID) -> None:
+        if not self._maxes:
+            self._lists.append([stream_id])
+            self._maxes.append(stream_id)
+            self._len += 1
+            return
+        index: int = bisect.bisect_left(self._maxes, stream_id)
+        if index == len(self._maxes):
+            index -= 1
+            self._lists[index].append(stream_id)
+            self._maxes[index] = stream_id
+        else:
+            sublist: List[StreamID] = self._lists[index]
+            position: int = bisect.bisect_left(sublist, stream_id)
+            if position < len(sublist) and sublist[position] == stream_id:
+                return
+            sublist.insert(position, stream_id)
+        self._len += 1
+        sublist = self._lists[index]
+        if len(sublist) > 2 * self.LOAD:
+            self._lists.insert(index + 1, sublist[self.LOAD :])
+            del sublist[self.LOAD :]
+            self._maxes.insert(index, sublist[-1])
+
+    def discard(self, stream_id: StreamID) -> bool:
+        index: int = bisect.bisect_left(self._maxes, stream_id)
+        if index == len(self._maxes):
+            return False
+        sublist: List[StreamID] = self._lists[index]
+        position: int = bisect.bisect_left(sublist, stream_id)
+        if position == len(sublist) or sublist[position] != stream_id:
+            return False
+        del sublist[position]
+        self._len -= 1
+        if sublist:
+            self._maxes[index] = sublist[-1]
+        else:
+            del self._lists[index]
+            del self._maxes[index]
+        return True
+
+    def first(self) -> Optional[StreamID]:
+        return self._lists[0][0] if self._lists else None
+
+    def last(self) -> Optional[StreamID]:
+        return self._maxes[-1] if self._maxes else None
+
+    def irange(self, start: StreamID, end: StreamID) -> Iterator[StreamID]:
+        """## IDs with `start <= id <= end`, in order"""
+        index: int = bisect.bisect_left(self._maxes, start)
+        if index == len(self._maxes):
+            return
+        position: int = bisect.bisect_left(self._lists[index], start)
+        for list_index in range(index, len(self._lists)):
+            sublist: List[StreamID] = self._lists[list_index]
+            for offset in range(position, len(sublist)):
+                if sublist[offset] > end:
+                    return
+                yield sublist[offset]
+            position = 0
+
+
+class PendingEntry:
+    """An entry delivered to a consumer of a group and not acknowledged yet."""
+
+    __slots__ = ("consumer", "delivery_time_ms", "delivery_count")
+
+    def __init__(
+        self, consumer: "StreamConsumer", delivery_time_ms: int, delivery_count: int
     ) -> None:
+        self.consumer: StreamConsumer = consumer
+        self.delivery_time_ms: int = delivery_time_ms
+        self.delivery_count: int = delivery_count
+
+
+class StreamConsumer:
+    __slots__ = ("name", "seen_time_ms", "pending")
+
+    def __init__(self, name: bytes, seen_time_ms: int) -> None:
+        self.name: bytes = name
+        self.seen_time_ms: int = seen_time_ms
+        self.pending: SortedIDSet = SortedIDSet()
+
+
+class StreamGroup:
+    """A consumer group: its delivery cursor and pending entries list (PEL).
+
+    The PEL is indexed twice, like in Redis: by ID for the whole group and
+    by ID within each consumer, so XACK, XCLAIM and per-consumer reads
+    don't scan unrelated entries.
+    """
+
+    def __init__(self, name: bytes, last_delivered_id: StreamID) -> None:
+        self.name: bytes = name
+        self.last_delivered_id: StreamID = last_delivered_id
+        self.pending: Dict[StreamID, PendingEntry] = {}
+        self.pending_ids: SortedIDSet = SortedIDSet()
+        self.consumers: Dict[bytes, StreamConsumer] = {}
+
+    def consumer(self, name: bytes, now_ms: int) -> StreamConsumer:
+        """## Look up a consumer, creating it on first use, and mark it seen"""
+        consumer: Optional[StreamConsumer] = self.consumers.get(name)
+        if consumer is None:
+            consumer = self.consumers[name] = StreamConsumer(name, now_ms)
+        consumer.seen_time_ms = now_ms
+        return consumer
+
+    def deliver(
+        self,
+        stream_id: StreamID,
+        consumer: StreamConsumer,
+        delivery_time_ms: int,
+        delivery_count: int = 1,
+    ) -> PendingEntry:
+        """## Record `stream_id` as pending for `consumer`, moving it if needed"""
+        pending: Optional[PendingEntry] = self.pending.get(stream_id)
+        if pending is None:
+            pending = PendingEntry(consumer, delivery_time_ms, delivery_count)
+            self.pending[stream_id] = pending
+            self.pending_ids.add(stream_id)
+        else:
+            if pending.consumer is not consumer:
+                pending.consumer.pending.discard(stream_id)
+                pending.consumer = consumer
+            pending.delivery_time_ms = delivery_time_ms
+            pending.delivery_count = delivery_count
+        consumer.pending.add(stream_id)
+        return pending
+
+    def ack(self, stream_id: StreamID) -> bool:
+        pending: Optional[PendingEntry] = self.pending.pop(stream_id, None)
+        if pending is None:
+            return False
+        self.pending_ids.discard(stream_id)
+        pending.consumer.pending.discard(stream_id)
+        return True
+
+    def delete_consumer(self, name: bytes) -> int:
+        """## Drop a consumer along with its pending entries
+
+        ### Returns:
+            - `int`: number of pending entries the consumer had
+        """
+        consumer: Optional[StreamConsumer] = self.consumers.pop(name, None)
+        if consumer is None:
+            return 0
+        for stream_id in consumer.pending:
+            del self.pending[stream_id]
+            self.pending_ids.discard(stream_id)
+        return len(consumer.pending)
+
+
+class RespDatatypes(enum.IntEnum):
+    STRING = 0
+    LIST = 1
+    SET = 2
+    ZSET = 3
+    HASH = 4
+    STREAM = 5
+
+    @property
+    def type_name(self) -> str:
+        return self.name.lower()
+
+
+class Entry:
+    """A keyspace value and its type tag.
+
+    Slotted so a key costs no per-instance `__dict__`; expiries live in
+    `Storage` and are only stored for keys that have one.
+    """
+
+    __slots__ = ("value", "type")
+
+    def __init__(self, value, type: RespDatatypes = RespDatatypes.STRING) -> None:
         self.value = value
-        self.len: int = len
-        self.ttl_ms: float = (time.time() * 1000) + ttl if ttl else 0.0
-        self.infinite_alive: bool = not ttl
-        self.type: str = type
-        # self.stream_id: Optional[str] = stream_id
+        self.type: RespDatatypes = type
 
     def print(self) -> None:
-        print(f"value is {self.value}, len is: {self.len}")
+        print(f"value is {self.value}, type is: {self.type.type_name}")
+
+
+@dataclass
+class PersistenceStats:
+    rdb_last_load_keys_loaded: int = 0
+    rdb_last_load_keys_expired: int = 0
+    rdb_last_load_bytes_read: int = 0
+    rdb_last_load_time_ms: float = 0.0
+    rdb_bgsave_in_progress: int = 0
+    rdb_last_save_time: int = field(default_factory=lambda: int(time.time()))
+    rdb_last_bgsave_status: str = "ok"
+    rdb_last_bgsave_time_sec: int = -1
+
+
+@dataclass
+class KeyspaceStats:
+    expired_keys: int = 0
+    expire_cycle_cpu_milliseconds: float = 0.0
 
 
 class Storage:
+    # the clock is only re-read every this many keys during an expire cycle
+    EXPIRE_CYCLE_CHECK_EVERY: int = 16
+
     def __init__(self, rdb_file: Optional[str] = None) -> None:
-        self._storage: Dict[str, Entry] = {}
+        # keys and string values are the raw bytes sent by clients
+        self._storage: Dict[bytes, Entry] = {}
+        # absolute deadline in unix ms, only for keys that have one
+        self._expiry_ms: Dict[bytes, int] = {}
+        # (deadline_ms, key) for every deadline set; entries that no longer
+        # match the key's current deadline are skipped lazily
+        self._expires_heap: List[Tuple[int, bytes]] = []
         self.rdb_file = rdb_file
+        self.persistence_stats: PersistenceStats = PersistenceStats()
+        self.keyspace_stats: KeyspaceStats = KeyspaceStats()
+        # writes since the last successful snapshot
+        self.dirty: int = 0
+        # cluster mode only: hash slot -> keys in it, so a slot can be
+        # counted or emptied without scanning the whole keyspace
+        self._slot_of: Optional[Callable[[bytes], int]] = None
+        self._slot_keys: Optional[Dict[int, Set[bytes]]] = None
+
+    def flush(self) -> None:
+        """## Drop every key"""
+        self._storage = {}
+        self._expiry_ms = {}
+        self._expires_heap = []
+        if self._slot_keys is not None:
+            self._slot_keys = {}
+
+    def index_slots(self, slot_of: Callable[[bytes], int]) -> None:
+        """## Keep track of the keys in every hash slot from now on
+
+        ### Args:
+            - `slot_of (Callable[[bytes], int])`: hash slot of a key
+        """
+        self._slot_of = slot_of
+        self._rebuild_slot_index()
+
+    def _rebuild_slot_index(self) -> None:
+        if self._slot_of is None:
+            return
+        self._slot_keys = {}
+        for key in self._storage:
+            self._slot_keys.setdefault(self._slot_of(key), set()).add(key)
 
-    def add(self, key: str, entry_dict: Entry) -> None:
+    def swap_keyspace(self, other: "Storage") -> None:
+        """## Take over the keys of `other`, which is left empty
+
+        A snapshot is loaded into a separate `Storage` and only swapped in
+        once it was read whole, so a corrupt one leaves the keyspace as it was.
+        """
+        self._storage, self._expiry_ms, self._expires_heap = (
+            other._storage,
+            other._expiry_ms,
+            other._expires_heap,
+        )
+        other.flush()
+        self._rebuild_slot_index()
+
+    def add(
+        self, key: bytes, entry_dict: Entry, expires_at_ms: Optional[int] = None
+    ) -> None:
+        """## Store `entry_dict` under `key`, replacing any previous expiry"""
+        if self._slot_keys is not None and key not in self._storage:
+            assert self._slot_of
+            self._slot_keys.setdefault(self._slot_of(key), set()).add(key)
         self._storage[key] = entry_dict
+        if expires_at_ms is None:
+            self._expiry_ms.pop(key, None)
+            return
+        expires_at_ms = int(expires_at_ms)
+        self._expiry_ms[key] = expires_at_ms
+        heapq.heappush(self._expires_heap, (expires_at_ms, key))
+        if len(self._expires_heap) > 2 * len(self._expiry_ms) + 1024:
+            self._rebuild_expires()
 
     def get(
         self,
-        key: str,
+        key: bytes,
     ) -> Optional[Entry]:
-        if self.has(key):
-            val = self._storage[key]
-            return val
-        return None
+        val = self._storage.get(key)
+        if val is not None and not self.is_alive(key):
+            self._expire(key)
+            return None
+        return val
+
+    def get_expiry(self, key: bytes) -> Optional[int]:
+        return self._expiry_ms.get(key)
 
-    def has(self, key: str) -> bool:
-        return key in self._storage
+    def has(self, key: bytes) -> bool:
+        return self.get(key) is not None
 
-    def remove(self, key: str):
+    def remove(self, key: bytes):
         del self._storage[key]
+        self._expiry_ms.pop(key, None)
+        if self._slot_keys is not None:
+            assert self._slot_of
+            slot: int = self._slot_of(key)
+            keys: Set[bytes] = self._slot_keys[slot]
+            keys.discard(key)
+            if not keys:
+                del self._slot_keys[slot]
+
+    def keys_in_slot(self, slot: int, count: Optional[int] = None) -> List[bytes]:
+        """## Live keys hashing to `slot`, at most `count` of them
+
+        Only available once `index_slots` was called.
+        """
+        assert self._slot_keys is not None
+        keys: List[bytes] = []
+        if count == 0:
+            return keys
+        now_ms: int = int(time.time() * 1000)
+        for key in self._slot_keys.get(slot, ()):
+            if self.is_alive(key, now_ms):
+                keys.append(key)
+                if len(keys) == count:
+                    break
+        return keys
+
+    def count_keys_in_slot(self, slot: int) -> int:
+        assert self._slot_keys is not None
+        keys: Set[bytes] = self._slot_keys.get(slot, set())
+        if not self._expiry_ms:
+            return len(keys)
+        now_ms: int = int(time.time() * 1000)
+        return sum(1 for key in keys if self.is_alive(key, now_ms))
+
+    def keys(self) -> List[bytes]:
+        if not self._expiry_ms:
+            return list(self._storage)
+        now_ms: int = int(time.time() * 1000)
+        return [key for key in self._storage if self.is_alive(key, now_ms)]
+
+    def items(self) -> dict_items:
+        return self._storage.items()
+
+    def __len__(self) -> int:
+        return len(self._storage)
+
+    def expires_count(self) -> int:
+        return len(self._expiry_ms)
+
+    def is_alive(self, key: bytes, now_ms: Optional[int] = None) -> bool:
+        expires_at_ms: Optional[int] = self._expiry_ms.get(key)
+        if expires_at_ms is None:
+            return True
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        return expires_at_ms > now_ms
+
+    def _expire(self, key: bytes) -> None:
+        self.remove(key)
+        self.keyspace_stats.expired_keys += 1
+
+    def _rebuild_expires(self) -> None:
+        self._expires_heap = [(ms, key) for key, ms in self._expiry_ms.items()]
+        heapq.heapify(self._expires_heap)
+
+    def active_expire_cycle(self, time_limit_ms: float) -> int:
+        """## Reclaim expired keys in deadline order within a time budget
+
+        ### Args:
+            - `time_limit_ms (float)`: upper bound on the time spent in this call
+
+        ### Returns:
+            - `int`: number of keys expired
+        """
+        started: float = time.perf_counter()
+        deadline: float = started + time_limit_ms / 1000
+        now_ms: int = int(time.time() * 1000)
+        expired: int = 0
+        checked: int = 0
+        heap: List[Tuple[int, bytes]] = self._expires_heap
+        while heap and heap[0][0] <= now_ms:
+            expires_at_ms, key = heapq.heappop(heap)
+            if self._expiry_ms.get(key) == expires_at_ms:
+                self._expire(key)
+                expired += 1
+            checked += 1
+            if checked % self.EXPIRE_CYCLE_CHECK_EVERY == 0:
+                if time.perf_counter() >= deadline:
+                    break
+                now_ms = int(time.time() * 1000)
+        self.keyspace_stats.expire_cycle_cpu_milliseconds += (
+            time.perf_counter() - started
+        ) * 1000
+        return expired
 
 
 kvPair: Storage = Storage()
-STREAM_LOCK = asyncio.Lock()
-STREAM_CONDITIONALS = {}
+
+
+class StreamWaiter:
+    """A client blocked in XREAD, waiting for entries after `after_ids`."""
+
+    __slots__ = ("after_ids", "future")
+
+    def __init__(self, after_ids: Dict[bytes, StreamID]) -> None:
+        self.after_ids: Dict[bytes, StreamID] = after_ids
+        # resolved with the first key that received a newer entry
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class StreamWaiters:
+    """Clients blocked on stream keys, in FIFO order per key.
+
+    Blocked clients only hold a future, so they cost nothing while idle;
+    `signal` wakes the ones whose requested ID an XADD just crossed. Each
+    key's waiters are the keys of an insertion-ordered dict, which keeps
+    them in arrival order and still removes one in O(1) when it times out
+    or its client goes away.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: Dict[bytes, Dict[StreamWaiter, None]] = {}
+
+    def add(self, waiter: StreamWaiter) -> None:
+        for key in waiter.after_ids:
+            self._waiters.setdefault(key, {})[waiter] = None
+
+    def remove(self, waiter: StreamWaiter) -> None:
+        for key in waiter.after_ids:
+            queue: Optional[Dict[StreamWaiter, None]] = self._waiters.get(key)
+            if queue is None:
+                continue
+            queue.pop(waiter, None)
+            if not queue:
+                del self._waiters[key]
+
+    def signal(self, key: bytes, last_id: StreamID) -> None:
+        for waiter in self._waiters.get(key, ()):
+            if not waiter.future.done() and last_id > waiter.after_ids[key]:
+                waiter.future.set_result(key)
+
+
+stream_waiters: StreamWaiters = StreamWaiters()
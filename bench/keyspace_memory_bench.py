@@ -0,0 +1,49 @@
+"""Memory a keyspace of small string keys takes, per key.
+
+Keys and values are built first, as the parser hands them over, then
+stored; only what storing them allocates counts as keyspace overhead.
+Run from the repository root: `python -m bench.keyspace_memory_bench`
+"""
+
+import argparse
+import sys
+import tracemalloc
+from typing import List
+
+from app.storage.storage import Entry, Storage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--key-size", type=int, default=16)
+    parser.add_argument("--value-size", type=int, default=32)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    keys: List[bytes] = [
+        (b"%d:" % i).rjust(args.key_size, b"k") for i in range(args.keys)
+    ]
+    values: List[bytes] = [
+        (b"%d" % i).rjust(args.value_size, b"v") for i in range(args.keys)
+    ]
+    payload: int = sys.getsizeof(keys[0]) + sys.getsizeof(values[0])
+
+    storage = Storage()
+    before: int = tracemalloc.get_traced_memory()[0]
+    for key, value in zip(keys, values):
+        storage.add(key, Entry(value), None)
+    overhead: float = (tracemalloc.get_traced_memory()[0] - before) / args.keys
+    tracemalloc.stop()
+
+    print(
+        f"{args.keys:,} keys of {args.key_size} bytes, "
+        f"values of {args.value_size} bytes"
+    )
+    print(f"key and value objects: {payload:6d} bytes/key")
+    print(f"keyspace overhead:     {overhead:6.1f} bytes/key")
+    print(f"total:                 {payload + overhead:6.1f} bytes/key")
+
+
+if __name__ == "__main__":
+    main()
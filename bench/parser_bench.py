@@ -0,0 +1,56 @@
+"""Microbenchmark for the incremental RESP request parser.
+
+Run from the repository root: `python -m bench.parser_bench`
+"""
+
+import argparse
+import time
+from typing import List
+
+from app.processor.resp_coder import RespCoder, RespParser
+
+
+def set_requests(count: int, value_size: int) -> bytes:
+    value: bytes = b"v" * value_size
+    return b"".join(
+        RespCoder.encode([b"SET", b"key:%d" % i, value]) for i in range(count)
+    )
+
+
+def chunked(data: bytes, size: int) -> List[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def run(name: str, chunks: List[bytes], commands: int, rounds: int) -> None:
+    best: float = float("inf")
+    for _ in range(rounds):
+        parser = RespParser()
+        started: float = time.perf_counter()
+        parsed: int = 0
+        for chunk in chunks:
+            parsed += len(parser.feed(chunk))
+        best = min(best, time.perf_counter() - started)
+        assert parsed == commands, f"{name}: parsed {parsed} of {commands}"
+    size: int = sum(map(len, chunks))
+    print(
+        f"{name:<32} {commands / best:>12,.0f} cmd/s " f"{size / best / 1e6:>9.1f} MB/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    small: bytes = set_requests(args.commands, 16)
+    run("small SETs, one buffer", [small], args.commands, args.rounds)
+    run("small SETs, 4 KB reads", chunked(small, 4096), args.commands, args.rounds)
+    run("small SETs, 7 byte reads", chunked(small, 7), args.commands, args.rounds)
+    large_count: int = max(args.commands // 1000, 1)
+    large: bytes = set_requests(large_count, 1024 * 1024)
+    run("1 MB SETs, 64 KB reads", chunked(large, 64 * 1024), large_count, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
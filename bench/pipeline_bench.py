@@ -0,0 +1,57 @@
+"""Throughput of a running server at several pipeline depths.
+
+Start a server first, then run from the repository root:
+`python -m bench.pipeline_bench --port 6379 --depths 1 10 100`
+"""
+
+import argparse
+import asyncio
+import time
+
+from app.processor.resp_coder import RespCoder
+
+
+async def client(
+    host: str, port: int, depth: int, batches: int, client_id: int
+) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    batch: bytes = b"".join(
+        RespCoder.encode([b"SET", b"bench:%d:%d" % (client_id, i), b"value"])
+        for i in range(depth)
+    )
+    # every reply is +OK
+    expected: int = depth * len(b"+OK\r\n")
+    for _ in range(batches):
+        writer.write(batch)
+        await reader.readexactly(expected)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(host: str, port: int, depth: int, requests: int, clients: int) -> float:
+    batches: int = max(requests // (depth * clients), 1)
+    started: float = time.perf_counter()
+    await asyncio.gather(
+        *(client(host, port, depth, batches, i) for i in range(clients))
+    )
+    return batches * depth * clients / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--clients", type=int, default=10)
+    args = parser.parse_args()
+
+    for depth in args.depths:
+        ops: float = asyncio.run(
+            run(args.host, args.port, depth, args.requests, args.clients)
+        )
+        print(f"pipeline depth {depth:>4}: {ops:>10,.0f} SET/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Time writing and loading an RDB dump of many string keys.
+
+Run from the repository root: `python -m bench.rdb_load_bench --keys 1000000`
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.processor import rdb_file_processor
+from app.processor.rdb_file_processor import RDBFileProcessor, RDBFileWriter
+from app.storage.storage import Entry, Storage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--value-size", type=int, default=16)
+    args = parser.parse_args()
+
+    storage = Storage()
+    value: bytes = b"v" * args.value_size
+    for i in range(args.keys):
+        storage.add(b"key:%d" % i, Entry(value), None)
+    crc: str = "crcmod" if rdb_file_processor._crc64_c else "pure Python"
+    print(f"{args.keys:,} keys, CRC64 from {crc}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename: str = os.path.join(directory, "dump.rdb")
+        started: float = time.perf_counter()
+        size: int = RDBFileWriter(storage).save(filename)
+        print(f"save:                {time.perf_counter() - started:8.3f} s")
+        print(f"size:                {size / 1e6:8.1f} MB")
+
+        for verify in (True, False):
+            loaded = Storage()
+            started = time.perf_counter()
+            RDBFileProcessor(filename, verify).load(loaded)
+            elapsed: float = time.perf_counter() - started
+            assert len(loaded) == args.keys
+            print(f"load, checksum {'on ' if verify else 'off'}: {elapsed:8.3f} s")
+
+        with open(filename, "rb") as f:
+            data: bytes = f.read()
+        started = time.perf_counter()
+        rdb_file_processor._crc64_sliced(data)
+        elapsed = time.perf_counter() - started
+        print(
+            f"pure Python CRC64:   {elapsed:8.3f} s ({size / elapsed / 1e6:.1f} MB/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Memory a stream of small telemetry entries takes, per entry.
+
+Every entry has the same three fields, as a sensor feed would. Field
+values are built the way the parser hands them over and only what the
+stream keeps once they are appended is counted.
+Run from the repository root: `python -m bench.stream_memory_bench`
+"""
+
+import argparse
+import tracemalloc
+
+from app.storage.storage import Stream, StreamEntry
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=100_000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    stream = Stream()
+    for i in range(args.entries):
+        stream.append(
+            StreamEntry(
+                (1_700_000_000_000 + i // 4, i % 4),
+                [
+                    b"sensor",
+                    b"sensor-%d" % (i % 100),
+                    b"temperature",
+                    b"%.2f" % (20 + i % 700 / 100),
+                    b"humidity",
+                    b"%d" % (40 + i % 30),
+                ],
+            )
+        )
+    retained: float = (tracemalloc.get_traced_memory()[0] - before) / args.entries
+    tracemalloc.stop()
+
+    print(f"{args.entries:,} entries of 3 fields in {len(stream.blocks())} blocks")
+    print(f"memory: {retained:6.1f} bytes/entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""GET/SET throughput of a `--workers N` server as N grows.
+
+Starts a server for every worker count in turn, then runs client
+processes sending pipelined SET+GET batches over keys spread across all
+workers. Run from the repository root:
+`python -m bench.workers_bench --workers 1 2 4 8`
+"""
+
+import argparse
+import multiprocessing
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+from app.processor.resp_coder import RespCoder
+
+STARTUP_TIMEOUT_S: float = 10.0
+
+
+def client(port: int, depth: int, batches: int, client_id: int) -> None:
+    sock: socket.socket = socket.create_connection(("localhost", port))
+    batch: bytes = b"".join(
+        RespCoder.encode([b"SET", b"bench:%d:%d" % (client_id, i), b"value"])
+        + RespCoder.encode([b"GET", b"bench:%d:%d" % (client_id, i)])
+        for i in range(depth)
+    )
+    # every SET replies +OK and every GET $5 value
+    expected: int = depth * len(b"+OK\r\n$5\r\nvalue\r\n")
+    for _ in range(batches):
+        sock.sendall(batch)
+        received: int = 0
+        while received < expected:
+            chunk: bytes = sock.recv(expected - received)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            received += len(chunk)
+    sock.close()
+
+
+def wait_for_port(port: int) -> None:
+    deadline: float = time.monotonic() + STARTUP_TIMEOUT_S
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run(port: int, workers: int, depth: int, requests: int, clients: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        server: subprocess.Popen = subprocess.Popen(
+            [sys.executable, "-m", "app.main", "--port", str(port)]
+            + ["--dir", directory, "--save", "", "--workers", str(workers)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port)
+            # every worker has to be listening, not just the first one up
+            time.sleep(0.5)
+            batches: int = max(requests // (2 * depth * clients), 1)
+            processes: List[multiprocessing.Process] = [
+                multiprocessing.Process(target=client, args=(port, depth, batches, i))
+                for i in range(clients)
+            ]
+            started: float = time.perf_counter()
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            elapsed: float = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+    return 2 * batches * depth * clients / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=6399)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--depth", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{multiprocessing.cpu_count()} CPUs, {args.clients} clients")
+    for workers in args.workers:
+        ops: float = run(args.port, workers, args.depth, args.requests, args.clients)
+        print(f"workers {workers:>2}: {ops:>10,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
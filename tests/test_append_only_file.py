@@ -0,0 +1,74 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+from app.handler.server_conf import AppendFsync
+from app.processor.append_only_file import AppendOnlyFile
+from app.processor.resp_coder import RespCoder
+from app.storage.storage import Storage
+
+
+class AppendOnlyFileTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename: str = os.path.join(self.directory.name, "appendonly.aof")
+        self.aof = AppendOnlyFile(Storage())
+
+    def tearDown(self) -> None:
+        if self.aof.fd is not None:
+            os.close(self.aof.fd)
+        self.directory.cleanup()
+
+    def configure(self, enabled: bool, policy: AppendFsync) -> None:
+        self.aof.configure(enabled, self.filename, policy, True)
+
+    def file_contents(self) -> bytes:
+        with open(self.filename, "rb") as f:
+            return f.read()
+
+    async def test_always_commit_only_waits_for_own_writes(self) -> None:
+        self.configure(True, AppendFsync.ALWAYS)
+        self.aof.open()
+        release = threading.Event()
+        write_and_sync = self.aof._write_and_sync
+
+        def slow_write_and_sync(data: bytes) -> None:
+            release.wait()
+            write_and_sync(data)
+
+        self.aof._write_and_sync = slow_write_and_sync  # type: ignore[method-assign]
+        request: bytes = RespCoder.encode([b"SET", b"k", b"v"])
+        self.aof.feed(request)
+        writer = asyncio.create_task(self.aof.commit(self.aof.fed_offset))
+        await asyncio.sleep(0.01)
+        self.assertFalse(writer.done())
+        # a connection that wrote nothing doesn't wait on the fsync
+        await asyncio.wait_for(self.aof.commit(0), 0.1)
+        release.set()
+        await writer
+        self.assertEqual(self.file_contents(), request)
+
+    async def test_always_commit_spans_groups(self) -> None:
+        self.configure(True, AppendFsync.ALWAYS)
+        self.aof.open()
+        first: bytes = RespCoder.encode([b"SET", b"a", b"1"])
+        second: bytes = RespCoder.encode([b"SET", b"b", b"2"])
+        self.aof.feed(first)
+        writer = asyncio.create_task(self.aof.commit(self.aof.fed_offset))
+        await asyncio.sleep(0)
+        # fed while the first group is on its way to disk
+        self.aof.feed(second)
+        await self.aof.commit(self.aof.fed_offset)
+        await writer
+        self.assertEqual(self.file_contents(), first + second)
+
+    async def test_rewrite_refused_while_disabled(self) -> None:
+        self.configure(False, AppendFsync.EVERYSEC)
+        self.assertFalse(self.aof.bgrewrite())
+        self.assertFalse(os.path.exists(self.filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import time
+import unittest
+
+from app.processor.cluster import ClusterNode, ClusterState, key_hash_slot
+from app.storage.storage import Entry, Storage
+
+
+class SlotIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.storage = Storage()
+        self.storage.add(b"{a}1", Entry(b"v"), None)
+        self.storage.index_slots(key_hash_slot)
+        self.slot: int = key_hash_slot(b"a")
+
+    def test_tracks_adds_and_removes(self) -> None:
+        self.storage.add(b"{a}2", Entry(b"v"), None)
+        # overwriting a key doesn't count it twice
+        self.storage.add(b"{a}2", Entry(b"w"), None)
+        self.storage.add(b"{b}1", Entry(b"v"), None)
+        self.assertEqual(self.storage.count_keys_in_slot(self.slot), 2)
+        self.assertEqual(
+            sorted(self.storage.keys_in_slot(self.slot)), [b"{a}1", b"{a}2"]
+        )
+        self.assertEqual(len(self.storage.keys_in_slot(self.slot, 1)), 1)
+        self.storage.remove(b"{a}1")
+        self.assertEqual(self.storage.keys_in_slot(self.slot), [b"{a}2"])
+        self.storage.flush()
+        self.assertEqual(self.storage.count_keys_in_slot(self.slot), 0)
+
+    def test_expired_keys_are_left_out(self) -> None:
+        past_ms: int = int(time.time() * 1000) - 1
+        self.storage.add(b"{a}2", Entry(b"v"), past_ms)
+        self.assertEqual(self.storage.count_keys_in_slot(self.slot), 1)
+        self.storage.active_expire_cycle(10)
+        self.assertEqual(self.storage.keys_in_slot(self.slot), [b"{a}1"])
+
+    def test_swapped_in_keyspace_is_indexed(self) -> None:
+        loaded = Storage()
+        loaded.add(b"{a}3", Entry(b"v"), None)
+        self.storage.swap_keyspace(loaded)
+        self.assertEqual(self.storage.keys_in_slot(self.slot), [b"{a}3"])
+
+
+class ClusterConfigTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = ClusterState()
+        self.state.enabled = True
+        self.state.config_file = os.path.join(self.directory.name, "nodes.conf")
+        self.state.myself = ClusterNode("a" * 40, "127.0.0.1", 7000)
+        self.state.nodes[self.state.myself.id] = self.state.myself
+        # keep cron from gossiping
+        self.state._last_gossip = time.monotonic()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_changes_are_written_by_cron(self) -> None:
+        for slot in range(100):
+            self.assertIsNone(self.state.add_slots([slot]))
+        self.assertFalse(os.path.exists(self.state.config_file))
+        self.state.cron()
+        with open(self.state.config_file) as f:
+            self.assertIn("myself,master", f.read())
+        self.assertEqual(os.listdir(self.directory.name), ["nodes.conf"])
+        loaded = ClusterState()
+        loaded.load(self.state.config_file)
+        self.assertEqual(len(loaded.owned_slots(loaded.nodes["a" * 40])), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
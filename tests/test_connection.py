@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+from typing import Any, List, Optional
+
+from app.handler.connection import READ_BUFFER_LIMIT, Connection
+from app.processor.resp_coder import RespCoder
+
+
+class FakeTransport:
+    """Just enough of a transport to drive a `Connection` by hand."""
+
+    def __init__(self) -> None:
+        self.written = bytearray()
+        self.paused: bool = False
+        self.closing: bool = False
+
+    def write(self, data: bytes) -> None:
+        self.written += data
+
+    def pause_reading(self) -> None:
+        self.paused = True
+
+    def resume_reading(self) -> None:
+        self.paused = False
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def close(self) -> None:
+        self.closing = True
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return default
+
+    def set_write_buffer_limits(self, high: Optional[int] = None) -> None:
+        pass
+
+
+class EchoDispatcher:
+    """Answers each request with its first argument, suspending after a batch
+    on `gate` the way a flush waiting on an fsync or a drain does."""
+
+    def __init__(self) -> None:
+        self.gate: Optional[asyncio.Future] = None
+
+    async def __call__(self, conn: Connection) -> None:
+        while conn.pending:
+            request, _ = conn.next_request()
+            conn.write(b"+%s\r\n" % request[0])
+        if self.gate is not None:
+            await self.gate
+
+
+class ConnectionDispatchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.dispatcher = EchoDispatcher()
+        self.transport = FakeTransport()
+        self.conn = Connection(self.dispatcher)
+        self.conn.connection_made(self.transport)  # type: ignore[arg-type]
+
+    async def settle(self) -> None:
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def test_requests_queued_during_suspension_are_served(self) -> None:
+        self.dispatcher.gate = asyncio.get_running_loop().create_future()
+        self.conn.data_received(RespCoder.encode([b"SET", b"k", b"v"]))
+        await self.settle()
+        self.assertEqual(bytes(self.transport.written), b"+SET\r\n")
+        # arrives while the dispatcher waits past its last look at pending
+        self.conn.data_received(RespCoder.encode([b"PING"]))
+        await self.settle()
+        self.dispatcher.gate.set_result(None)
+        self.dispatcher.gate = None
+        await self.settle()
+        self.assertEqual(bytes(self.transport.written), b"+SET\r\n+PING\r\n")
+        self.assertFalse(self.conn.pending)
+
+    async def test_reading_pauses_behind_a_suspended_dispatcher(self) -> None:
+        self.dispatcher.gate = asyncio.get_running_loop().create_future()
+        self.conn.data_received(RespCoder.encode([b"BLOCKED"]))
+        await self.settle()
+        request: bytes = RespCoder.encode([b"PING", b"x" * 1024])
+        count: int = READ_BUFFER_LIMIT // len(request) + 2
+        for _ in range(count):
+            self.conn.data_received(request)
+        self.assertTrue(self.transport.paused)
+        self.assertEqual(len(self.conn.pending), count)
+        self.dispatcher.gate.set_result(None)
+        self.dispatcher.gate = None
+        await self.settle()
+        self.assertFalse(self.transport.paused)
+        self.assertFalse(self.conn.pending)
+        self.assertEqual(self.transport.written.count(b"+PING\r\n"), count)
+
+    async def test_protocol_error_after_served_requests(self) -> None:
+        self.conn.data_received(RespCoder.encode([b"PING"]) + b"*1\r\n$-5\r\n")
+        await self.settle()
+        written: List[bytes] = bytes(self.transport.written).split(b"\r\n")
+        self.assertEqual(written[0], b"+PING")
+        self.assertTrue(written[1].startswith(b"-ERR Protocol error"))
+        self.assertTrue(self.transport.closing)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from app.processor.rdb_file_processor import RDBError, RDBFileWriter, load_rdb
+from app.storage.storage import Entry, RespDatatypes, Storage, Stream, StreamEntry
+
+
+def build_storage() -> Storage:
+    storage = Storage()
+    for i in range(100):
+        storage.add(b"key:%d" % i, Entry(b"value:%d" % i), None)
+    return storage
+
+
+class RDBLoadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dump: bytes = RDBFileWriter(build_storage()).dumps()
+        self.storage = Storage()
+        self.storage.add(b"existing", Entry(b"kept"), None)
+
+    def assert_untouched(self) -> None:
+        self.assertEqual(self.storage.keys(), [b"existing"])
+
+    def test_load_replaces_the_keyspace(self) -> None:
+        stats = load_rdb(self.dump, self.storage)
+        self.assertEqual(stats.rdb_last_load_keys_loaded, 100)
+        self.assertEqual(len(self.storage), 100)
+        self.assertIsNone(self.storage.get(b"existing"))
+
+    def test_bad_checksum_leaves_keyspace_untouched(self) -> None:
+        corrupt = bytearray(self.dump)
+        corrupt[-1] ^= 0xFF
+        with self.assertRaises(RDBError):
+            load_rdb(bytes(corrupt), self.storage)
+        self.assert_untouched()
+
+    def test_truncated_dump_leaves_keyspace_untouched(self) -> None:
+        truncated: bytes = self.dump[: len(self.dump) // 2]
+        with self.assertRaises(RDBError):
+            load_rdb(truncated, self.storage, verify_checksum=False)
+        self.assert_untouched()
+
+
+class StreamMetadataTest(unittest.TestCase):
+    def test_trimmed_stream_keeps_its_counters(self) -> None:
+        stream = Stream()
+        for seq in range(1, 11):
+            stream.append(StreamEntry((1, seq), [b"f", b"%d" % seq]))
+        stream.trim(min_id=(1, 6))
+        storage = Storage()
+        storage.add(b"s", Entry(stream, RespDatatypes.STREAM), None)
+        loaded = Storage()
+        load_rdb(RDBFileWriter(storage).dumps(), loaded)
+        entry = loaded.get(b"s")
+        assert entry is not None
+        self.assertEqual(len(entry.value), 5)
+        self.assertEqual(entry.value.entries_added, 10)
+        self.assertEqual(entry.value.max_deleted_id, (1, 5))
+        self.assertEqual(entry.value.last_id, (1, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
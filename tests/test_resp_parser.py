@@ -0,0 +1,51 @@
+import unittest
+
+from app.processor.resp_coder import RespParser, RespProtocolError
+
+
+class RespParserTest(unittest.TestCase):
+    def assert_protocol_error(self, data: bytes, message: str) -> None:
+        with self.assertRaises(RespProtocolError) as raised:
+            RespParser().feed(data)
+        self.assertEqual(str(raised.exception), f"Protocol error: {message}")
+
+    def test_frames_split_across_reads(self) -> None:
+        parser = RespParser()
+        self.assertEqual(parser.feed(b"*2\r\n$3\r\nGET\r\n$1\r"), [])
+        self.assertEqual(
+            parser.feed(b"\nk\r\nPING\r\n"),
+            [([b"GET", b"k"], 20), ([b"PING"], 6)],
+        )
+
+    def test_bulk_length_is_capped(self) -> None:
+        self.assertEqual(
+            RespParser().feed(b"*1\r\n$536870912\r\n"), [], "512MB still fits"
+        )
+        self.assert_protocol_error(b"*1\r\n$536870913\r\n", "invalid bulk length")
+        self.assert_protocol_error(b"*1\r\n$-1\r\n", "invalid bulk length")
+
+    def test_multibulk_length_is_capped(self) -> None:
+        self.assert_protocol_error(b"*2147483648\r\n", "invalid multibulk length")
+        self.assert_protocol_error(
+            b"*99999999999999999999999\r\n", "invalid multibulk length"
+        )
+
+    def test_lengths_are_plain_digits(self) -> None:
+        for length in (b"+3", b" 3", b"3 ", b"0_3", b"", b"-", b"\xd9\xa3"):
+            self.assert_protocol_error(
+                b"*1\r\n$%s\r\nGET\r\n" % length, "invalid bulk length"
+            )
+            self.assert_protocol_error(
+                b"*%s\r\n$3\r\nGET\r\n" % length, "invalid multibulk length"
+            )
+        # a null or empty multibulk is skipped
+        self.assertEqual(RespParser().feed(b"*-1\r\n*0\r\nPING\r\n"), [([b"PING"], 6)])
+
+    def test_error_keeps_the_frames_before_it(self) -> None:
+        with self.assertRaises(RespProtocolError) as raised:
+            RespParser().feed(b"PING\r\n*1\r\n$x\r\n")
+        self.assertEqual(raised.exception.commands, [([b"PING"], 6)])
+
+
+if __name__ == "__main__":
+    unittest.main()
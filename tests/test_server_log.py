@@ -0,0 +1,36 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from app.handler import server_log
+from app.handler.server_log import setup_logging
+
+
+class ForkedChildLoggingTest(unittest.TestCase):
+    def test_child_writes_its_own_records(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            logfile: str = os.path.join(directory, "redis.log")
+            listener = setup_logging("notice", logfile)
+            try:
+                logging.info("from the parent")
+                pid: int = os.fork()
+                if pid == 0:
+                    # no listener thread runs here to drain the queue
+                    logging.error("from the child")
+                    os._exit(0)
+                _, status = os.waitpid(pid, 0)
+                self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+            finally:
+                listener.stop()
+                logging.getLogger().handlers.clear()
+                server_log._logfile = None
+            with open(logfile) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(any(line.endswith("ERROR from the child") for line in lines))
+        self.assertTrue(any(line.endswith("INFO from the parent") for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import asyncio
+import unittest
+from typing import Any, List, Tuple
+from unittest import mock
+
+from app.handler.server_conf import ServerInfo, get_server_info
+from app.processor.command import CommandProcessor
+from app.storage.storage import kvPair
+
+INTEGER_ERROR: bytes = b"-ERR value is not an integer or out of range\r\n"
+INVALID_ID_ERROR: bytes = (
+    b"-ERR Invalid stream ID specified as stream command argument\r\n"
+)
+
+
+def decode(reply: bytes) -> Any:
+    """## Decode a RESP reply into Python values, errors as bytes"""
+    value, end = _decode(reply, 0)
+    assert end == len(reply), "trailing data after the reply"
+    return value
+
+
+def _decode(reply: bytes, pos: int) -> Tuple[Any, int]:
+    line_end: int = reply.index(b"\r\n", pos)
+    kind, line = reply[pos : pos + 1], reply[pos + 1 : line_end]
+    pos = line_end + 2
+    if kind in (b"+", b"-"):
+        return kind + line if kind == b"-" else line, pos
+    if kind == b":":
+        return int(line), pos
+    length: int = int(line)
+    if length < 0:
+        return None, pos
+    if kind == b"$":
+        return reply[pos : pos + length], pos + length + 2
+    items: List[Any] = []
+    for _ in range(length):
+        item, pos = _decode(reply, pos)
+        items.append(item)
+    return items, pos
+
+
+class ConsumerGroupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        with mock.patch("sys.argv", ["redis"]):
+            self.config: ServerInfo = get_server_info()
+        kvPair.flush()
+        for seq in range(1, 6):
+            self.call(b"XADD", b"s", b"1-%d" % seq, b"f", b"%d" % seq)
+        self.call(b"XGROUP", b"CREATE", b"s", b"g", b"0")
+
+    def tearDown(self) -> None:
+        kvPair.flush()
+
+    def command(self, *args: bytes) -> CommandProcessor:
+        command = CommandProcessor.get_command(list(args), self.config)
+        assert command is not None
+        return command
+
+    def call(self, *args: bytes) -> bytes:
+        response, _ = asyncio.run(self.command(*args).call())
+        return response
+
+    def read_group(self, consumer: bytes, count: int = 5) -> Any:
+        return decode(
+            self.call(
+                b"XREADGROUP",
+                b"GROUP",
+                b"g",
+                consumer,
+                b"COUNT",
+                b"%d" % count,
+                b"STREAMS",
+                b"s",
+                b">",
+            )
+        )
+
+    def pending(self, *args: bytes) -> Any:
+        return decode(self.call(b"XPENDING", b"s", b"g", *args))
+
+    def test_delivery_fills_the_pel(self) -> None:
+        reply = self.read_group(b"alice", 3)
+        self.assertEqual([entry[0] for entry in reply[0][1]], [b"1-1", b"1-2", b"1-3"])
+        self.assertEqual(self.pending(), [3, b"1-1", b"1-3", [[b"alice", b"3"]]])
+        extended = self.pending(b"-", b"+", b"10", b"alice")
+        self.assertEqual([entry[0] for entry in extended], [b"1-1", b"1-2", b"1-3"])
+        self.assertEqual({entry[3] for entry in extended}, {1})
+        self.assertEqual(decode(self.call(b"XACK", b"s", b"g", b"1-1", b"1-9")), 1)
+        self.assertEqual(self.pending()[0], 2)
+
+    def test_history_read_counts_a_delivery(self) -> None:
+        self.read_group(b"alice", 2)
+        self.call(b"XREADGROUP", b"GROUP", b"g", b"alice", b"STREAMS", b"s", b"0")
+        self.assertEqual(
+            [entry[3] for entry in self.pending(b"-", b"+", b"10")], [2, 2]
+        )
+
+    def test_xpending_argument_errors(self) -> None:
+        self.read_group(b"alice")
+        self.assertEqual(
+            self.call(b"XPENDING", b"s", b"g", b"-", b"+", b"x"), INTEGER_ERROR
+        )
+        self.assertEqual(
+            self.call(b"XPENDING", b"s", b"g", b"IDLE", b"x", b"-", b"+", b"10"),
+            INTEGER_ERROR,
+        )
+        self.assertEqual(
+            self.call(b"XPENDING", b"s", b"g", b"bad", b"+", b"10"), INVALID_ID_ERROR
+        )
+        self.assertEqual(
+            self.call(b"XPENDING", b"s", b"g", b"-", b"+"),
+            b"-ERR syntax error\r\n",
+        )
+
+    def test_xclaim_moves_entries(self) -> None:
+        self.read_group(b"alice", 2)
+        reply = decode(self.call(b"XCLAIM", b"s", b"g", b"bob", b"0", b"1-1", b"1-2"))
+        self.assertEqual([entry[0] for entry in reply], [b"1-1", b"1-2"])
+        extended = self.pending(b"-", b"+", b"10")
+        self.assertEqual({entry[1] for entry in extended}, {b"bob"})
+        self.assertEqual({entry[3] for entry in extended}, {2})
+        # JUSTID leaves the delivery count alone
+        self.assertEqual(
+            decode(self.call(b"XCLAIM", b"s", b"g", b"carol", b"0", b"1-1", b"JUSTID")),
+            [b"1-1"],
+        )
+        self.assertEqual(self.pending(b"-", b"1-1", b"1")[0][3], 2)
+
+    def test_xclaim_skips_recently_delivered(self) -> None:
+        self.read_group(b"alice", 1)
+        reply = decode(self.call(b"XCLAIM", b"s", b"g", b"bob", b"3600000", b"1-1"))
+        self.assertEqual(reply, [])
+        self.assertEqual(self.pending(b"-", b"+", b"10")[0][1], b"alice")
+
+    def test_xclaim_force_and_deleted_entries(self) -> None:
+        reply = decode(
+            self.call(b"XCLAIM", b"s", b"g", b"bob", b"0", b"1-4", b"FORCE", b"JUSTID")
+        )
+        self.assertEqual(reply, [b"1-4"])
+        self.read_group(b"alice", 1)
+        self.call(b"XTRIM", b"s", b"MINID", b"1-2")
+        self.assertEqual(
+            decode(self.call(b"XCLAIM", b"s", b"g", b"bob", b"0", b"1-1")), []
+        )
+        self.assertEqual(
+            [entry[0] for entry in self.pending(b"-", b"+", b"10")], [b"1-4"]
+        )
+
+    def test_xclaim_propagates_consumer_and_delivery(self) -> None:
+        self.read_group(b"alice", 1)
+        command = self.command(b"XCLAIM", b"s", b"g", b"bob", b"0", b"1-1")
+        asyncio.run(command.call())
+        requests: List[List[bytes]] = command.aof_requests()
+        self.assertEqual(
+            requests[0], [b"XGROUP", b"CREATECONSUMER", b"s", b"g", b"bob"]
+        )
+        self.assertEqual(requests[1][:6], [b"XCLAIM", b"s", b"g", b"bob", b"0", b"1-1"])
+        self.assertIn(b"RETRYCOUNT", requests[1])
+
+    def test_xautoclaim_pages_through_the_pel(self) -> None:
+        self.read_group(b"alice", 5)
+        reply = decode(
+            self.call(b"XAUTOCLAIM", b"s", b"g", b"bob", b"0", b"-", b"COUNT", b"2")
+        )
+        self.assertEqual(reply[0], b"1-3")
+        self.assertEqual([entry[0] for entry in reply[1]], [b"1-1", b"1-2"])
+        reply = decode(
+            self.call(
+                b"XAUTOCLAIM",
+                b"s",
+                b"g",
+                b"bob",
+                b"0",
+                reply[0],
+                b"COUNT",
+                b"5",
+                b"JUSTID",
+            )
+        )
+        self.assertEqual(reply, [b"0-0", [b"1-3", b"1-4", b"1-5"], []])
+        self.assertEqual(self.pending()[3], [[b"bob", b"5"]])
+
+    def test_xautoclaim_reports_deleted_entries(self) -> None:
+        self.read_group(b"alice", 5)
+        self.call(b"XTRIM", b"s", b"MINID", b"1-3")
+        reply = decode(self.call(b"XAUTOCLAIM", b"s", b"g", b"bob", b"0", b"-"))
+        self.assertEqual([entry[0] for entry in reply[1]], [b"1-3", b"1-4", b"1-5"])
+        self.assertEqual(reply[2], [b"1-1", b"1-2"])
+        self.assertEqual(self.pending()[0], 3)
+
+    def test_xautoclaim_count_errors(self) -> None:
+        self.assertEqual(
+            self.call(b"XAUTOCLAIM", b"s", b"g", b"bob", b"0", b"-", b"COUNT", b"0"),
+            b"-ERR COUNT must be > 0\r\n",
+        )
+        self.assertEqual(
+            self.call(b"XAUTOCLAIM", b"s", b"g", b"bob", b"0", b"-", b"COUNT", b"x"),
+            INTEGER_ERROR,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
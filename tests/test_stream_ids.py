@@ -0,0 +1,123 @@
+import asyncio
+import unittest
+from typing import List
+from unittest import mock
+
+from app.handler.server_conf import ServerInfo, get_server_info
+from app.processor.command import CommandProcessor
+from app.processor.rdb_file_processor import RDBFileWriter, load_rdb
+from app.storage.storage import (
+    STREAM_ID_MAX,
+    Entry,
+    RespDatatypes,
+    Storage,
+    Stream,
+    StreamEntry,
+    StreamID,
+    kvPair,
+)
+
+# IDs around the signed and unsigned 64-bit limits
+EDGE_IDS: List[List[StreamID]] = [
+    [(5, STREAM_ID_MAX), (6, 0)],
+    [(1, 1), ((1 << 63) + 2, 0)],
+    [(0, 1), ((1 << 63) - 1, 1 << 63), (STREAM_ID_MAX, STREAM_ID_MAX)],
+    [(1, (1 << 63) + 5), (2, 0), (3, (1 << 63) + 5), (STREAM_ID_MAX, 0)],
+]
+
+
+def build_stream(ids: List[StreamID]) -> Stream:
+    stream = Stream()
+    for stream_id in ids:
+        stream.append(StreamEntry(stream_id, [b"f", b"%d-%d" % stream_id]))
+    return stream
+
+
+class StreamIDLimitsTest(unittest.TestCase):
+    def test_append_far_apart_ids(self) -> None:
+        for ids in EDGE_IDS:
+            stream: Stream = build_stream(ids)
+            self.assertEqual([entry.id for entry in stream], ids)
+            self.assertEqual(
+                [entry.id for entry in stream.range((0, 0), (STREAM_ID_MAX,) * 2)],
+                ids,
+            )
+            for stream_id in ids:
+                entry = stream.get(stream_id)
+                assert entry is not None
+                self.assertEqual(entry.fields, [b"f", b"%d-%d" % stream_id])
+
+    def test_rdb_round_trip(self) -> None:
+        storage = Storage()
+        for number, ids in enumerate(EDGE_IDS):
+            storage.add(
+                b"s%d" % number, Entry(build_stream(ids), RespDatatypes.STREAM), None
+            )
+        loaded = Storage()
+        load_rdb(RDBFileWriter(storage).dumps(), loaded)
+        for number, ids in enumerate(EDGE_IDS):
+            entry = loaded.get(b"s%d" % number)
+            assert entry is not None
+            self.assertEqual([stream_entry.id for stream_entry in entry.value], ids)
+
+    def test_rdb_round_trip_after_trim(self) -> None:
+        # the first live entry, which a dump node is based on, is now far
+        # from the later ones although the block's master ID was not
+        ids: List[StreamID] = [(0, 1 << 63), (1, STREAM_ID_MAX), (2, 0)]
+        stream: Stream = build_stream(ids)
+        self.assertEqual(len(stream.blocks()), 1)
+        stream.trim(min_id=(1, 0))
+        storage = Storage()
+        storage.add(b"s", Entry(stream, RespDatatypes.STREAM), None)
+        loaded = Storage()
+        load_rdb(RDBFileWriter(storage).dumps(), loaded)
+        entry = loaded.get(b"s")
+        assert entry is not None
+        self.assertEqual([stream_entry.id for stream_entry in entry.value], ids[1:])
+
+
+class XAddIDLimitsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        with mock.patch("sys.argv", ["redis"]):
+            self.config: ServerInfo = get_server_info()
+        kvPair.flush()
+
+    def tearDown(self) -> None:
+        kvPair.flush()
+
+    def run_command(self, *args: bytes) -> bytes:
+        command = CommandProcessor.get_command(list(args), self.config)
+        assert command is not None
+        response, _ = asyncio.run(command.call())
+        return response
+
+    def test_xadd_then_xrange(self) -> None:
+        for ids in EDGE_IDS:
+            for stream_id in ids:
+                formatted: bytes = b"%d-%d" % stream_id
+                reply: bytes = self.run_command(b"XADD", b"s", formatted, b"f", b"v")
+                self.assertIn(formatted, reply)
+            reply = self.run_command(b"XRANGE", b"s", b"-", b"+")
+            self.assertTrue(reply.startswith(b"*%d\r\n" % len(ids)))
+            self.run_command(b"DEL", b"s")
+
+    def test_auto_sequence_past_the_last_one(self) -> None:
+        # far ahead of the clock, so `*` builds on the last ID
+        ms: int = 1 << 62
+        self.run_command(b"XADD", b"s", b"%d-%d" % (ms, STREAM_ID_MAX), b"f", b"v")
+        reply: bytes = self.run_command(b"XADD", b"s", b"%d-*" % ms, b"f", b"v")
+        self.assertTrue(reply.startswith(b"-ERR The ID specified in XADD is equal"))
+        reply = self.run_command(b"XADD", b"s", b"*", b"f", b"v")
+        self.assertEqual(reply, b"+%d-0\r\n" % (ms + 1))
+
+    def test_auto_id_when_the_stream_is_exhausted(self) -> None:
+        last: bytes = b"%d-%d" % (STREAM_ID_MAX, STREAM_ID_MAX)
+        self.run_command(b"XADD", b"s", last, b"f", b"v")
+        reply: bytes = self.run_command(b"XADD", b"s", b"*", b"f", b"v")
+        self.assertTrue(reply.startswith(b"-ERR The stream has exhausted"))
+        reply = self.run_command(b"XADD", b"s", b"%d-*" % STREAM_ID_MAX, b"f", b"v")
+        self.assertTrue(reply.startswith(b"-ERR The ID specified in XADD is equal"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from app.handler.server_conf import ServerInfo, get_server_info
+from app.processor.command import CommandProcessor
+from app.processor.resp_coder import RespCoder
+from app.storage.storage import StreamWaiter, StreamWaiters, kvPair, stream_waiters
+
+
+class StreamWaitersTest(unittest.IsolatedAsyncioTestCase):
+    async def test_signal_wakes_in_arrival_order(self) -> None:
+        waiters = StreamWaiters()
+        woken: List[int] = []
+        registered: List[StreamWaiter] = []
+        for number in range(5):
+            waiter = StreamWaiter({b"s": (1, 0)})
+            waiter.future.add_done_callback(
+                lambda _, number=number: woken.append(number)
+            )
+            waiters.add(waiter)
+            registered.append(waiter)
+        waiters.remove(registered[2])
+        waiters.signal(b"s", (2, 0))
+        await asyncio.sleep(0)
+        self.assertEqual(woken, [0, 1, 3, 4])
+        self.assertFalse(registered[2].future.done())
+
+    async def test_signal_only_wakes_crossed_ids(self) -> None:
+        waiters = StreamWaiters()
+        behind = StreamWaiter({b"s": (1, 0)})
+        ahead = StreamWaiter({b"s": (5, 0)})
+        waiters.add(behind)
+        waiters.add(ahead)
+        waiters.signal(b"s", (3, 0))
+        self.assertEqual(behind.future.result(), b"s")
+        self.assertFalse(ahead.future.done())
+
+    async def test_remove_drops_every_key(self) -> None:
+        waiters = StreamWaiters()
+        waiter = StreamWaiter({b"a": (0, 0), b"b": (0, 0)})
+        waiters.add(waiter)
+        waiters.remove(waiter)
+        # removing twice, as a timeout racing a disconnect would, is harmless
+        waiters.remove(waiter)
+        self.assertEqual(waiters._waiters, {})
+
+
+class BlockingXReadTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        with mock.patch("sys.argv", ["redis"]):
+            self.config: ServerInfo = get_server_info()
+        kvPair.flush()
+
+    def tearDown(self) -> None:
+        kvPair.flush()
+        stream_waiters._waiters.clear()
+
+    async def run_command(self, *args: bytes) -> bytes:
+        command = CommandProcessor.get_command(list(args), self.config)
+        assert command is not None
+        response, _ = await command.call()
+        return response
+
+    async def test_blocked_readers_are_served_in_order(self) -> None:
+        await self.run_command(b"XADD", b"s", b"1-1", b"f", b"v")
+        finished: List[int] = []
+
+        async def read(number: int) -> bytes:
+            reply: bytes = await self.run_command(
+                b"XREAD", b"BLOCK", b"0", b"STREAMS", b"s", b"$"
+            )
+            finished.append(number)
+            return reply
+
+        readers = [asyncio.create_task(read(number)) for number in range(3)]
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(stream_waiters._waiters[b"s"]), 3)
+        await self.run_command(b"XADD", b"s", b"2-1", b"f", b"w")
+        replies: List[bytes] = await asyncio.gather(*readers)
+        self.assertEqual(finished, [0, 1, 2])
+        for reply in replies:
+            self.assertIn(b"2-1", reply)
+            self.assertNotIn(b"1-1", reply)
+        self.assertNotIn(b"s", stream_waiters._waiters)
+
+    async def test_timeout_replies_null_and_unregisters(self) -> None:
+        started: float = time.monotonic()
+        reply: bytes = await self.run_command(
+            b"XREAD", b"BLOCK", b"50", b"STREAMS", b"s", b"$"
+        )
+        elapsed: float = time.monotonic() - started
+        self.assertEqual(reply, RespCoder.NULL_BULK_STRING_BYTES)
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertLess(elapsed, 1.0)
+        self.assertNotIn(b"s", stream_waiters._waiters)
+
+    async def test_disconnect_unregisters(self) -> None:
+        readers = [
+            asyncio.create_task(
+                self.run_command(
+                    b"XREAD", b"BLOCK", b"0", b"STREAMS", b"s", b"t", b"$", b"$"
+                )
+            )
+            for _ in range(100)
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(stream_waiters._waiters[b"t"]), 100)
+        # a client going away cancels its command
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        self.assertEqual(stream_waiters._waiters, {})
+        reply: bytes = await self.run_command(b"XADD", b"s", b"1-1", b"f", b"v")
+        self.assertIn(b"1-1", reply)
+
+
+if __name__ == "__main__":
+    unittest.main()